@@ -0,0 +1,506 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import defaultdict, namedtuple
+from operator import attrgetter
+
+from six import integer_types
+from six.moves import range, zip
+
+from efc.rpn_builder.parser.operands import CellAddress, ErrorOperand
+from efc.utils import digit
+
+__all__ = ('AggregatePart', 'LineAggregates', 'BlockAggregates', 'get_line_aggregates', 'get_block_aggregates')
+
+BLANK_VALUES = {None, ''}
+
+# integer: sum of integer digits, it is the sum of the scan if the range has only integer digits (exact).
+# sequential: sum of digits added one by one from the first cell of the range, None if it is not known
+AggregatePart = namedtuple('AggregatePart', ('integer', 'sequential', 'exact', 'digits'))
+
+CellAggregates = namedtuple('CellAggregates', ('integer', 'value', 'is_float', 'is_digit', 'is_number', 'is_error',
+                                               'is_other'))
+
+
+ERROR_AGGREGATES = CellAggregates(0, None, 0, 0, 0, 1, 0)
+BLANK_AGGREGATES = CellAggregates(0, None, 0, 0, 0, 0, 0)
+
+
+def get_value_aggregates(value):
+    """
+    Contribution of the cell value to SUM, COUNT and AVERAGE, value is the term which the scan adds to the sum
+    :rtype: CellAggregates
+    """
+    integer = is_float = is_digit = is_other = 0
+    is_number = int(isinstance(value, (integer_types, float)))
+    try:
+        d = None if value in BLANK_VALUES else digit(value)
+    except (ValueError, TypeError):
+        d = None
+
+    if d is not None:
+        is_digit = 1
+        if isinstance(d, float):
+            is_float = 1
+        elif isinstance(d, integer_types):
+            integer = d
+        else:
+            # is not summed the same way as the scan
+            is_other = 1
+        d = d or 0
+    return CellAggregates(integer, d, is_float, is_digit, is_number, 0, is_other)
+
+
+class PrefixSums(object):
+    """
+    Prefix sums of a contiguous run of line positions, prefixes have the leading zero.
+    Sums of floats depend on the order of terms, so they are kept as sequential sums from the start of the run.
+    """
+
+    def __init__(self, start):
+        self.start = start
+        self.integers = [0]
+        self.floats = [0]
+        self.digits = [0]
+        self.numbers = [0]
+        self.errors = [0]
+        self.others = [0]
+        # terms of the sum by positions, None for cells which are not digits
+        self.values = []
+        # sums of terms added one by one like the scan does, None after a term which the scan can not add
+        self.sequential = [0]
+
+    @property
+    def end(self):
+        return self.start + len(self.integers) - 2
+
+    def _prefixes(self):
+        return (self.integers, self.floats, self.digits, self.numbers, self.errors, self.others)
+
+    def truncate(self, position):
+        """Remove prefixes from the position"""
+        size = max(position - self.start, 0) + 1
+        for prefixes in self._prefixes() + (self.sequential,):
+            del prefixes[size:]
+        del self.values[size - 1:]
+
+    def _append_value(self, value, is_other):
+        self.values.append(value)
+        sequential = self.sequential[-1]
+        if sequential is not None and value is not None:
+            sequential = None if is_other else sequential + value
+        self.sequential.append(sequential)
+
+    def append(self, aggregates):
+        """
+        Add the next position
+        :type aggregates: CellAggregates
+        """
+        integer, value, is_float, is_digit, is_number, is_error, is_other = aggregates
+        self.integers.append(self.integers[-1] + integer)
+        self.floats.append(self.floats[-1] + is_float)
+        self.digits.append(self.digits[-1] + is_digit)
+        self.numbers.append(self.numbers[-1] + is_number)
+        self.errors.append(self.errors[-1] + is_error)
+        self.others.append(self.others[-1] + is_other)
+        self._append_value(value, is_other)
+
+    def append_run(self, run):
+        """
+        Add positions of the run which starts next to the end of this run, cells are not read again
+        :type run: PrefixSums
+        """
+        for prefixes, run_prefixes in zip(self._prefixes(), run._prefixes()):
+            delta = prefixes[-1]
+            prefixes.extend([delta + v for v in run_prefixes[1:]])
+        # sequential sums of the run start from its own start, so they are added again
+        for idx, value in enumerate(run.values, 1):
+            self._append_value(value, run.others[idx] != run.others[idx - 1])
+
+    def get_slice(self, start, end):
+        """Prefix indexes of the range, None if the scan of the range raises an error"""
+        i, j = start - self.start, end - self.start + 1
+        if self.errors[j] != self.errors[i]:
+            return None
+        return i, j
+
+
+class LineAggregates(object):
+    """
+    Prefix sums of a worksheet column or row for SUM, COUNT and AVERAGE of contiguous ranges.
+    Prefixes are kept for runs of positions covered by ranges, runs are joined when ranges overlap or touch,
+    so only cells of the ranges are calculated.
+    """
+
+    def __init__(self, source, ws_name, is_row, index):
+        self._source = source
+        self._ws_name = ws_name
+        self._is_row = is_row
+        self._index = index
+        self._bounds = None
+        # disjoint runs ordered by start positions
+        self._runs = []
+
+    def truncate(self, position):
+        """Remove prefixes from the position, runs after the position do not depend on the cell"""
+        self._bounds = None
+        for run in self._runs:
+            if run.start <= position <= run.end:
+                run.truncate(position)
+        self._runs = [run for run in self._runs if run.end >= run.start]
+
+    def _get_bounds(self):
+        """
+        Positions of the line in the sheet, the range has blank operands outside of them.
+        Bounds are kept until a cell of the line is changed, other cells can not add values to the line.
+        """
+        if self._bounds is None:
+            source, ws_name = self._source, self._ws_name
+            if self._is_row:
+                in_sheet = source._min_row(ws_name) <= self._index <= source._max_row(ws_name)
+                self._bounds = source._min_column(ws_name), source._max_column(ws_name), in_sheet
+            else:
+                in_sheet = source._min_column(ws_name) <= self._index <= source._max_column(ws_name)
+                self._bounds = source._min_row(ws_name), source._max_row(ws_name), in_sheet
+        return self._bounds
+
+    def _get_populated(self, first, last):
+        """
+        Infos of populated cells of the line from the first to the last position
+        :rtype: dict[int, CellInfo]
+        """
+        source, ws_name, index = self._source, self._ws_name, self._index
+        if self._is_row:
+            return {column: info for _, column, info in source._iter_range_cells(ws_name, index, first, index, last)}
+        return {row: info for row, _, info in source._iter_range_cells(ws_name, first, index, last, index)}
+
+    def _get_cell_aggregates(self, position, cell_info):
+        if cell_info.formula is None:
+            return get_value_aggregates(cell_info.value)
+
+        if self._is_row:
+            cell_addr = CellAddress(self._ws_name, self._index, position, False, False)
+        else:
+            cell_addr = CellAddress(self._ws_name, position, self._index, False, False)
+        try:
+            value = self._source._cell_info_to_value(cell_addr, cell_info)[0]
+        except ErrorOperand:
+            return ERROR_AGGREGATES
+        return get_value_aggregates(value)
+
+    def _extend(self, run, end):
+        """Add cells of the line after the end of the run up to the end"""
+        min_position, max_position, in_sheet = self._get_bounds()
+        start = run.end + 1
+        first, last = max(start, min_position), min(end, max_position)
+        populated = self._get_populated(first, last) if in_sheet and first <= last else {}
+
+        for position in range(start, end + 1):
+            if position in populated:
+                run.append(self._get_cell_aggregates(position, populated[position]))
+            else:
+                run.append(BLANK_AGGREGATES)
+
+    def _get_run(self, start, end):
+        """
+        Run with prefixes of the range. Runs which overlap or touch the range are joined into one run,
+        only positions of the range which are not in runs are read.
+        :rtype: PrefixSums
+        """
+        runs = [run for run in self._runs if run.start <= end + 1 and run.end >= start - 1]
+        if len(runs) == 1 and runs[0].start <= start and runs[0].end >= end:
+            return runs[0]
+
+        if runs and runs[0].start <= start:
+            result, joined = runs[0], runs[1:]
+        else:
+            result, joined = PrefixSums(start), runs
+        for run in joined:
+            if run.start > result.end + 1:
+                self._extend(result, run.start - 1)
+            result.append_run(run)
+        if end > result.end:
+            self._extend(result, end)
+
+        self._runs = sorted([run for run in self._runs if run not in runs] + [result], key=attrgetter('start'))
+        return result
+
+    def get_count(self, start, end):
+        """
+        Count of numbers in the range
+        :rtype: int | None
+        """
+        run = self._get_run(start, end)
+        indexes = run.get_slice(start, end)
+        if indexes is None:
+            return None
+        i, j = indexes
+        return run.numbers[j] - run.numbers[i]
+
+    def get_part(self, start, end):
+        """
+        Sums of digits of the range, the sequential sum is known for ranges from the start of the run
+        :rtype: AggregatePart | None
+        """
+        run = self._get_run(start, end)
+        indexes = run.get_slice(start, end)
+        if indexes is None:
+            return None
+        i, j = indexes
+        exact = run.floats[j] == run.floats[i] and run.others[j] == run.others[i]
+        return AggregatePart(run.integers[j] - run.integers[i], run.sequential[j] if i == 0 else None, exact,
+                             run.digits[j] - run.digits[i])
+
+
+class SummedAreaTable(object):
+    """
+    Summed-area table of a worksheet block for SUM, COUNT and AVERAGE of rectangular ranges.
+    Only values of cells are read, ranges with formula cells are not answered by the table,
+    so the table never calculates formulas outside of ranges.
+    Rows from the changed cell are built again on the next use.
+    """
+    # counts are packed into one int, every count takes COUNT_BITS bits
+    COUNT_BITS = 40
+    FLOATS, DIGITS, NUMBERS, ERRORS, OTHERS, FORMULAS = range(6)
+
+    def __init__(self, source, ws_name):
+        self._source = source
+        self._ws_name = ws_name
+        # area of ranges which the table was built for
+        self.queried = 0
+        self._reset(None, None)
+
+    def _reset(self, row, column):
+        self._row = row
+        self._column = column
+        self._columns = 0
+        self._bounds = None
+        # tables with the leading zero row and column
+        self._integers = [[0]]
+        self._counts = [[0]]
+
+    @property
+    def rect(self):
+        """Rows and columns of built entries of the table, None if the table is not built"""
+        if self._row is None:
+            return None
+        return self._row, self._column, self._row + len(self._integers) - 2, self._column + self._columns - 1
+
+    def truncate(self, row, column):
+        """Remove rows of the table from the row of the cell, cells outside of the table do not change it"""
+        if self._row is not None and row >= self._row and self._column <= column < self._column + self._columns:
+            size = row - self._row + 1
+            for table in (self._integers, self._counts):
+                del table[size:]
+        self._bounds = None
+
+    def _get_bounds(self):
+        if self._bounds is None:
+            source, ws_name = self._source, self._ws_name
+            self._bounds = (source._min_row(ws_name), source._max_row(ws_name),
+                            source._min_column(ws_name), source._max_column(ws_name))
+        return self._bounds
+
+    def _get_cell_aggregates(self, info):
+        """Integer sum and packed counts of the cell, info is None outside of the worksheet"""
+        if info is None:
+            return 0, 0
+        if info.formula is not None:
+            return 0, 1 << (self.FORMULAS * self.COUNT_BITS)
+
+        aggregates = get_value_aggregates(info.value)
+        bits = self.COUNT_BITS
+        counts = (aggregates.is_float | aggregates.is_digit << (self.DIGITS * bits) |
+                  aggregates.is_number << (self.NUMBERS * bits) | aggregates.is_error << (self.ERRORS * bits) |
+                  aggregates.is_other << (self.OTHERS * bits))
+        return aggregates.integer, counts
+
+    def _get_populated(self, row1, column1, row2, column2):
+        """
+        Infos of populated cells of the rectangle inside of the worksheet
+        :rtype: dict[int, dict[int, CellInfo]]
+        :return: {row: {column: info}}
+        """
+        min_row, max_row, min_column, max_column = self._get_bounds()
+        row1, row2 = max(row1, min_row), min(row2, max_row)
+        column1, column2 = max(column1, min_column), min(column2, max_column)
+        populated = defaultdict(dict)
+        if row1 <= row2 and column1 <= column2:
+            for row, column, info in self._source._iter_range_cells(self._ws_name, row1, column1, row2, column2):
+                populated[row][column] = info
+        return populated
+
+    def _fill_blanks(self, idx, columns):
+        """Add entries of blank cells of the table row up to the columns"""
+        for table in (self._integers, self._counts):
+            table_row, prev_row = table[idx], table[idx - 1]
+            start = len(table_row)
+            # blank cells add nothing, so entries differ from entries of the previous row by the same value
+            delta = table_row[-1] - prev_row[start - 1]
+            table_row.extend([v + delta for v in prev_row[start:columns + 1]] if delta else prev_row[start:columns + 1])
+
+    def _fill_row(self, idx, columns, infos):
+        """
+        Add entries of the table row up to the columns
+        :param infos: infos of populated cells of new entries by columns
+        """
+        if idx == 0:
+            for table_row in (self._integers[idx], self._counts[idx]):
+                table_row.extend([0] * (columns + 1 - len(table_row)))
+            return
+
+        for column in sorted(infos):
+            j = column - self._column + 1
+            self._fill_blanks(idx, j - 1)
+
+            integer, cell_counts = self._get_cell_aggregates(infos[column])
+            integers, counts = self._integers[idx], self._counts[idx]
+            prev_integers, prev_counts = self._integers[idx - 1], self._counts[idx - 1]
+
+            # value of the previous row plus the sum of the row up to the column
+            integers.append(prev_integers[j] + integers[j - 1] - prev_integers[j - 1] + integer)
+            counts.append(prev_counts[j] + counts[j - 1] - prev_counts[j - 1] + cell_counts)
+        self._fill_blanks(idx, columns)
+
+    def _extend(self, row2, column2):
+        rows = row2 - self._row + 1
+        columns = max(column2 - self._column + 1, self._columns)
+        if columns > self._columns:
+            filled = len(self._integers) - 1
+            populated = self._get_populated(self._row, self._column + self._columns, self._row + filled - 1,
+                                            self._column + columns - 1)
+            for idx in range(filled + 1):
+                self._fill_row(idx, columns, populated.get(self._row + idx - 1, {}))
+            self._columns = columns
+
+        populated = self._get_populated(self._row + len(self._integers) - 1, self._column, row2,
+                                        self._column + columns - 1)
+        for idx in range(len(self._integers), rows + 1):
+            for table in (self._integers, self._counts):
+                table.append([0])
+            self._fill_row(idx, columns, populated.get(self._row + idx - 1, {}))
+
+    def _get_rect(self, table, row1, column1, row2, column2):
+        i1, j1 = row1 - self._row, column1 - self._column
+        i2, j2 = row2 - self._row + 1, column2 - self._column + 1
+        return table[i2][j2] - table[i1][j2] - table[i2][j1] + table[i1][j1]
+
+    def _get_counts(self, row1, column1, row2, column2):
+        """Counts of the range, None if the range has errors or formulas"""
+        if self._row is None or row1 < self._row or column1 < self._column:
+            row = row1 if self._row is None else min(row1, self._row)
+            column = column1 if self._column is None else min(column1, self._column)
+            columns = 0 if self._column is None else self._column + self._columns - column
+            rows = 0 if self._row is None else self._row + len(self._integers) - 1 - row
+            self._reset(row, column)
+            # keep the previous block in the table
+            self._extend(max(row2, row + rows - 1), max(column2, column + columns - 1))
+        else:
+            self._extend(row2, column2)
+
+        packed = self._get_rect(self._counts, row1, column1, row2, column2)
+        mask = (1 << self.COUNT_BITS) - 1
+        counts = [(packed >> (field * self.COUNT_BITS)) & mask for field in range(6)]
+        if counts[self.ERRORS] or counts[self.FORMULAS]:
+            return None
+        return counts
+
+    def get_count(self, row1, column1, row2, column2):
+        """
+        Count of numbers in the range
+        :rtype: int | None
+        """
+        counts = self._get_counts(row1, column1, row2, column2)
+        return None if counts is None else counts[self.NUMBERS]
+
+    def get_part(self, row1, column1, row2, column2):
+        """
+        Sums of digits of the range. Rows of the table are not summed in order of the scan,
+        so only integer sums are known.
+        :rtype: AggregatePart | None
+        """
+        counts = self._get_counts(row1, column1, row2, column2)
+        if counts is None:
+            return None
+        return AggregatePart(self._get_rect(self._integers, row1, column1, row2, column2), None,
+                             not counts[self.FLOATS] and not counts[self.OTHERS], counts[self.DIGITS])
+
+
+class BlockAggregates(object):
+    """
+    Summed-area tables of blocks of a worksheet. A range is answered by the table which contains it or grows
+    the table while the table stays dense: its area is at most SPARSITY times the area of ranges it was built for.
+    Ranges far from tables get their own tables, ranges which overlap tables but can not join them are scanned.
+    """
+    SPARSITY = 2
+    MAX_TABLES = 16
+
+    def __init__(self, source, ws_name):
+        self._source = source
+        self._ws_name = ws_name
+        self._tables = []
+
+    def truncate(self, row, column):
+        for table in self._tables:
+            table.truncate(row, column)
+
+    def _get_table(self, row1, column1, row2, column2):
+        """
+        Table for the range, None if the range is scanned
+        :rtype: SummedAreaTable | None
+        """
+        area = (row2 - row1 + 1) * (column2 - column1 + 1)
+        overlaps = False
+        for table in self._tables:
+            t_row1, t_column1, t_row2, t_column2 = table.rect
+            if t_row1 <= row1 and t_column1 <= column1 and row2 <= t_row2 and column2 <= t_column2:
+                return table
+
+            box = ((max(row2, t_row2) - min(row1, t_row1) + 1) *
+                   (max(column2, t_column2) - min(column1, t_column1) + 1))
+            if box <= self.SPARSITY * (table.queried + area):
+                table.queried = min(table.queried + area, box)
+                return table
+            overlaps = overlaps or (row1 <= t_row2 and t_row1 <= row2 and column1 <= t_column2 and t_column1 <= column2)
+
+        if overlaps or len(self._tables) >= self.MAX_TABLES:
+            return None
+        table = SummedAreaTable(self._source, self._ws_name)
+        table.queried = area
+        self._tables.append(table)
+        return table
+
+    def get_count(self, row1, column1, row2, column2):
+        """
+        Count of numbers in the range
+        :rtype: int | None
+        """
+        table = self._get_table(row1, column1, row2, column2)
+        return None if table is None else table.get_count(row1, column1, row2, column2)
+
+    def get_part(self, row1, column1, row2, column2):
+        """
+        Sums of digits of the range
+        :rtype: AggregatePart | None
+        """
+        table = self._get_table(row1, column1, row2, column2)
+        return None if table is None else table.get_part(row1, column1, row2, column2)
+
+
+def get_line_aggregates(source, ws_name, is_row, index):
+    """:rtype: LineAggregates"""
+    cache = source._caches['aggregates']
+    key = (ws_name, is_row, index)
+    aggregates = cache.get(key)
+    if aggregates is None:
+        aggregates = cache[key] = LineAggregates(source, ws_name, is_row, index)
+    return aggregates
+
+
+def get_block_aggregates(source, ws_name):
+    """:rtype: BlockAggregates"""
+    cache = source._caches['blocks']
+    aggregates = cache.get(ws_name)
+    if aggregates is None:
+        aggregates = cache[ws_name] = BlockAggregates(source, ws_name)
+    return aggregates
@@ -2,14 +2,32 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 from abc import ABCMeta, abstractmethod
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, defaultdict, deque
 from functools import partial
+from itertools import chain
 
-from six import add_metaclass
+from six import add_metaclass, iteritems
+from six.moves import range
 
-from efc import Lexer, Parser
-from efc.interfaces.cache import CacheManager
-from efc.interfaces.errors import NamedRangeNotFound
-from efc.rpn_builder.parser.operands import CellAddress, HyperlinkOperand, RPNOperand, SingleCellOperand
+from efc import RPN, Lexer, Parser
+from efc.base.errors import BaseEFCException
+from efc.interfaces.cache import CacheManager, RPNCache
+from efc.interfaces.dependencies import DependencyGraph
+from efc.interfaces.errors import CircularReference, NamedRangeNotFound
+from efc.rpn_builder.lexer.tokens import NamedRangeToken
+from efc.rpn_builder.parser.operands import (CellAddress, ErrorOperand, HyperlinkOperand, RPNOperand,
+                                             SingleCellOperand)
+from efc.utils import col_index_to_str
+
+
+class CellCalculationDeferred(Exception):
+    """Cell is too deep in the chain of formulas, it will be calculated from the work stack"""
+
+    def __init__(self, cell_addr, cell_info):
+        super(CellCalculationDeferred, self).__init__(cell_addr)
+        self.cell_addr = cell_addr
+        self.cell_info = cell_info
 
 
 class CellInfo:
@@ -18,21 +36,151 @@ class CellInfo:
         self.formula = formula
 
 
+class SheetDimensions(object):
+    """Bounds of used cells of a worksheet, a worksheet without cells has bounds of the first cell"""
+
+    def __init__(self, cells=()):
+        """
+        :param cells: rows and columns of used cells
+        """
+        self.min_row = self.max_row = self.min_column = self.max_column = None
+        rows, columns = set(), set()
+        for row, column in cells:
+            rows.add(row)
+            columns.add(column)
+        if rows:
+            self.min_row, self.max_row = min(rows), max(rows)
+            self.min_column, self.max_column = min(columns), max(columns)
+
+    def add(self, row, column):
+        if self.min_row is None:
+            self.min_row = self.max_row = row
+            self.min_column = self.max_column = column
+        else:
+            self.min_row, self.max_row = min(self.min_row, row), max(self.max_row, row)
+            self.min_column, self.max_column = min(self.min_column, column), max(self.max_column, column)
+
+    @property
+    def bounds(self):
+        """
+        :rtype: (int, int, int, int)
+        :return: min row, max row, min column and max column
+        """
+        if self.min_row is None:
+            return 1, 1, 1, 1
+        return self.min_row, self.max_row, self.min_column, self.max_column
+
+
+class UsedRange(object):
+    """Last used row of every column and last used column of every row of a worksheet"""
+
+    def __init__(self, cells=()):
+        """
+        :param cells: rows and columns of used cells
+        """
+        self._rows = {}
+        self._columns = {}
+        for row, column in cells:
+            self.add(row, column)
+
+    def add(self, row, column):
+        if row > self._rows.get(column, 0):
+            self._rows[column] = row
+        if column > self._columns.get(row, 0):
+            self._columns[row] = column
+
+    @staticmethod
+    def _get_last(lasts, first, last):
+        if last - first < len(lasts):
+            return max([lasts.get(i, 0) for i in range(first, last + 1)] or [0])
+        return max([v for k, v in iteritems(lasts) if first <= k <= last] or [0])
+
+    def max_row(self, column1, column2):
+        """Last used row of the columns, 0 if the columns are empty"""
+        return self._get_last(self._rows, column1, column2)
+
+    def max_column(self, row1, row2):
+        """Last used column of the rows, 0 if the rows are empty"""
+        return self._get_last(self._columns, row1, row2)
+
+
 @add_metaclass(ABCMeta)
 class BaseExcelInterface(object):
     """
     Base class to working with excel document
     """
 
-    def __init__(self, use_cache=False, lexer=Lexer, parser=Parser):
+    def __init__(self, use_cache=False, lexer=Lexer, parser=Parser, rpn_cache_size=1024, max_depth=None,
+                 block_aggregates=False):
+        """
+        :param rpn_cache_size: max count of compiled formulas and formula templates to keep,
+            None - unlimited, 0 - disable cache
+        :param max_depth: max count of nested formula cells calculated by recursion. Deeper cells are
+            calculated by the work stack, so chains of formulas of any length can be calculated.
+            None - use recursion only
+        :param block_aggregates: use summed-area tables for SUM, COUNT and AVERAGE of rectangular ranges,
+            it pays off when many ranges overlap. Works with use_cache=True
+        """
         self._cache_manager = CacheManager() if use_cache else None
+        self._block_aggregates = block_aggregates
+        self._dependencies = DependencyGraph() if use_cache else None
+        self._max_depth = max_depth
+        self._depth = None
+        self._deferred_rpns = None
+        self._rpn_cache = RPNCache(rpn_cache_size) if rpn_cache_size != 0 else None
+        self._template_cache = RPNCache(rpn_cache_size) if rpn_cache_size != 0 else None
 
         self.lexer = lexer()
         self.parser = parser()
 
-    def _build_rpn(self, formula, ws_name=None):
+    def _build_rpn(self, formula, ws_name=None, cell_addr=None):
+        """
+        :type formula: str
+        :type ws_name: str
+        :param cell_addr: cell with the formula, it allows to reuse RPN of formulas filled down or right
+        :type cell_addr: CellAddress
+        """
+        if self._rpn_cache is None:
+            tokens_line = self.lexer.parse(formula)
+            return self.parser.to_rpn(tokens_line, ws_name=ws_name, source=self)
+
+        key = (formula, ws_name)
+        cached = self._rpn_cache.get(key)
+        if isinstance(cached, RPN):
+            # Operands cache calculated values, so every call gets its own copy of them
+            return cached.offset()
+        elif cached is not None:
+            cached.reset()
+            return self.parser.to_rpn(cached, ws_name=ws_name, source=self)
+
         tokens_line = self.lexer.parse(formula)
-        return self.parser.to_rpn(tokens_line, ws_name=ws_name, source=self)
+        if any(isinstance(token, NamedRangeToken) for token in tokens_line):
+            # Named ranges are resolved to their values while parsing, so only tokens can be reused
+            self._rpn_cache[key] = tokens_line
+            return self.parser.to_rpn(tokens_line, ws_name=ws_name, source=self)
+
+        if cell_addr is None:
+            rpn = self.parser.to_rpn(tokens_line, ws_name=ws_name, source=self)
+        else:
+            template_key = (tokens_line.relative_key(cell_addr.row, cell_addr.column), ws_name)
+            template = self._template_cache.get(template_key)
+            if template is None:
+                template = self._template_cache[template_key] = self.parser.to_template(
+                    tokens_line, ws_name, self, cell_addr.row, cell_addr.column
+                )
+                rpn = template.rpn
+            else:
+                rpn = template.bind(cell_addr.row, cell_addr.column)
+
+        self._rpn_cache[key] = rpn
+        return rpn
+
+    def rpn_cache_info(self):
+        """
+        Statistics of compiled formulas cache
+        :rtype: RPNCacheInfo | None
+        """
+        return self._rpn_cache.info() if self._rpn_cache is not None else None
 
     def _calc_formula(self, formula, ws_name=None):
         """
@@ -50,6 +198,19 @@ class BaseExcelInterface(object):
     def clear_cache(self):
         """Clear all caches"""
         self._caches.clear()
+        self._dependencies.clear()
+
+    def _reset_cell(self, cell_addr):
+        """
+        Remove calculated values of the changed cell and all cells which depend on it
+        :type cell_addr: CellAddress
+        """
+        if not self._caches:
+            return
+
+        self._caches.remove_cell(cell_addr.ws_name, cell_addr.row, cell_addr.column)
+        for dependent in self._dependencies.pop_dependents(cell_addr):
+            self._caches.remove_cell(dependent.ws_name, dependent.row, dependent.column)
 
     def _get_cell_formula_hyperlink(self, address):
         """
@@ -62,7 +223,7 @@ class BaseExcelInterface(object):
             return v[1].link if isinstance(v[1], HyperlinkOperand) else None
         else:
             self._cell_to_value(address)
-            return self._caches['hyperlinks'].get(address)
+            return self._caches['hyperlinks'].get(self._cell_cache_key(address))
 
     @abstractmethod
     def _get_cell_info(self, address):
@@ -72,42 +233,121 @@ class BaseExcelInterface(object):
         """
         pass
 
+    def _get_range_values(self, ws_name, row1, column1, row2, column2):
+        """
+        Cells of the rectangle by rows. Backends can override it to read the block by one query,
+        by default every cell is read by _get_cell_info.
+        :type ws_name: basestring
+        :rtype: list[list[CellInfo]]
+        """
+        get_cell_info = self._get_cell_info
+        return [[get_cell_info(CellAddress(ws_name, row, column, False, False))
+                 for column in range(column1, column2 + 1)]
+                for row in range(row1, row2 + 1)]
+
+    def _iter_range_cells(self, ws_name, row1, column1, row2, column2):
+        """
+        Populated cells of the rectangle in order of rows, blank cells without formulas are skipped.
+        Backends which know populated cells can override it, so empty parts of large ranges are not read.
+        :type ws_name: basestring
+        :rtype: collections.Iterable[(int, int, CellInfo)]
+        """
+        for row, infos in enumerate(self._get_range_values(ws_name, row1, column1, row2, column2), row1):
+            for column, info in enumerate(infos, column1):
+                if info.value is not None or info.formula is not None:
+                    yield row, column, info
+
     def _calc_extended_value(self, cell_addr, cell_info):
         """
         :type cell_addr: CellAddress
         :type cell_info: CellInfo
         """
         last_cell_address = cell_addr
-        calc = partial(self._build_rpn(cell_info.formula, cell_addr.ws_name).calc, cell_addr.ws_name, self)
-        while True:
-            partial_result = calc()
-            if isinstance(partial_result, SingleCellOperand):
-                value, last_cell_address = self._cell_to_value(partial_result.cell_address)
-                break
-            elif isinstance(partial_result, RPNOperand):
-                calc = partial(partial_result.rpn.calc,
-                               ws_name=partial_result.ws_name,
-                               source=partial_result.source)
-            else:
-                value = partial_result.value
-                break
+        rpn = None
+        if self._deferred_rpns:
+            rpn = self._deferred_rpns.pop(self._cell_cache_key(cell_addr), None)
+        if rpn is None:
+            rpn = self._build_rpn(cell_info.formula, cell_addr.ws_name, cell_addr)
+
+        dependencies = self._dependencies
+        if dependencies is not None:
+            dependencies.add_rpn(rpn, self._cell_cache_key(cell_addr))
+            for named_range_rpn in self._iter_named_range_rpns(rpn):
+                dependencies.add_rpn(named_range_rpn, self._cell_cache_key(cell_addr))
+
+        calc = partial(rpn.calc, cell_addr.ws_name, self)
+        try:
+            while True:
+                partial_result = calc()
+                if isinstance(partial_result, SingleCellOperand):
+                    if dependencies is not None:
+                        # the cell can be built while calculating, e.g. by OFFSET
+                        dependencies.add_cell(partial_result, self._cell_cache_key(cell_addr))
+                    value, last_cell_address = self._cell_to_value(partial_result.cell_address)
+                    break
+                elif isinstance(partial_result, RPNOperand):
+                    calc = partial(partial_result.rpn.calc,
+                                   ws_name=partial_result.ws_name,
+                                   source=partial_result.source)
+                else:
+                    value = partial_result.value
+                    break
+        except CellCalculationDeferred:
+            # the formula will be calculated again when the deferred cell is calculated
+            self._deferred_rpns[self._cell_cache_key(cell_addr)] = rpn
+            raise
         return value, partial_result, last_cell_address
     
+    def _iter_named_range_rpns(self, rpn):
+        """
+        RPN of named ranges used by the formula and by other named ranges. Named ranges are replaced
+        by their values while parsing, so cells used by them are known only from their formulas.
+        :type rpn: RPN
+        :rtype: collections.Iterable[RPN]
+        """
+        seen = set()
+        queue = list(rpn.named_ranges)
+        while queue:
+            named_range = queue.pop()
+            if named_range in seen:
+                continue
+            seen.add(named_range)
+
+            name, ws_name = named_range
+            try:
+                named_range_rpn = self._build_rpn(self._get_named_range_formula(name, ws_name), ws_name)
+            except BaseEFCException:
+                continue
+            yield named_range_rpn
+            queue.extend(named_range_rpn.named_ranges)
+
+    @staticmethod
+    def _cell_cache_key(cell_addr):
+        """
+        $A$1 and A1 are the same cell, so they share cached value
+        :type cell_addr: CellAddress
+        """
+        if cell_addr.row_fixed or cell_addr.column_fixed:
+            return CellAddress(cell_addr.ws_name, cell_addr.row, cell_addr.column, False, False)
+        return cell_addr
+
     def _store_to_cache(self, cell_addr, value, partial_result, last_cell_address):
+        cell_addr = self._cell_cache_key(cell_addr)
         if isinstance(partial_result, HyperlinkOperand):
             self._caches['hyperlinks'][cell_addr] = partial_result.link
         self._caches['cells'][cell_addr] = (value, last_cell_address)
-        
+
     def _get_or_calc_extended_value(self, cell_addr, cell_info):
         """
         :type cell_addr: CellAddress
         :type cell_info: CellInfo
         """
         if self._caches:
-            if cell_addr not in self._caches['cells']:
+            key = self._cell_cache_key(cell_addr)
+            if key not in self._caches['cells']:
                 v, pr, lca = self._calc_extended_value(cell_addr, cell_info)
-                self._store_to_cache(cell_addr, v, pr, lca)
-            return self._caches['cells'][cell_addr]
+                self._store_to_cache(key, v, pr, lca)
+            return self._caches['cells'][key]
         else:
             v, _, lca = self._calc_extended_value(cell_addr, cell_info)
             return v, lca
@@ -116,12 +356,242 @@ class BaseExcelInterface(object):
         """
         rtype: tuple[Any, CellAddress]
         """
-        cell_info = self._get_cell_info(cell_addr)  # type: CellInfo
+        return self._cell_info_to_value(cell_addr, self._get_cell_info(cell_addr))
 
+    def _cell_info_to_value(self, cell_addr, cell_info):
+        """
+        Value of the cell which info is already read
+        :type cell_addr: CellAddress
+        :type cell_info: CellInfo
+        rtype: tuple[Any, CellAddress]
+        """
         if cell_info.formula is None:
             return cell_info.value, cell_addr
-        else:
+        elif self._max_depth is None:
             return self._get_or_calc_extended_value(cell_addr, cell_info)
+        elif self._depth is None:
+            return self._calc_with_stack(cell_addr, cell_info)
+        elif self._depth >= self._max_depth and self._cell_cache_key(cell_addr) not in self._caches['cells']:
+            raise CellCalculationDeferred(cell_addr, cell_info)
+        else:
+            self._depth += 1
+            try:
+                return self._get_or_calc_extended_value(cell_addr, cell_info)
+            finally:
+                self._depth -= 1
+
+    def _calc_with_stack(self, cell_addr, cell_info):
+        """
+        Calculate the cell with a work stack instead of recursion.
+        Cells deeper than max_depth are pushed to the stack together with formula cells they use,
+        so the chain of formulas is calculated from the end.
+        :type cell_addr: CellAddress
+        :type cell_info: CellInfo
+        """
+        cache_manager = self._cache_manager
+        if cache_manager is None:
+            # calculated cells should be kept until the calculation is finished
+            self._cache_manager = CacheManager()
+        cells_cache = self._caches['cells']
+
+        self._depth = 0
+        self._deferred_rpns = {}
+        stack = [(cell_addr, cell_info, False)]
+        # cells of the chain which is calculated now: the top of the stack and cells which wait for it.
+        # Other cells of the stack are pending precedents, they are not a part of the chain
+        visiting = set()
+        try:
+            while True:
+                cell_addr, cell_info, expand = stack[-1]
+                cell_key = self._cell_cache_key(cell_addr)
+                visiting.add(cell_key)
+                if expand:
+                    stack[-1] = (cell_addr, cell_info, False)
+                    rpn = self._deferred_rpns.get(cell_key)
+                    if rpn is None:
+                        rpn = self._deferred_rpns[cell_key] = self._build_rpn(cell_info.formula, cell_addr.ws_name,
+                                                                              cell_addr)
+                    pushed = set()
+                    for reference in rpn.iter_references():
+                        if not isinstance(reference, SingleCellOperand):
+                            continue
+                        key = self._cell_cache_key(reference.cell_address)
+                        if key in visiting or key in pushed or key in cells_cache:
+                            continue
+                        reference_info = self._get_cell_info(key)
+                        if reference_info.formula is not None:
+                            pushed.add(key)
+                            stack.append((key, reference_info, True))
+                    continue
+
+                try:
+                    result = self._get_or_calc_extended_value(cell_addr, cell_info)
+                except CellCalculationDeferred as err:
+                    key = self._cell_cache_key(err.cell_addr)
+                    if key in visiting:
+                        raise CircularReference(key.ws_name, key.row, key.column)
+                    stack.append((err.cell_addr, err.cell_info, True))
+                else:
+                    stack.pop()
+                    visiting.discard(cell_key)
+                    if not stack:
+                        return result
+        finally:
+            self._depth = None
+            self._deferred_rpns = None
+            self._cache_manager = cache_manager
+
+    @abstractmethod
+    def _worksheet_names(self):
+        """
+        Names of worksheets in order of the workbook
+        :rtype: list[basestring]
+        """
+        pass
+
+    def _iter_formula_cells(self, ws_name):
+        """
+        Formula cells of the worksheet by rows. By default cells in bounds of the worksheet are read
+        by _iter_range_cells, backends which know formula cells can override it.
+        :type ws_name: basestring
+        :rtype: collections.Iterable[CellAddress]
+        """
+        cells = self._iter_range_cells(ws_name, self._min_row(ws_name), self._min_column(ws_name),
+                                       self._max_row(ws_name), self._max_column(ws_name))
+        for row, column, info in cells:
+            if info.formula is not None:
+                yield CellAddress(ws_name, row, column, False, False)
+
+    def _cell_precedents(self, cell_addr, formula_cells):
+        """
+        Formula cells used by the cell formula
+        :type cell_addr: CellAddress
+        :param formula_cells: {ws_name: {column: sorted rows of formula cells}}
+        :rtype: set[CellAddress]
+        """
+        formula = self._get_cell_info(cell_addr).formula
+        if formula is None:
+            return set()
+
+        try:
+            rpn = self._build_rpn(formula, cell_addr.ws_name, cell_addr)
+        except BaseEFCException:
+            # the formula will raise the error while calculating
+            return set()
+
+        references = chain(rpn.iter_references(),
+                           *(named_range_rpn.iter_references() for named_range_rpn in self._iter_named_range_rpns(rpn)))
+        precedents = set()
+        for reference in references:
+            columns = formula_cells.get(reference.ws_name)
+            if not columns:
+                continue
+
+            if isinstance(reference, SingleCellOperand):
+                row1 = row2 = reference.row
+                column1 = column2 = reference.column
+            else:
+                row1, row2 = reference.row1, reference.row2
+                column1, column2 = reference.column1, reference.column2
+
+            if column1 is None:
+                used_columns = columns.items()
+            elif column1 == column2:
+                used_columns = [(column1, columns[column1])] if column1 in columns else []
+            else:
+                used_columns = [(c, rows) for c, rows in columns.items() if column1 <= c <= column2]
+
+            for column, rows in used_columns:
+                if row1 is None:
+                    start, end = 0, len(rows)
+                else:
+                    start, end = bisect_left(rows, row1), bisect_right(rows, row2)
+                for row in rows[start:end]:
+                    precedents.add(CellAddress(reference.ws_name, row, column, False, False))
+
+        precedents.discard(cell_addr)
+        return precedents
+
+    def _calc_cells(self, cells):
+        """
+        Calculate formula cells in order of their dependencies, so every cell is calculated
+        after formula cells it uses. Use it with enabled cache, otherwise precedents are calculated again.
+        Cells with errors, e.g. #DIV/0!, get the error operand as the value.
+        :type cells: collections.Iterable[CellAddress]
+        :rtype: OrderedDict[CellAddress, Any]
+        """
+        cells = list(OrderedDict.fromkeys(self._cell_cache_key(c) for c in cells))
+
+        formula_cells = defaultdict(lambda: defaultdict(list))
+        for cell_addr in cells:
+            formula_cells[cell_addr.ws_name][cell_addr.column].append(cell_addr.row)
+        for columns in formula_cells.values():
+            for rows in columns.values():
+                rows.sort()
+
+        dependents = defaultdict(list)
+        precedents_count = {}
+        for cell_addr in cells:
+            precedents = self._cell_precedents(cell_addr, formula_cells)
+            precedents_count[cell_addr] = len(precedents)
+            for precedent in precedents:
+                dependents[precedent].append(cell_addr)
+
+        # Kahn's algorithm
+        order = []
+        queue = deque(c for c in cells if not precedents_count[c])
+        while queue:
+            cell_addr = queue.popleft()
+            order.append(cell_addr)
+            for dependent in dependents[cell_addr]:
+                precedents_count[dependent] -= 1
+                if not precedents_count[dependent]:
+                    queue.append(dependent)
+
+        # cells with circular references
+        if len(order) < len(cells):
+            order.extend(c for c in cells if precedents_count[c] > 0)
+
+        result = OrderedDict()
+        for cell_addr in order:
+            try:
+                result[cell_addr] = self._cell_to_value(cell_addr)[0]
+            except ErrorOperand as err:
+                # errors of formulas are results of their cells, other cells are still calculated
+                result[cell_addr] = err
+        return result
+
+    def _calc_cells_by_index(self, cells):
+        """
+        Calculated values of cells by worksheets and cell indexes
+        :type cells: collections.Iterable[CellAddress]
+        :rtype: dict[basestring, dict[basestring, Any]]
+        """
+        result = {}
+        for address, value in self._calc_cells(cells).items():
+            cell_index = '%s%d' % (col_index_to_str(address.column), address.row)
+            result.setdefault(address.ws_name, {})[cell_index] = value
+        return result
+
+    def calc_sheet(self, ws_name):
+        """
+        Calculate all formulas of the worksheet in order of their dependencies.
+        Use it with use_cache=True.
+        :type ws_name: basestring
+        :rtype: dict[basestring, Any]
+        :return: {cell_index: value}
+        """
+        return self._calc_cells_by_index(self._iter_formula_cells(ws_name)).get(ws_name, {})
+
+    def calc_all(self):
+        """
+        Calculate all formulas of the workbook in order of their dependencies.
+        Use it with use_cache=True.
+        :rtype: dict[basestring, dict[basestring, Any]]
+        :return: {ws_name: {cell_index: value}}
+        """
+        return self._calc_cells_by_index(chain.from_iterable(self._iter_formula_cells(ws_name)
+                                                             for ws_name in self._worksheet_names()))
 
     @abstractmethod
     def _get_named_range_formula(self, name, ws_name):
@@ -152,6 +622,22 @@ class BaseExcelInterface(object):
     def _has_worksheet(self, ws_name):
         pass
 
+    def _max_row_in_columns(self, ws_name, column1, column2):
+        """
+        Last used row of the columns, cells of whole columns after it are blank.
+        By default it is the last row of the worksheet.
+        :rtype: int
+        """
+        return self._max_row(ws_name)
+
+    def _max_column_in_rows(self, ws_name, row1, row2):
+        """
+        Last used column of the rows, cells of whole rows after it are blank.
+        By default it is the last column of the worksheet.
+        :rtype: int
+        """
+        return self._max_column(ws_name)
+
     def _named_range_to_cells(self, name, ws_name):
         f = self._get_named_range_formula(name, ws_name)
         return self._calc_formula(f, ws_name)
@@ -2,6 +2,7 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict, namedtuple
 
 from six import add_metaclass
 
@@ -47,21 +48,60 @@ class RangeCache(BaseCache):
         for key in list(self._items):
             if ws_name == key[0]:
                 if key[1] is None:
-                    if key[2] >= column >= key[4]:
+                    if key[2] <= column <= key[4]:
                         del self._items[key]
                 elif key[2] is None:
-                    if key[1] >= row >= key[3]:
+                    if key[1] <= row <= key[3]:
                         del self._items[key]
-                elif key[1] >= row >= key[3] and key[2] >= column >= key[4]:
+                elif key[1] <= row <= key[3] and key[2] <= column <= key[4]:
                     del self._items[key]
 
 
+class LineCache(BaseCache):
+    """
+    Keys are (ws_name, is_row, index) of worksheet rows and columns,
+    items are truncated before the changed cell instead of removing.
+    """
+
+    def remove_cell(self, ws_name, row, column):
+        for key, position in (((ws_name, False, column), row), ((ws_name, True, row), column)):
+            item = self._items.get(key)
+            if item is not None:
+                item.truncate(position)
+
+
+class SheetCache(BaseCache):
+    """Keys are worksheet names, items are truncated from the changed cell instead of removing"""
+
+    def remove_cell(self, ws_name, row, column):
+        item = self._items.get(ws_name)
+        if item is not None:
+            item.truncate(row, column)
+
+
+class BoundsCache(BaseCache):
+    """
+    Keys are worksheet names, items are bounds of used cells. The changed cell can be used, so items are
+    extended by it. They are not shrunk when cells are cleared, cleared cells in bounds are blank.
+    """
+
+    def remove_cell(self, ws_name, row, column):
+        item = self._items.get(ws_name)
+        if item is not None:
+            item.add(row, column)
+
+
 class CacheManager(object):
     CACHE_TYPES = {
         'single': SingleCellCache,  # cache SingleCellOperand instances
         'cells': SingleCellCache,  # cache calculated Cells
         'range': RangeCache,  # cache CellRangeOperand instances
         'ifs': RangeCache,  # cache IFS expressions for ranges
+        'lookup': RangeCache,  # cache lookup indexes for ranges
+        'aggregates': LineCache,  # cache prefix sums of rows and columns
+        'blocks': SheetCache,  # cache summed-area tables of worksheets
+        'used_ranges': BoundsCache,  # cache last used rows and columns of worksheets
+        'dimensions': BoundsCache,  # cache bounds of used cells of worksheets
         'hyperlinks': SingleCellCache,  # cache hyperlinks for cells
     }
 
@@ -79,3 +119,51 @@ class CacheManager(object):
     def remove_cell(self, ws_name, row, column):
         for cache in self._caches.values():
             cache.remove_cell(ws_name, row, column)
+
+
+RPNCacheInfo = namedtuple('RPNCacheInfo', ('hits', 'misses', 'maxsize', 'currsize'))
+
+
+class RPNCache(object):
+    """
+    LRU cache of compiled formulas.
+    maxsize=None makes the cache unbounded.
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def get(self, key):
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+
+        # move key to the end of the queue
+        self._items[key] = value
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = value
+        if self.maxsize is not None:
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        self._items.clear()
+        self.hits = self.misses = 0
+
+    def info(self):
+        return RPNCacheInfo(self.hits, self.misses, self.maxsize, len(self._items))
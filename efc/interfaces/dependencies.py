@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import defaultdict
+
+from six import iteritems
+
+from efc.rpn_builder.parser.operands import CellAddress, CellRangeOperand, CellSetOperand, SingleCellOperand
+from efc.rpn_builder.parser.operations import FunctionOperation
+
+# Functions which build references or values while calculating, so cells with them depend on any cell.
+# Only OFFSET is supported now, others raise FunctionNotSupported until they are added to EXCEL_FUNCTIONS
+VOLATILE_FUNCTIONS = frozenset(('OFFSET', 'INDIRECT', 'NOW', 'TODAY', 'RAND', 'RANDBETWEEN', 'CELL', 'INFO'))
+
+
+def cell_key(ws_name, row, column):
+    return CellAddress(ws_name, row, column, False, False)
+
+
+class DependencyGraph(object):
+    """
+    Reverse dependencies of calculated cells
+    """
+
+    def __init__(self):
+        self._cells = defaultdict(set)  # cell -> cells which use it
+        self._ranges = defaultdict(set)  # (ws_name, row1, column1, row2, column2) -> cells which use it
+        self._volatile = set()
+
+    def clear(self):
+        self._cells.clear()
+        self._ranges.clear()
+        self._volatile.clear()
+
+    def add_cell(self, cell_addr, dependent):
+        """
+        :type cell_addr: CellAddress | SingleCellOperand
+        :type dependent: CellAddress
+        """
+        self._cells[cell_key(cell_addr.ws_name, cell_addr.row, cell_addr.column)].add(dependent)
+
+    def add_rpn(self, rpn, dependent):
+        """
+        Add cells and ranges used by the formula of the dependent cell
+        :type rpn: efc.rpn_builder.rpn.RPN
+        :type dependent: CellAddress
+        """
+        for token in rpn.iter_tokens():
+            if isinstance(token, SingleCellOperand):
+                self.add_cell(token, dependent)
+            elif isinstance(token, CellRangeOperand):
+                key = (token.ws_name, token.row1, token.column1, token.row2, token.column2)
+                self._ranges[key].add(dependent)
+            elif isinstance(token, CellSetOperand):
+                for cell in token:
+                    if isinstance(cell, SingleCellOperand):
+                        self.add_cell(cell, dependent)
+            elif isinstance(token, FunctionOperation) and token.f_name in VOLATILE_FUNCTIONS:
+                self._volatile.add(dependent)
+
+    def _range_dependents(self, cell_addr):
+        for (ws_name, row1, column1, row2, column2), dependents in iteritems(self._ranges):
+            if ws_name != cell_addr.ws_name:
+                continue
+            if row1 is not None and not row1 <= cell_addr.row <= row2:
+                continue
+            if column1 is not None and not column1 <= cell_addr.column <= column2:
+                continue
+            for dependent in dependents:
+                yield dependent
+
+    def pop_dependents(self, cell_addr):
+        """
+        Cells which use the cell directly or through other cells and volatile cells.
+        Their dependencies are removed, they will be added again when the cells are calculated.
+        :type cell_addr: CellAddress
+        :rtype: set[CellAddress]
+        """
+        dirty = set(self._volatile)
+        queue = [cell_key(cell_addr.ws_name, cell_addr.row, cell_addr.column)]
+        queue.extend(dirty)
+        while queue:
+            key = queue.pop()
+            for dependent in list(self._cells.pop(key, ())) + list(self._range_dependents(key)):
+                if dependent not in dirty:
+                    dirty.add(dependent)
+                    queue.append(dependent)
+
+        self._volatile.clear()
+        for dependents in self._ranges.values():
+            dependents -= dirty
+        return dirty
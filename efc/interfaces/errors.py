@@ -11,3 +11,21 @@ class BaseInterfaceError(BaseEFCException):
 class NamedRangeNotFound(BaseInterfaceError):
     code = 401
     msg = 'Named range not found'
+
+
+class CircularReference(BaseInterfaceError):
+    code = 402
+    msg = 'Circular reference in cell {row}:{column}'
+
+    def __init__(self, ws_name, row, column):
+        self.ws_name = ws_name
+        self.row = row
+        self.column = column
+
+
+class WorkbookPartNotFound(BaseInterfaceError):
+    code = 403
+    msg = 'Workbook part {part} not found'
+
+    def __init__(self, part):
+        self.part = part
@@ -2,9 +2,10 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 from openpyxl.utils.cell import coordinate_to_tuple
-from six import PY3
+from six import PY3, iteritems
+from six.moves import range
 
-from efc.interfaces.base import BaseExcelInterface, CellInfo
+from efc.interfaces.base import BaseExcelInterface, CellInfo, SheetDimensions, UsedRange
 from efc.interfaces.errors import NamedRangeNotFound
 from efc.rpn_builder.parser.operands import CellAddress
 from efc.utils import datetime_to_openxml, parse_date
@@ -38,17 +39,67 @@ class OpenpyxlInterface(BaseExcelInterface):
         """
         row, column = coordinate_to_tuple(cell_index)
         value, _ = self._cell_to_value(CellAddress(ws_name, row, column, False, False))
-        cell = self.wb[ws_name]._get_cell(row, column)
+        cell = self._get_cell(ws_name, row, column)
         return self._deserialize_value(value, cell.data_type)
 
-    def _get_cell_info(self, address):
-        cell = self.wb[address.ws_name]._get_cell(address.row, address.column)
-        value = cell.value
+    def set_cell_value(self, cell_index, ws_name, value):
+        """
+        Set the cell value. Calculated values of cells which depend on the cell are removed from the cache,
+        other cells are not calculated again.
+        :type cell_index: basestring
+        :type ws_name: basestring
+        """
+        row, column = coordinate_to_tuple(cell_index)
+        self.wb[ws_name].cell(row=row, column=column).value = value
+        self._reset_cell(CellAddress(ws_name, row, column, False, False))
+
+    def _worksheet_names(self):
+        return self.wb.sheetnames
+
+    def _iter_formula_cells(self, ws_name):
+        for (row, column), cell in sorted(self.wb[ws_name]._cells.items()):
+            if cell.data_type == 'f':
+                yield CellAddress(ws_name, row, column, False, False)
+
+    def _cell_to_info(self, cell):
         if cell.data_type != 'f':
-            return CellInfo(self._serialize_value(value, cell.data_type))
+            return CellInfo(self._serialize_value(cell.value, cell.data_type))
         else:
             return CellInfo(None, cell.value[1:])
 
+    def _get_cell(self, ws_name, row, column):
+        """Cell of the worksheet, openpyxl creates missing cells and they extend bounds of the worksheet"""
+        ws = self.wb[ws_name]
+        cell = ws._cells.get((row, column))
+        if cell is None:
+            cell = ws._get_cell(row, column)
+            dimensions = self._caches['dimensions'].get(ws_name) if self._caches else None
+            if dimensions is not None:
+                dimensions.add(row, column)
+        return cell
+
+    def _get_cell_info(self, address):
+        return self._cell_to_info(self._get_cell(address.ws_name, address.row, address.column))
+
+    def _get_range_values(self, ws_name, row1, column1, row2, column2):
+        # missing cells are not created
+        cells = self.wb[ws_name]._cells
+        blank = CellInfo(None)
+        rows = []
+        for row in range(row1, row2 + 1):
+            row_cells = [cells.get((row, column)) for column in range(column1, column2 + 1)]
+            rows.append([blank if cell is None else self._cell_to_info(cell) for cell in row_cells])
+        return rows
+
+    def _iter_range_cells(self, ws_name, row1, column1, row2, column2):
+        cells = self.wb[ws_name]._cells
+        if (row2 - row1 + 1) * (column2 - column1 + 1) <= len(cells):
+            return super(OpenpyxlInterface, self)._iter_range_cells(ws_name, row1, column1, row2, column2)
+
+        # the range is larger than the worksheet, only existing cells are read
+        return ((row, column, self._cell_to_info(cells[row, column])) for row, column in sorted(cells)
+                if row1 <= row <= row2 and column1 <= column <= column2 and cells[row, column].value is not None)
+
     if PY3:
         def _get_named_range_formula(self, name, ws_name):
             check = []
@@ -78,17 +129,46 @@ class OpenpyxlInterface(BaseExcelInterface):
             else:
                 return result
 
+    def _get_dimensions(self, ws_name):
+        """
+        Bounds of the worksheet, with the cache they are computed once and extended by changed cells
+        :rtype: (int, int, int, int)
+        """
+        cache = self._caches['dimensions'] if self._caches else None
+        dimensions = cache.get(ws_name) if cache is not None else None
+        if dimensions is None:
+            dimensions = SheetDimensions(self.wb[ws_name]._cells)
+            if cache is not None:
+                cache[ws_name] = dimensions
+        return dimensions.bounds
+
     def _max_row(self, ws_name):
-        return self.wb[ws_name].max_row
+        return self._get_dimensions(ws_name)[1]
 
     def _min_row(self, ws_name):
-        return self.wb[ws_name].min_row
+        return self._get_dimensions(ws_name)[0]
 
     def _max_column(self, ws_name):
-        return self.wb[ws_name].max_column
+        return self._get_dimensions(ws_name)[3]
 
     def _min_column(self, ws_name):
-        return self.wb[ws_name].min_column
+        return self._get_dimensions(ws_name)[2]
+
+    def _get_used_range(self, ws_name):
+        """:rtype: UsedRange"""
+        cache = self._caches['used_ranges'] if self._caches else None
+        used_range = cache.get(ws_name) if cache is not None else None
+        if used_range is None:
+            used_range = UsedRange(key for key, cell in iteritems(self.wb[ws_name]._cells) if cell.value is not None)
+            if cache is not None:
+                cache[ws_name] = used_range
+        return used_range
+
+    def _max_row_in_columns(self, ws_name, column1, column2):
+        return self._get_used_range(ws_name).max_row(column1, column2)
+
+    def _max_column_in_rows(self, ws_name, row1, row2):
+        return self._get_used_range(ws_name).max_column(row1, row2)
 
     def _has_worksheet(self, ws_name):
         return ws_name in self.wb.sheetnames
@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime
+
+from six import PY3, integer_types, iteritems, string_types
+from six.moves import range, zip
+
+from efc.interfaces.base import BaseExcelInterface, CellInfo, SheetDimensions, UsedRange
+from efc.interfaces.errors import NamedRangeNotFound
+from efc.rpn_builder.parser.operands import CellAddress
+from efc.utils import cell_index_to_tuple, datetime_to_openxml, parse_date
+
+__all__ = ('SheetSnapshot', 'SnapshotInterface')
+
+# typecode of signed 64-bit integers
+INT64 = 'q' if PY3 else 'l'
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+# cells are keyed by row << COLUMN_BITS | column, so keys are sorted by rows and then by columns
+COLUMN_BITS = 15
+COLUMN_MASK = (1 << COLUMN_BITS) - 1
+
+
+class SheetSnapshot(object):
+    """
+    Populated cells of a worksheet in compact columnar arrays.
+    Cells are kept sorted by their keys, every cell has a kind and a slot: the index of the value
+    in the typed array or the table of its kind, booleans are kept in slots themselves.
+    Rows have bitmaps of populated columns, so reads of blank cells do not search keys.
+    Cells of shared formulas keep one template of the group, formulas of cells are built from it when they are read.
+    Slots of numbers, integers and other values belong to one cell, they are reused when cells are changed.
+    """
+    NUMBER, INTEGER, BOOLEAN, STRING, DATE, FORMULA, SHARED_FORMULA, OTHER = range(8)
+
+    BLANK = CellInfo(None)
+
+    def __init__(self):
+        self._keys = array(INT64)
+        self._kinds = bytearray()
+        self._slots = array(INT64)
+
+        self._numbers = array('d')
+        self._integers = array(INT64)
+        self._strings = []
+        self._string_ids = {}
+        self._formulas = []
+        self._formula_ids = {}
+        self._shared_formulas = []
+        self._shared_formula_ids = {}
+        self._others = []
+        # kind -> slots of changed cells which can be reused
+        self._free_slots = {self.NUMBER: [], self.INTEGER: [], self.OTHER: []}
+
+        self._populated = {}
+        self.dimensions = SheetDimensions()
+        self.used_range = UsedRange()
+
+    def __len__(self):
+        return len(self._keys)
+
+    @staticmethod
+    def _add_to_table(table, ids, value):
+        slot = ids.get(value)
+        if slot is None:
+            slot = ids[value] = len(table)
+            table.append(value)
+        return slot
+
+    def _store(self, kind, values, value):
+        """Slot of the value in the array of the kind, a slot of a changed cell is taken first"""
+        free_slots = self._free_slots[kind]
+        if free_slots:
+            slot = free_slots.pop()
+            values[slot] = value
+            return slot
+        values.append(value)
+        return len(values) - 1
+
+    def _release(self, idx):
+        """Free the slot of the cell which is changed"""
+        kind, slot = self._kinds[idx], self._slots[idx]
+        free_slots = self._free_slots.get(kind)
+        if free_slots is not None:
+            free_slots.append(slot)
+            if kind == self.OTHER:
+                self._others[slot] = None
+
+    def _encode(self, value, formula, date):
+        """
+        :return: kind and slot of the value
+        :rtype: (int, int)
+        """
+        if isinstance(formula, string_types):
+            return self.FORMULA, self._add_to_table(self._formulas, self._formula_ids, formula)
+        elif formula is not None:
+            return self.SHARED_FORMULA, self._add_to_table(self._shared_formulas, self._shared_formula_ids, formula)
+        elif date:
+            return self.DATE, self._add_to_table(self._strings, self._string_ids, value)
+        elif isinstance(value, bool):
+            return self.BOOLEAN, int(value)
+        elif isinstance(value, integer_types) and INT64_MIN <= value <= INT64_MAX:
+            return self.INTEGER, self._store(self.INTEGER, self._integers, value)
+        elif isinstance(value, float):
+            return self.NUMBER, self._store(self.NUMBER, self._numbers, value)
+        elif isinstance(value, string_types):
+            return self.STRING, self._add_to_table(self._strings, self._string_ids, value)
+        else:
+            return self.OTHER, self._store(self.OTHER, self._others, value)
+
+    def _decode(self, idx):
+        """:rtype: CellInfo"""
+        kind, slot = self._kinds[idx], self._slots[idx]
+        if kind == self.FORMULA:
+            return CellInfo(None, self._formulas[slot])
+        elif kind == self.SHARED_FORMULA:
+            key = self._keys[idx]
+            return CellInfo(None, self._shared_formulas[slot].formula_at(key >> COLUMN_BITS, key & COLUMN_MASK))
+        elif kind == self.STRING or kind == self.DATE:
+            return CellInfo(self._strings[slot])
+        elif kind == self.INTEGER:
+            return CellInfo(self._integers[slot])
+        elif kind == self.NUMBER:
+            return CellInfo(self._numbers[slot])
+        elif kind == self.BOOLEAN:
+            return CellInfo(bool(slot))
+        else:
+            return CellInfo(self._others[slot])
+
+    def _find(self, row, column):
+        """Index of the populated cell or None"""
+        if not self._populated.get(row, 0) >> column & 1:
+            return None
+        return bisect_left(self._keys, row << COLUMN_BITS | column)
+
+    def append(self, row, column, value=None, formula=None, date=False):
+        """
+        Add the cell after all cells of the snapshot, cells should be appended in order of rows and columns.
+        Blank cells only extend dimensions of the worksheet.
+        :param formula: formula without leading "=" or the template of a shared formula with formula_at(row, column)
+        :param date: the value is a serialized date
+        """
+        self.dimensions.add(row, column)
+        if value is None and formula is None:
+            return
+
+        key = row << COLUMN_BITS | column
+        if self._keys and self._keys[-1] >= key:
+            raise ValueError('Cells should be appended in order of rows and columns')
+
+        kind, slot = self._encode(value, formula, date)
+        self._keys.append(key)
+        self._kinds.append(kind)
+        self._slots.append(slot)
+        self._populated[row] = self._populated.get(row, 0) | 1 << column
+        self.used_range.add(row, column)
+
+    def set(self, row, column, value=None, formula=None, date=False):
+        """Change the cell in any place of the worksheet, None value and formula clear the cell"""
+        self.dimensions.add(row, column)
+        idx = self._find(row, column)
+        if idx is not None:
+            self._release(idx)
+        if value is None and formula is None:
+            if idx is not None:
+                del self._keys[idx]
+                del self._kinds[idx]
+                del self._slots[idx]
+                self._populated[row] &= ~(1 << column)
+            return
+
+        kind, slot = self._encode(value, formula, date)
+        if idx is None:
+            idx = bisect_left(self._keys, row << COLUMN_BITS | column)
+            self._keys.insert(idx, row << COLUMN_BITS | column)
+            self._kinds.insert(idx, kind)
+            self._slots.insert(idx, slot)
+            self._populated[row] = self._populated.get(row, 0) | 1 << column
+            self.used_range.add(row, column)
+        else:
+            self._kinds[idx] = kind
+            self._slots[idx] = slot
+
+    def get(self, row, column):
+        """:rtype: CellInfo"""
+        idx = self._find(row, column)
+        return self.BLANK if idx is None else self._decode(idx)
+
+    def is_date(self, row, column):
+        idx = self._find(row, column)
+        return idx is not None and self._kinds[idx] == self.DATE
+
+    def iter_cells(self, row1, column1, row2, column2):
+        """
+        Populated cells of the rectangle in order of rows, keys of rows are skipped outside of the columns
+        :rtype: collections.Iterable[(int, int, CellInfo)]
+        """
+        keys = self._keys
+        end = bisect_right(keys, row2 << COLUMN_BITS | column2)
+        idx = bisect_left(keys, row1 << COLUMN_BITS | column1, 0, end)
+        while idx < end:
+            key = keys[idx]
+            row, column = key >> COLUMN_BITS, key & COLUMN_MASK
+            if column < column1:
+                idx = bisect_left(keys, row << COLUMN_BITS | column1, idx, end)
+            elif column > column2:
+                idx = bisect_left(keys, (row + 1) << COLUMN_BITS | column1, idx, end)
+            else:
+                yield row, column, self._decode(idx)
+                idx += 1
+
+    def iter_formula_cells(self):
+        """
+        Rows and columns of formula cells in order of rows
+        :rtype: collections.Iterable[(int, int)]
+        """
+        formulas = (self.FORMULA, self.SHARED_FORMULA)
+        for key, kind in zip(self._keys, self._kinds):
+            if kind in formulas:
+                yield key >> COLUMN_BITS, key & COLUMN_MASK
+
+
+class SnapshotInterface(BaseExcelInterface):
+    """
+    Workbook read once into compact snapshots of worksheets, the source workbook is not used after that.
+    Cells are not created by reads, so bounds of worksheets change only by set_cell_value.
+    """
+
+    def __init__(self, sheets, defined_names=None, *args, **kwargs):
+        """
+        :param sheets: snapshots of worksheets in order of the workbook
+        :type sheets: collections.Iterable[(basestring, SheetSnapshot)]
+        :param defined_names: formulas of named ranges by worksheet names, workbook names are kept by None
+        :type defined_names: dict[basestring | None, dict[basestring, basestring]]
+        """
+        self.sheets = OrderedDict(sheets)
+        self.defined_names = defined_names or {}
+        super(SnapshotInterface, self).__init__(*args, **kwargs)
+
+    @classmethod
+    def from_openpyxl(cls, wb, *args, **kwargs):
+        """
+        Walk every worksheet of the openpyxl workbook once
+        :type wb: openpyxl.Workbook
+        """
+        sheets = []
+        for ws in wb.worksheets:
+            sheet = SheetSnapshot()
+            for (row, column), cell in sorted(iteritems(ws._cells)):
+                if cell.data_type == 'f':
+                    sheet.append(row, column, formula=cell.value[1:])
+                elif cell.data_type == 'd' and cell.value is not None:
+                    sheet.append(row, column, datetime_to_openxml(cell.value), date=True)
+                else:
+                    sheet.append(row, column, cell.value)
+            sheets.append((ws.title, sheet))
+        return cls(sheets, cls._openpyxl_defined_names(wb), *args, **kwargs)
+
+    if PY3:
+        @staticmethod
+        def _openpyxl_defined_names(wb):
+            defined_names = {None: {name: dn.attr_text for name, dn in wb.defined_names.items()}}
+            for ws in wb.worksheets:
+                defined_names[ws.title] = {name: dn.attr_text for name, dn in ws.defined_names.items()}
+            return defined_names
+    else:
+        @staticmethod
+        def _openpyxl_defined_names(wb):
+            defined_names = {}
+            for named_range in wb.defined_names.definedName:
+                ws_name = None
+                if named_range.localSheetId is not None:
+                    ws_name = wb.sheetnames[named_range.localSheetId]
+                defined_names.setdefault(ws_name, {})[named_range.name] = named_range.attr_text
+            return defined_names
+
+    def _get_sheet(self, ws_name):
+        """:rtype: SheetSnapshot"""
+        return self.sheets[ws_name]
+
+    def get_cell_formula_hyperlink(self, cell_index, ws_name):
+        row, column = cell_index_to_tuple(cell_index)
+        return self._get_cell_formula_hyperlink(CellAddress(ws_name, row, column, False, False))
+
+    def calc_cell(self, cell_index, ws_name):
+        """
+        Calculate the cell formula by str index.
+        If the cell does not have the formula it returns the cell's value.
+        :type cell_index: basestring
+        :type ws_name: basestring
+        """
+        row, column = cell_index_to_tuple(cell_index)
+        value, _ = self._cell_to_value(CellAddress(ws_name, row, column, False, False))
+        if self._get_sheet(ws_name).is_date(row, column):
+            value = parse_date(value)
+        return value
+
+    def set_cell_value(self, cell_index, ws_name, value):
+        """
+        Set the cell value, strings which start with "=" are formulas.
+        Calculated values of cells which depend on the cell are removed from the cache,
+        other cells are not calculated again.
+        :type cell_index: basestring
+        :type ws_name: basestring
+        """
+        row, column = cell_index_to_tuple(cell_index)
+        sheet = self._get_sheet(ws_name)
+        if isinstance(value, string_types) and len(value) > 1 and value.startswith('='):
+            sheet.set(row, column, formula=value[1:])
+        elif isinstance(value, datetime):
+            sheet.set(row, column, datetime_to_openxml(value), date=True)
+        else:
+            sheet.set(row, column, value)
+        self._reset_cell(CellAddress(ws_name, row, column, False, False))
+
+    def _worksheet_names(self):
+        return list(self.sheets)
+
+    def _iter_formula_cells(self, ws_name):
+        for row, column in self._get_sheet(ws_name).iter_formula_cells():
+            yield CellAddress(ws_name, row, column, False, False)
+
+    def _get_cell_info(self, address):
+        return self._get_sheet(address.ws_name).get(address.row, address.column)
+
+    def _get_range_values(self, ws_name, row1, column1, row2, column2):
+        blank = SheetSnapshot.BLANK
+        rows = [[blank] * (column2 - column1 + 1) for _ in range(row1, row2 + 1)]
+        for row, column, info in self._get_sheet(ws_name).iter_cells(row1, column1, row2, column2):
+            rows[row - row1][column - column1] = info
+        return rows
+
+    def _iter_range_cells(self, ws_name, row1, column1, row2, column2):
+        return self._get_sheet(ws_name).iter_cells(row1, column1, row2, column2)
+
+    def _get_named_range_formula(self, name, ws_name):
+        for names in (self.defined_names.get(ws_name), self.defined_names.get(None)):
+            if names and name in names:
+                return names[name]
+        raise NamedRangeNotFound
+
+    def _max_row(self, ws_name):
+        return self._get_sheet(ws_name).dimensions.bounds[1]
+
+    def _min_row(self, ws_name):
+        return self._get_sheet(ws_name).dimensions.bounds[0]
+
+    def _max_column(self, ws_name):
+        return self._get_sheet(ws_name).dimensions.bounds[3]
+
+    def _min_column(self, ws_name):
+        return self._get_sheet(ws_name).dimensions.bounds[2]
+
+    def _max_row_in_columns(self, ws_name, column1, column2):
+        return self._get_sheet(ws_name).used_range.max_row(column1, column2)
+
+    def _max_column_in_rows(self, ws_name, row1, row2):
+        return self._get_sheet(ws_name).used_range.max_column(row1, row2)
+
+    def _has_worksheet(self, ws_name):
+        return ws_name in self.sheets
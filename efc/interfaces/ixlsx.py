@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import posixpath
+import re
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from zipfile import ZipFile
+
+from six import PY2
+
+from efc.interfaces.errors import WorkbookPartNotFound
+from efc.interfaces.isnapshot import SheetSnapshot, SnapshotInterface
+from efc.rpn_builder.lexer import tokens
+from efc.utils import cached_property, col_index_to_str, col_str_to_index, datetime_to_openxml
+
+if PY2:
+    from xml.etree import cElementTree as ElementTree
+else:
+    from xml.etree import ElementTree
+
+__all__ = ('SharedFormula', 'XlsxReader', 'XlsxInterface')
+
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PACKAGE_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+WORKSHEET_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet'
+SHARED_STRINGS_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings'
+STYLES_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles'
+OFFICE_DOCUMENT_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+
+# built-in number formats of dates and times
+DATE_FORMAT_IDS = frozenset(range(14, 23)) | frozenset(range(45, 48))
+# quoted text and bracketed colors and conditions of number formats are not date parts
+DATE_FORMAT_STRIP_REGEXP = re.compile(r'"[^"]*"|\[[^\]]*\]|\\.')
+DATE_FORMAT_REGEXP = re.compile(r'[dmhys]', re.I)
+ISO_DATE_REGEXP = re.compile(r'^(\d{4})-(\d\d)-(\d\d)(?:T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,6})\d*)?)?')
+
+WINDOWS_EPOCH = datetime(1899, 12, 30)
+MAC_EPOCH = datetime(1904, 1, 1)
+
+# cell references in formulas, other tokens are matched to skip references inside them,
+# names of functions can look like cells, e.g. LOG10
+REFERENCES_REGEXP = re.compile('|'.join([r'(?P<function>[A-Z][A-Z0-9.]*(?=\())'] + [c.get_group_pattern() for c in (
+    tokens.FloatToken, tokens.IntToken, tokens.StringToken,
+    tokens.CellsRangeToken, tokens.SingleCellToken, tokens.NamedRangeToken,
+)]), re.UNICODE)
+
+
+def _shift_address_part(value, fixed, offset, to_str):
+    if value is None:
+        return ''
+    elif fixed:
+        return '$' + to_str(value)
+    else:
+        return to_str(value + offset)
+
+
+class SharedFormula(object):
+    """
+    Formula of the shared formula group. It is kept once for the group, relative references
+    are shifted for every cell of the group like Excel does when the formula is filled.
+    """
+
+    def __init__(self, formula, row, column):
+        """
+        :param formula: formula of the first cell of the group
+        :type row: int
+        :type column: int
+        """
+        self.formula = formula
+        self.row = row
+        self.column = column
+
+        self._parts = []
+        position = 0
+        for match in REFERENCES_REGEXP.finditer(formula):
+            token_class = getattr(tokens, match.lastgroup, None)
+            if token_class is tokens.SingleCellToken or token_class is tokens.CellsRangeToken:
+                src_value = match.group(0)
+                self._parts.append(formula[position:match.start()])
+                self._parts.append((token_class(match), src_value[:src_value.rfind('!') + 1]))
+                position = match.end()
+        self._parts.append(formula[position:])
+
+    def formula_at(self, row, column):
+        """
+        Formula of the cell of the group
+        :rtype: basestring
+        """
+        row_offset, column_offset = row - self.row, column - self.column
+        if not row_offset and not column_offset:
+            return self.formula
+
+        parts = []
+        for part in self._parts:
+            if not isinstance(part, tuple):
+                parts.append(part)
+                continue
+
+            token, ws_prefix = part
+            parts.append(ws_prefix)
+            if isinstance(token, tokens.SingleCellToken):
+                parts.append(_shift_address_part(token.column, token.column_fixed, column_offset, col_index_to_str))
+                parts.append(_shift_address_part(token.row, token.row_fixed, row_offset, str))
+            else:
+                parts.append(_shift_address_part(token.column1, token.column1_fixed, column_offset, col_index_to_str))
+                parts.append(_shift_address_part(token.row1, token.row1_fixed, row_offset, str))
+                parts.append(':')
+                parts.append(_shift_address_part(token.column2, token.column2_fixed, column_offset, col_index_to_str))
+                parts.append(_shift_address_part(token.row2, token.row2_fixed, row_offset, str))
+        return ''.join(parts)
+
+
+def is_date_format(format_code):
+    """
+    :type format_code: basestring
+    :rtype: bool
+    """
+    format_code = DATE_FORMAT_STRIP_REGEXP.sub('', format_code.split(';')[0])
+    return DATE_FORMAT_REGEXP.search(format_code) is not None
+
+
+class XlsxReader(object):
+    """
+    Reader of xlsx files without loading the whole document. Worksheets and shared strings are parsed
+    by iterparse, parsed elements are dropped right away, so only values of cells are kept in memory.
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: path or file object of the xlsx document
+        """
+        self.zip_file = ZipFile(filename)
+        self._names = set(self.zip_file.namelist())
+
+        self.workbook_part = self._get_workbook_part()
+        relationships = self._read_relationships(self.workbook_part)
+
+        self.sheet_parts = []
+        self.defined_names = {}
+        self.date1904 = False
+        root = self._parse(self.workbook_part)
+        sheet_names = []
+        for element in root.iter():
+            if element.tag == MAIN_NS + 'sheet':
+                rel_type, part = relationships.get(element.get(REL_NS + 'id'), (None, None))
+                sheet_names.append(element.get('name'))
+                if rel_type == WORKSHEET_REL:
+                    self.sheet_parts.append((element.get('name'), part))
+            elif element.tag == MAIN_NS + 'definedName':
+                local_sheet_id = element.get('localSheetId')
+                ws_name = sheet_names[int(local_sheet_id)] if local_sheet_id is not None else None
+                self.defined_names.setdefault(ws_name, {})[element.get('name')] = element.text
+            elif element.tag == MAIN_NS + 'workbookPr':
+                self.date1904 = element.get('date1904') in ('1', 'true')
+
+        self._shared_strings_part = self._find_part(relationships, SHARED_STRINGS_REL)
+        self._styles_part = self._find_part(relationships, STYLES_REL)
+
+    def close(self):
+        self.zip_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _open(self, part):
+        if part not in self._names:
+            raise WorkbookPartNotFound(part)
+        return self.zip_file.open(part)
+
+    def _parse(self, part):
+        """Small parts are parsed entirely"""
+        with self._open(part) as f:
+            return ElementTree.parse(f).getroot()
+
+    def _get_workbook_part(self):
+        if '_rels/.rels' in self._names:
+            for rel_type, part in self._read_relationships('').values():
+                if rel_type == OFFICE_DOCUMENT_REL:
+                    return part
+        return 'xl/workbook.xml'
+
+    def _read_relationships(self, part):
+        """
+        :return: {relationship id: (relationship type, part)}
+        :rtype: dict[basestring, (basestring, basestring)]
+        """
+        directory, name = posixpath.split(part)
+        rels_part = posixpath.join(directory, '_rels', name + '.rels')
+        if rels_part not in self._names:
+            return {}
+
+        relationships = {}
+        for element in self._parse(rels_part).iter(PACKAGE_REL_NS + 'Relationship'):
+            target = element.get('Target')
+            if target.startswith('/'):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join(directory, target))
+            relationships[element.get('Id')] = (element.get('Type'), target)
+        return relationships
+
+    @staticmethod
+    def _find_part(relationships, rel_type):
+        for part_type, part in relationships.values():
+            if part_type == rel_type:
+                return part
+
+    @property
+    def sheet_names(self):
+        """:rtype: list[basestring]"""
+        return [ws_name for ws_name, _ in self.sheet_parts]
+
+    @cached_property
+    def shared_strings(self):
+        """:rtype: list[basestring]"""
+        shared_strings = []
+        if self._shared_strings_part is None:
+            return shared_strings
+
+        si_tag, t_tag, r_tag = MAIN_NS + 'si', MAIN_NS + 't', MAIN_NS + 'r'
+        with self._open(self._shared_strings_part) as f:
+            for _, element in ElementTree.iterparse(f):
+                if element.tag != si_tag:
+                    continue
+                # phonetic runs are not a part of the text
+                texts = [t.text for t in element.findall(t_tag)]
+                texts.extend(t.text for r in element.findall(r_tag) for t in r.findall(t_tag))
+                shared_strings.append(''.join(text for text in texts if text))
+                element.clear()
+        return shared_strings
+
+    @cached_property
+    def date_styles(self):
+        """
+        Indexes of cell styles with date formats
+        :rtype: set[int]
+        """
+        date_styles = set()
+        if self._styles_part is None:
+            return date_styles
+
+        root = self._parse(self._styles_part)
+        date_formats = set(DATE_FORMAT_IDS)
+        for element in root.iter(MAIN_NS + 'numFmt'):
+            if is_date_format(element.get('formatCode', '')):
+                date_formats.add(int(element.get('numFmtId')))
+
+        cell_xfs = root.find(MAIN_NS + 'cellXfs')
+        if cell_xfs is not None:
+            for idx, element in enumerate(cell_xfs.findall(MAIN_NS + 'xf')):
+                if int(element.get('numFmtId', 0)) in date_formats:
+                    date_styles.add(idx)
+        return date_styles
+
+    def _serial_to_openxml(self, value):
+        """
+        Serial number of the date like openpyxl reads it, times without dates are kept as numbers
+        :rtype: basestring | float
+        """
+        if not 1 <= value < 2958466:
+            return None
+        days, fraction = divmod(value, 1)
+        if self.date1904:
+            epoch = MAC_EPOCH
+        else:
+            epoch = WINDOWS_EPOCH
+            if days < 60:
+                days += 1
+        date = epoch + timedelta(days=days, milliseconds=round(fraction * 24 * 60 * 60 * 1000))
+        return datetime_to_openxml(date)
+
+    def _read_value(self, data_type, text, element):
+        """
+        :return: value of the cell and the date flag
+        :rtype: (Any, bool)
+        """
+        if data_type == 'inlineStr':
+            inline_string = element.find(MAIN_NS + 'is')
+            if inline_string is None:
+                return None, False
+            return ''.join(t.text or '' for t in inline_string.iter(MAIN_NS + 't')), False
+        elif not text:
+            return None, False
+        elif data_type == 'n':
+            if '.' in text or 'E' in text or 'e' in text:
+                value = float(text)
+            else:
+                value = int(text)
+            if int(element.get('s', 0)) in self.date_styles:
+                date = self._serial_to_openxml(value)
+                if date is not None:
+                    return date, True
+            return value, False
+        elif data_type == 's':
+            return self.shared_strings[int(text)], False
+        elif data_type == 'b':
+            return text in ('1', 'true'), False
+        elif data_type == 'd':
+            m = ISO_DATE_REGEXP.match(text)
+            if m is None:
+                return text, False
+            parts = [int(p) if p else 0 for p in m.groups()]
+            parts[6] = int(m.group(7).ljust(6, '0')) if m.group(7) else 0
+            return datetime_to_openxml(datetime(*parts)), True
+        else:
+            # strings of formulas and errors
+            return text, False
+
+    def read_sheet(self, ws_name):
+        """
+        :rtype: SheetSnapshot
+        """
+        part = dict(self.sheet_parts)[ws_name]
+        sheet = SheetSnapshot()
+        shared_formulas = {}
+
+        sheet_data_tag, row_tag, c_tag = MAIN_NS + 'sheetData', MAIN_NS + 'row', MAIN_NS + 'c'
+        v_tag, f_tag = MAIN_NS + 'v', MAIN_NS + 'f'
+        sheet_data = None
+        row = column = 0
+        columns = {}
+        with self._open(part) as f:
+            for event, element in ElementTree.iterparse(f, events=('start', 'end')):
+                tag = element.tag
+                if event == 'start':
+                    if tag == row_tag:
+                        row = int(element.get('r', row + 1))
+                        column = 0
+                    elif tag == sheet_data_tag:
+                        sheet_data = element
+                    continue
+
+                if tag == c_tag:
+                    index = element.get('r')
+                    if index is not None:
+                        # cells are in the row of the row element, only columns are parsed
+                        letters = index.rstrip('0123456789')
+                        column = columns.get(letters)
+                        if column is None:
+                            column = columns[letters] = col_str_to_index(letters)
+                    else:
+                        column += 1
+
+                    formula = None
+                    f_element = element.find(f_tag)
+                    if f_element is not None:
+                        formula_type = f_element.get('t')
+                        if formula_type == 'shared':
+                            shared_index = f_element.get('si')
+                            if f_element.text:
+                                shared_formulas[shared_index] = SharedFormula(f_element.text, row, column)
+                                formula = f_element.text
+                            elif shared_index in shared_formulas:
+                                formula = shared_formulas[shared_index]
+                        elif formula_type != 'dataTable' and f_element.text:
+                            formula = f_element.text
+
+                    if formula is not None:
+                        sheet.append(row, column, formula=formula)
+                    else:
+                        value, date = self._read_value(element.get('t', 'n'), element.findtext(v_tag), element)
+                        sheet.append(row, column, value, date=date)
+                    element.clear()
+                elif tag == row_tag:
+                    element.clear()
+                    if sheet_data is not None:
+                        sheet_data.remove(element)
+        return sheet
+
+
+class XlsxInterface(SnapshotInterface):
+    """
+    Interface to xlsx documents which are read directly, without openpyxl.
+    Worksheets are read into compact snapshots, formulas are kept as strings.
+    """
+
+    def __init__(self, filename, lazy=False, max_resident_sheets=None, *args, **kwargs):
+        """
+        :param filename: path or file object of the xlsx document
+        :param lazy: read only the list of worksheets and defined names, worksheets are read when they are used
+            for the first time. The document is kept open until close() is called
+        :param max_resident_sheets: max count of worksheets kept in memory in the lazy mode, the least recently used
+            worksheets are dropped and read again when they are needed. Worksheets changed by set_cell_value
+            are always kept. None - unlimited
+        """
+        self._reader = XlsxReader(filename)
+        self.max_resident_sheets = max_resident_sheets
+        self._resident = OrderedDict()
+        self._changed = set()
+        if lazy:
+            sheets = [(ws_name, None) for ws_name in self._reader.sheet_names]
+        else:
+            sheets = [(ws_name, self._reader.read_sheet(ws_name)) for ws_name in self._reader.sheet_names]
+            self.close()
+        super(XlsxInterface, self).__init__(sheets, self._reader.defined_names, *args, **kwargs)
+
+    def close(self):
+        """Close the document, worksheets which are not read yet can not be used after that"""
+        self._reader.close()
+
+    def _get_sheet(self, ws_name):
+        sheet = self.sheets[ws_name]
+        if sheet is None:
+            sheet = self.sheets[ws_name] = self._reader.read_sheet(ws_name)
+            if self.max_resident_sheets is not None:
+                self._resident[ws_name] = None
+                self._drop_sheets()
+        elif self.max_resident_sheets is not None and ws_name in self._resident:
+            # move the worksheet to the end of the queue
+            self._resident[ws_name] = self._resident.pop(ws_name)
+        return sheet
+
+    def _drop_sheets(self):
+        """Drop the least recently used worksheets over the limit, the last used worksheet is always kept"""
+        while len(self._resident) > 1 and len(self._resident) + len(self._changed) > self.max_resident_sheets:
+            ws_name, _ = self._resident.popitem(last=False)
+            self.sheets[ws_name] = None
+
+    def loaded_sheets(self):
+        """
+        Names of worksheets kept in memory
+        :rtype: list[basestring]
+        """
+        return [ws_name for ws_name, sheet in self.sheets.items() if sheet is not None]
+
+    def set_cell_value(self, cell_index, ws_name, value):
+        if ws_name not in self._changed:
+            self._get_sheet(ws_name)
+            self._resident.pop(ws_name, None)
+            self._changed.add(ws_name)
+        super(XlsxInterface, self).set_cell_value(cell_index, ws_name, value)
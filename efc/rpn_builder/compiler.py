@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from efc.rpn_builder.parser.operands import (ErrorOperand, FunctionNotSupported, OperandLikeObject, SimpleOperand,
+                                             ValueErrorOperand, ZeroDivisionErrorOperand)
+from efc.rpn_builder.parser.operations import Operation
+
+__all__ = ('compile_rpn',)
+
+# max depth of nested operations of compiled formulas, every level takes two frames of the stack.
+# Formulas like A1+A2+...+A1000 are deeper, they are interpreted
+MAX_DEPTH = 100
+
+
+def operand_node(idx):
+    """Node of the operand token, tokens are taken from the RPN, so copies of the RPN share nodes"""
+
+    def node(tokens, ws_name):
+        return tokens[idx]
+
+    return node
+
+
+def not_supported(f_name):
+    """Function of the unknown name, the error is raised after calculation of arguments like RPN.calc does"""
+
+    def func(*args):
+        return FunctionNotSupported(f_name)
+
+    return func
+
+
+def resolve_function(operation):
+    """
+    Function of the operation, operations which override eval are called as is
+    :type operation: Operation
+    """
+    if type(operation).eval is not Operation.eval:
+        return operation.eval
+    elif operation.func is not None:
+        return operation.func
+    else:
+        return not_supported(operation.f_name)
+
+
+def error_to_operand(err):
+    """Errors of functions which are results of formulas, other errors are raised"""
+    if isinstance(err, FunctionNotSupported):
+        raise err
+    elif isinstance(err, ErrorOperand):
+        return err
+    elif isinstance(err, (TypeError, ValueError)):
+        v = ValueErrorOperand()
+        v.__cause__ = err
+        return v
+    elif isinstance(err, ZeroDivisionError):
+        return ZeroDivisionErrorOperand()
+    raise err
+
+
+def operation_node(func, arg_nodes, formula):
+    """
+    Node of the operation with the same error handling as RPN.calc
+    """
+
+    def to_operand(v, ws_name):
+        if not isinstance(v, OperandLikeObject):
+            return SimpleOperand(v)
+        elif isinstance(v, ErrorOperand):
+            v.formula = formula
+            if v.ws_name is None:
+                v.ws_name = ws_name
+            if isinstance(v, FunctionNotSupported):
+                raise v
+        return v
+
+    if len(arg_nodes) == 1:
+        arg_node, = arg_nodes
+
+        def node(tokens, ws_name):
+            arg = arg_node(tokens, ws_name)
+            try:
+                v = func(arg)
+            except Exception as err:
+                v = error_to_operand(err)
+            return to_operand(v, ws_name)
+    elif len(arg_nodes) == 2:
+        left_node, right_node = arg_nodes
+
+        def node(tokens, ws_name):
+            left = left_node(tokens, ws_name)
+            right = right_node(tokens, ws_name)
+            try:
+                v = func(left, right)
+            except Exception as err:
+                v = error_to_operand(err)
+            return to_operand(v, ws_name)
+    else:
+        def node(tokens, ws_name):
+            args = [n(tokens, ws_name) for n in arg_nodes]
+            try:
+                v = func(*args)
+            except Exception as err:
+                v = error_to_operand(err)
+            return to_operand(v, ws_name)
+
+    return node
+
+
+def compile_rpn(rpn):
+    """
+    Build the tree of closures which calculates the RPN without dispatching of tokens.
+    Program is called with tokens of the RPN, the working sheet and the source.
+    RPN which can not be compiled, e.g. with missing operands or too deep to be calculated by recursion,
+    returns None and it is interpreted by RPN.calc.
+    :type rpn: efc.rpn_builder.rpn.RPN
+    :rtype: ((list, basestring, object) -> OperandLikeObject) | None
+    """
+    stack = []
+    depths = []
+    for idx, token in enumerate(rpn._array):
+        if isinstance(token, OperandLikeObject):
+            stack.append(operand_node(idx))
+            depths.append(1)
+        elif isinstance(token, Operation):
+            count = token.operands_count
+            if count > len(stack):
+                return None
+            start = len(stack) - count
+            depth = max(depths[start:] or [0]) + 1
+            if depth > MAX_DEPTH:
+                return None
+            arg_nodes = stack[start:]
+            del stack[start:], depths[start:]
+            stack.append(operation_node(resolve_function(token), arg_nodes, rpn.formula))
+            depths.append(depth)
+        else:
+            return None
+
+    if len(stack) == 1:
+        result_node, = stack
+
+        def program(tokens, ws_name, source):
+            return result_node(tokens, ws_name)
+    else:
+        handle_result = rpn.handle_result
+
+        def program(tokens, ws_name, source):
+            return handle_result([n(tokens, ws_name) for n in stack], ws_name, source)
+
+    return program
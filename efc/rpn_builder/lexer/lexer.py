@@ -37,39 +37,82 @@ TOKENS_PRIORITY = (
     tokens.Separator,
 )
 
+LEXER_TOKENS = OrderedDict((c.__name__, c) for c in TOKENS_PRIORITY)
+
+# all tokens in order of priority, compiled once for all lexers
+LEXER_REGEXP = re.compile(r'|'.join(c.get_group_pattern() for c in TOKENS_PRIORITY), flags=re.UNICODE)
+
+# first symbol of the token -> regexp of tokens which may start with the symbol, in the same order of priority
+SYMBOL_REGEXPS = {}
+
+
+def get_symbol_regexp(symbol):
+    """
+    Regexp of tokens which may start with the symbol. Other tokens can not be matched at the position,
+    so the result of the match is the same as the result of LEXER_REGEXP. Tokens without the start pattern
+    are kept for every symbol.
+    :type symbol: basestring
+    :rtype: re.Pattern
+    """
+    try:
+        return SYMBOL_REGEXPS[symbol]
+    except KeyError:
+        pass
+
+    token_classes = [c for c in TOKENS_PRIORITY
+                     if c.start_pattern is None or re.match(c.start_pattern, symbol, flags=re.UNICODE)]
+    if len(token_classes) == len(TOKENS_PRIORITY):
+        regexp = LEXER_REGEXP
+    else:
+        regexp = re.compile(r'|'.join(c.get_group_pattern() for c in token_classes) or r'(?!)', flags=re.UNICODE)
+    SYMBOL_REGEXPS[symbol] = regexp
+    return regexp
+
 
 class TokensLine(Array):
     def __init__(self, line):
         self.src_line = line
         super(TokensLine, self).__init__()
 
+    def relative_key(self, row, column):
+        """
+        Formula key in R1C1 notation. Formulas filled down or right in Excel have the same key.
+        :type row: int
+        :type column: int
+        """
+        return tuple((token.__class__.__name__, token.relative_value(row, column)) for token in self)
+
 
 class Lexer(object):
     def __init__(self):
-        self.lexer_tokens = OrderedDict()
-        self.regexp = None
-
-        self.prepare_regexp()
+        self.lexer_tokens = LEXER_TOKENS
+        self.regexp = LEXER_REGEXP
 
-    def prepare_regexp(self):
-        regexp_list = []
-        for c in TOKENS_PRIORITY:
-            self.lexer_tokens[c.__name__] = c
-            regexp_list.append(c.get_group_pattern())
-        self.regexp = r'|'.join(regexp_list)
+    def check_sum(self, line):
+        """
+        Raise the error with symbols of the line which are matched by tokens
+        :type line: basestring
+        """
+        parsed_line = ''.join(match.group(0) for match in self.regexp.finditer(line))
+        if parsed_line != line:
+            raise CheckSumError(line, parsed_line)
 
     def parse(self, line):
         lexer_tokens = self.lexer_tokens
-        parsed_line = []
+        symbol_regexps = SYMBOL_REGEXPS
 
         tokens_line = TokensLine(line)
-        for match in re.finditer(self.regexp, line, flags=re.UNICODE):
-            token = lexer_tokens[match.lastgroup](match)
-            if not isinstance(token, tokens.SpaceToken):
-                tokens_line.append(token)
-            parsed_line.append(token.src_value)
+        tokens_append = tokens_line.append
+        pos, end = 0, len(line)
+        while pos < end:
+            symbol = line[pos]
+            match = (symbol_regexps.get(symbol) or get_symbol_regexp(symbol)).match(line, pos)
+            if match is None:
+                self.check_sum(line)
+                raise CheckSumError(line, line[:pos])
 
-        parsed_line = ''.join(parsed_line)
-        if parsed_line != line:
-            raise CheckSumError(line, parsed_line)
+            token_class = lexer_tokens[match.lastgroup]
+            if token_class is not tokens.SpaceToken:
+                tokens_append(token_class(match))
+            pos = match.end()
         return tokens_line
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import re
+
 from six import python_2_unicode_compatible
 
 from efc.utils import col_str_to_index
@@ -16,14 +18,50 @@ __all__ = ('FloatToken', 'IntToken', 'BoolToken',
            'OperandToken', 'OperationToken', 'ArithmeticToken')
 
 
+# token class -> compiled pattern of the token, values of tokens are parsed by it on first use
+TOKEN_REGEXPS = {}
+
+NOT_PARSED = object()
+
+
 @python_2_unicode_compatible
 class Token(object):
+    """
+    Token keeps the line and the span of the token, the value is parsed on first use
+    """
+    __slots__ = ('line', 'start', 'end', '_value')
+
     pattern = None
+    # pattern of the first symbol of the token, None if the token may start with any symbol
+    start_pattern = None
 
     def __init__(self, match):
-        self._match = match
-        self.src_value = match.group(0)
-        self.token_value = self.get_value(match.groupdict())
+        self.line = match.string
+        self.start = match.start()
+        self.end = match.end()
+        self._value = NOT_PARSED
+
+    @classmethod
+    def get_regexp(cls):
+        try:
+            return TOKEN_REGEXPS[cls]
+        except KeyError:
+            regexp = TOKEN_REGEXPS[cls] = re.compile(cls.get_group_pattern(), flags=re.UNICODE)
+            return regexp
+
+    @property
+    def src_value(self):
+        return self.line[self.start:self.end]
+
+    @property
+    def token_value(self):
+        value = self._value
+        if value is NOT_PARSED:
+            # the pattern is matched from the start of the token in the whole line,
+            # so \b and lookahead assertions see the same symbols as the lexer
+            match = self.get_regexp().match(self.line, self.start)
+            value = self._value = self.get_value(match.groupdict())
+        return value
 
     @classmethod
     def get_group_pattern(cls):
@@ -32,16 +70,26 @@ class Token(object):
     def get_value(self, m):
         return m[self.__class__.__name__]
 
+    def relative_value(self, row, column):
+        """
+        Token value which does not depend on the cell with formula
+        :type row: int
+        :type column: int
+        """
+        return self.src_value
+
     def __str__(self):
         return '<%s, %s>' % (self.__class__.__name__, self.token_value)
 
 
 class OperandToken(Token):
-    pass
+    __slots__ = ()
 
 
 class FloatToken(OperandToken):
+    __slots__ = ()
     pattern = r'(?P<float_value>\d+\.\d+)((?P<float_percent>%)|\b)'
+    start_pattern = r'\d'
 
     def get_value(self, m):
         v = float(m['float_value'])
@@ -51,7 +99,9 @@ class FloatToken(OperandToken):
 
 
 class IntToken(OperandToken):
+    __slots__ = ()
     pattern = r'(?P<int_value>\d+)((?P<int_percent>%)|\b)'
+    start_pattern = r'\d'
 
     def get_value(self, m):
         v = int(m['int_value'])
@@ -61,20 +111,42 @@ class IntToken(OperandToken):
 
 
 class BoolToken(OperandToken):
+    __slots__ = ()
     pattern = r'\b(TRUE|FALSE)\b'
+    start_pattern = r'[TF]'
 
     def get_value(self, m):
         return super(BoolToken, self).get_value(m) == 'TRUE'
 
 
 class StringToken(OperandToken):
+    __slots__ = ()
     pattern = r'"[^"]*"'
+    start_pattern = r'"'
 
     def get_value(self, m):
         return super(StringToken, self).get_value(m)[1:-1]
 
 
+def r1c1_part(prefix, value, fixed, base):
+    """
+    R1C1 notation of address part
+    :type prefix: basestring
+    :type value: int | None
+    :type fixed: bool
+    :type base: int
+    """
+    if value is None:
+        return ''
+    elif fixed:
+        return '%s%d' % (prefix, value)
+    else:
+        return '%s[%d]' % (prefix, value - base)
+
+
 class AddressToken(OperandToken):
+    __slots__ = ()
+
     @staticmethod
     def clean_ws_name(v):
         if v and v.startswith('\''):
@@ -86,8 +158,10 @@ class AddressToken(OperandToken):
 
 
 class SingleCellToken(AddressToken):
+    __slots__ = ()
     pattern = (r"((?P<q1>')?(\[(?P<s_doc>\w+)\])?(?P<single_ws_name>(?(q1)[^']|\w)+)?(?(q1)'|)!)?"
                r"(?P<column_fixed>\$)?(?P<column>[A-Z]+)(?P<row_fixed>\$)?(?P<row>[0-9]+)\b")
+    start_pattern = r"[\w'\[!$]"
 
     def get_value(self, m):
         return {
@@ -98,11 +172,19 @@ class SingleCellToken(AddressToken):
             'column_fixed': bool(m['column_fixed']),
         }
 
+    def relative_value(self, row, column):
+        v = self.token_value
+        return '%s!%s%s' % (v['ws_name'] or '',
+                            r1c1_part('R', v['row'], v['row_fixed'], row),
+                            r1c1_part('C', v['column'], v['column_fixed'], column))
+
 
 class CellsRangeToken(AddressToken):
+    __slots__ = ()
     pattern = (r"((?P<q2>')?(\[(?P<r_doc>\w+)\])?(?P<range_ws_name>(?(q2)[^']|\w)+)?(?(q2)'|)!)?"
                r"((?P<column1_fixed>\$)?(?P<column1>[A-Z]+))?((?P<row1_fixed>\$)?(?P<row1>[0-9]+))?"
                r":((?P<column2_fixed>\$)?(?P<column2>[A-Z]+))?((?P<row2_fixed>\$)?(?P<row2>[0-9]+))?\b")
+    start_pattern = r"[\w'\[!$:]"
 
     def get_value(self, m):
         return {
@@ -117,10 +199,20 @@ class CellsRangeToken(AddressToken):
             'column2_fixed': bool(m['column2_fixed']),
         }
 
+    def relative_value(self, row, column):
+        v = self.token_value
+        return '%s!%s%s:%s%s' % (v['ws_name'] or '',
+                                 r1c1_part('R', v['row1'], v['row1_fixed'], row),
+                                 r1c1_part('C', v['column1'], v['column1_fixed'], column),
+                                 r1c1_part('R', v['row2'], v['row2_fixed'], row),
+                                 r1c1_part('C', v['column2'], v['column2_fixed'], column))
+
 
 class NamedRangeToken(AddressToken):
+    __slots__ = ()
     pattern = (r"((?P<q3>')?(\[(?P<n_doc>\w+)\])?(?P<named_range_ws_name>(?(q3)[^']|\w)+)?(?(q3)'|)!)?"
                r"(?P<range_name>\w+)")
+    start_pattern = r"[\w'\[!]"
 
     def get_value(self, m):
         return {
@@ -130,79 +222,113 @@ class NamedRangeToken(AddressToken):
 
 
 class OperationToken(Token):
-    pass
+    __slots__ = ()
 
 
 class FunctionToken(OperationToken):
+    __slots__ = ()
     pattern = r'(?P<prefix>_(xlfn|xludf)\.)?(?P<func_name>[A-Z]+)(?=\()'
+    start_pattern = r'[_A-Z]'
 
     def get_value(self, m):
         return m['func_name']
 
 
 class ArithmeticToken(OperationToken):
-    pass
+    __slots__ = ()
 
 
 class AddToken(ArithmeticToken):
+    __slots__ = ()
     pattern = r'\+'
+    start_pattern = pattern
 
 
 class SubtractToken(ArithmeticToken):
+    __slots__ = ()
     pattern = r'\-'
+    start_pattern = pattern
 
 
 class DivideToken(ArithmeticToken):
+    __slots__ = ()
     pattern = r'/'
+    start_pattern = pattern
 
 
 class MultiplyToken(ArithmeticToken):
+    __slots__ = ()
     pattern = r'\*'
+    start_pattern = pattern
 
 
 class ConcatToken(ArithmeticToken):
+    __slots__ = ()
     pattern = r'\&'
+    start_pattern = pattern
 
 
 class ExponentToken(ArithmeticToken):
+    __slots__ = ()
     pattern = r'\^'
+    start_pattern = pattern
 
 
 class CompareNotEqToken(ArithmeticToken):
+    __slots__ = ()
     pattern = r'\<\>'
+    start_pattern = r'\<'
 
 
 class CompareGTEToken(ArithmeticToken):
+    __slots__ = ()
     pattern = r'\>\='
+    start_pattern = r'\>'
 
 
 class CompareLTEToken(ArithmeticToken):
+    __slots__ = ()
     pattern = r'\<\='
+    start_pattern = r'\<'
 
 
 class CompareGTToken(ArithmeticToken):
+    __slots__ = ()
     pattern = r'\>'
+    start_pattern = pattern
 
 
 class CompareLTToken(ArithmeticToken):
+    __slots__ = ()
     pattern = r'\<'
+    start_pattern = pattern
 
 
 class CompareEqToken(ArithmeticToken):
+    __slots__ = ()
     pattern = r'\='
+    start_pattern = pattern
 
 
 class LeftBracketToken(Token):
+    __slots__ = ()
     pattern = r'\('
+    start_pattern = pattern
 
 
 class RightBracketToken(Token):
+    __slots__ = ()
     pattern = r'\)'
+    start_pattern = pattern
 
 
 class SpaceToken(Token):
+    __slots__ = ()
     pattern = r'[ \n]+'
+    start_pattern = r'[ \n]'
 
 
 class Separator(Token):
+    __slots__ = ()
     pattern = r','
+    start_pattern = pattern
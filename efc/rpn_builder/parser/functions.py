@@ -3,24 +3,28 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import re
 from abc import ABCMeta
+from bisect import bisect_left, bisect_right
 from calendar import isleap, monthrange
 from collections import defaultdict
 from functools import wraps
 from itertools import chain, groupby
 
 from six import add_metaclass, integer_types, iteritems, string_types, text_type
-from six.moves import range, zip_longest
+from six.moves import range, zip, zip_longest
 
+from efc.interfaces.aggregates import BLANK_VALUES, get_block_aggregates, get_line_aggregates
 from efc.rpn_builder.parser.operands import (
     BadReference,
     CellRangeOperand,
     CellSetOperand,
+    CellsOperand,
     EmptyOperand,
     ErrorOperand,
     HyperlinkOperand,
     NamedRangeOperand,
     NotFoundErrorOperand,
     NumErrorOperand,
+    RangeValues,
     RPNOperand,
     SetOperand,
     SimpleOperand,
@@ -29,7 +33,7 @@ from efc.rpn_builder.parser.operands import (
     ValueErrorOperand,
     ValueNotAvailable,
 )
-from efc.utils import is_float, parse_date
+from efc.utils import digit, is_float, parse_date
 
 __all__ = ('EXCEL_FUNCTIONS',)
 
@@ -120,23 +124,34 @@ class FunctionsCompare(CompareAbstract):
         return all(getattr(op1.linked_cell, key) == getattr(op2.linked_cell, key)
                    for key in ('row', 'column', 'source', 'ws_name'))
 
+    @property
+    def symbol(self):
+        return self._symbol
+
+    def get_check_types(self, op2):
+        """
+        Types of the criteria value compared with items
+        :rtype: list
+        """
+        op2_type = self._get_op_type(op2)
+        check = [op2_type]
+        if self._check_2_types:
+            if op2_type[0] == 0:
+                tmp = SimpleOperand(str(op2.value))
+            elif op2_type[0] == 1:
+                tmp = SimpleOperand(float(op2.value))
+            else:
+                tmp = SimpleOperand({True: 'TRUE', False: 'FALSE'}[op2.value])
+            check.append(self._get_op_type(tmp))
+        return check
+
     def __call__(self, op1, op2):
         op1_type = self._get_op_type(op1)
-        op2_type = self._get_op_type(op2)
 
         if self._same_linked_cell(op1, op2):
             res = self._func(op1_type, op1_type)
         else:
-            check = [op2_type]
-            if self._check_2_types:
-                if op2_type[0] == 0:
-                    tmp = SimpleOperand(str(op2.value))
-                elif op2_type[0] == 1:
-                    tmp = SimpleOperand(float(op2.value))
-                else:
-                    tmp = SimpleOperand({True: 'TRUE', False: 'FALSE'}[op2.value])
-                check.append(self._get_op_type(tmp))
-
+            check = self.get_check_types(op2)
             res = False
             for check_op_type in check:
                 if self._symbol in ('<>', '='):
@@ -284,17 +299,139 @@ def iter_elements(*args):
             yield arg
 
 
-def iter_digits(*args):
-    for op in iter_elements(*args):
-        if not op.is_blank:
+def get_range_values(op):
+    """
+    Values block of the range, operands of other types are iterated by cells
+    :rtype: RangeValues | None
+    """
+    if isinstance(op, CellRangeOperand) and op.source is not None and op.source._has_worksheet(op.ws_name):
+        return op.values_block
+    return None
+
+
+def iter_values_digits(block):
+    """
+    Digits of populated cells, blank cells are skipped like by the scan of operands
+    :type block: RangeValues
+    """
+    if block.tag in {RangeValues.NUMBERS, RangeValues.BLANK}:
+        for value in block.values:
+            if value is not None and value != '':
+                yield value
+        return
+
+    for value in block.values:
+        if value not in BLANK_VALUES:
             try:
-                yield op.digit
+                d = digit(value)
             except (ValueError, TypeError):
-                pass
+                continue
+            yield d
+
+
+def iter_digits(*args):
+    for arg in args:
+        if isinstance(arg, RPNOperand):
+            arg = arg.evaluated_value
+
+        block = get_range_values(arg)
+        if block is not None:
+            for d in iter_values_digits(block):
+                yield d
+            continue
+
+        for op in iter_elements(arg):
+            if not op.is_blank:
+                try:
+                    yield op.digit
+                except (ValueError, TypeError):
+                    pass
+
+
+def call_range_aggregates(op, method):
+    """
+    Results of the aggregates method for the range: prefix sums of the row or the column for ranges in one line,
+    summed-area tables of the worksheet for others if the source uses them and prefix sums of columns otherwise.
+    Aggregates are used only with the cache.
+    :rtype: list | None
+    """
+    if not isinstance(op, CellRangeOperand) or op.source is None or not op.source._caches:
+        return None
+    if None in (op.row1, op.row2, op.column1, op.column2) or op.row1 > op.row2 or op.column1 > op.column2:
+        return None
+    if not op.source._has_worksheet(op.ws_name):
+        return None
+
+    if op.row1 == op.row2 and op.column1 != op.column2:
+        result = getattr(get_line_aggregates(op.source, op.ws_name, True, op.row1), method)(
+            op.column1, op.column2)
+        return None if result is None else [result]
+
+    if op.column1 != op.column2 and op.source._block_aggregates:
+        result = getattr(get_block_aggregates(op.source, op.ws_name), method)(
+            op.row1, op.column1, op.row2, op.column2)
+        if result is not None:
+            return [result]
+
+    # ranges with formula cells are calculated by columns, only cells of the range are calculated
+    results = []
+    for column in range(op.column1, op.column2 + 1):
+        result = getattr(get_line_aggregates(op.source, op.ws_name, False, column), method)(
+            op.row1, op.row2)
+        if result is None:
+            return None
+        results.append(result)
+    return results
+
+
+def split_aggregate_args(args, method):
+    """
+    Results of the aggregates method for ranges and arguments which are scanned
+    :rtype: (list, list)
+    """
+    results, rest = [], []
+    for arg in args:
+        if isinstance(arg, RPNOperand):
+            arg = arg.evaluated_value
+
+        arg_results = call_range_aggregates(arg, method)
+        if arg_results is None:
+            rest.append(arg)
+        else:
+            results.extend(arg_results)
+    return results, rest
+
+
+def sum_digits(args):
+    """
+    Sum and count of digits of arguments. Digits are added one by one in order of arguments,
+    sums of ranges are taken from aggregates only when they are the same as sums of the scan.
+    :rtype: (int | float, int)
+    """
+    total = count = 0
+    for arg in args:
+        if isinstance(arg, RPNOperand):
+            arg = arg.evaluated_value
+
+        parts = call_range_aggregates(arg, 'get_part')
+        if parts is not None and isinstance(total, integer_types):
+            if all(part.exact for part in parts):
+                # sums of integers do not depend on the order
+                total += sum(part.integer for part in parts)
+                count += sum(part.digits for part in parts)
+                continue
+            elif len(parts) == 1 and parts[0].sequential is not None and total == 0:
+                total, count = parts[0].sequential, count + parts[0].digits
+                continue
+
+        for d in iter_digits(arg):
+            total += d or 0
+            count += 1
+    return total, count
 
 
 def sum_func(*args):
-    return sum(d or 0 for d in iter_digits(*args))
+    return sum_digits(args)[0]
 
 
 def mod_func(op1, op2):
@@ -445,25 +582,197 @@ def floor_function(a, multiple):
 
 
 def count_function(*args):
-    return len([op for op in iter_elements(*args) if isinstance(op.value, (integer_types, float))])
+    counts, args = split_aggregate_args(args, 'get_count')
+    count = sum(counts)
+    for arg in args:
+        block = get_range_values(arg)
+        if block is None:
+            count += len([op for op in iter_elements(arg) if isinstance(op.value, (integer_types, float))])
+            continue
+        count += len([v for v in block.values if isinstance(v, (integer_types, float))])
+    return count
 
 
 def abs_function(a):
     return abs(a.digit)
 
 
-def match_function(op1, r, match_type=1):
-    if isinstance(match_type, EmptyOperand):
-        match_type = None
+class ExactMatchIndex(object):
+    """
+    First positions of values in the range, it is used instead of comparing every item with "=".
+    Keys are the same as the types built by SimpleCompare.
+    """
 
-    match_type = 0 if match_type is None else int(match_type)
+    def __init__(self, r):
+        self._positions = {}
+        self._error = None
 
-    if match_type == 1:
-        match_idx = None
-        if isinstance(r, CellRangeOperand) and r.is_multidim:
-            raise NotFoundErrorOperand
+        positions = self._positions
+        for idx, item in enumerate_used(r):
+            try:
+                value = item.value
+            except ErrorOperand as err:
+                # items after the error are never compared
+                self._error = err
+                break
 
+            if value is None:
+                positions.setdefault((0, 0), idx)
+                if not isinstance(item, SingleCellOperand) or item.linked_cell == item:
+                    positions.setdefault((1, ''), idx)
+            else:
+                positions.setdefault((CompareAbstract.get_type_id(value), value), idx)
+
+    def find(self, op, match_type=0):
+        """
+        :param op: operand with not None value
+        :type match_type: int
+        :rtype: int | None
+        """
+        value = op.value
+        idx = self._positions.get((CompareAbstract.get_type_id(value), value))
+        if idx is None and self._error is not None:
+            raise self._error
+        return idx
+
+
+class ApproximateMatchIndex(object):
+    """
+    Sorted keys snapshot of the range for MATCH with match_type 1 and -1. Range scan always stops at the first
+    item greater than the lookup value, it is found by bisection of the prefix maximums of item keys.
+    Keys are the same as the types built by SimpleCompare.
+    """
+
+    def __init__(self, r):
+        self._items = []
+        self._error = None
+        self._snapshots = {}
+
+        items = self._items
+        for item in r:
+            try:
+                value = item.value
+            except ErrorOperand as err:
+                # items after the error are never compared
+                self._error = err
+                break
+            # blank cells linked to other cells are compared as 0 with strings too
+            items.append((value, value is not None or not isinstance(item, SingleCellOperand) or
+                          item.linked_cell == item))
+
+    def _snapshot(self, string_lookup):
+        """
+        Prefix maximums and positions of keys, None when keys are not comparable
+        :type string_lookup: bool
+        :rtype: tuple | None
+        """
+        try:
+            return self._snapshots[string_lookup]
+        except KeyError:
+            pass
+
+        blank_key = (1, '') if string_lookup else (0, 0)
+        maximums = []
+        positions = defaultdict(list)
+        current = None
+        try:
+            for idx, (value, is_blank_string) in enumerate(self._items, 1):
+                if value is not None:
+                    key = (CompareAbstract.get_type_id(value), value)
+                elif is_blank_string:
+                    key = blank_key
+                else:
+                    key = (0, 0)
+
+                if current is None or key > current:
+                    current = key
+                maximums.append(current)
+                positions[key].append(idx)
+        except TypeError:
+            snapshot = None
+        else:
+            snapshot = (maximums, positions)
+        self._snapshots[string_lookup] = snapshot
+        return snapshot
+
+    def find(self, op, match_type):
+        """
+        Same result as the scan of the range, TypeError is raised if keys can not be ordered
+        :param op: operand with not None value
+        :type match_type: int
+        :rtype: int | None
+        """
+        value = op.value
+        snapshot = self._snapshot(isinstance(value, string_types))
+        if snapshot is None:
+            raise TypeError('Range values can not be ordered')
+
+        maximums, positions = snapshot
+        key = (CompareAbstract.get_type_id(value), value)
+        greater_idx = bisect_right(maximums, key) + 1
+        if greater_idx > len(maximums):
+            if self._error is not None:
+                raise self._error
+            greater_idx = None
+
+        if match_type == -1:
+            return greater_idx
+
+        key_positions = positions.get(key, ())
+        if greater_idx is None:
+            return key_positions[-1] if key_positions else None
+        prev_count = bisect_left(key_positions, greater_idx)
+        return key_positions[prev_count - 1] if prev_count else None
+
+
+def get_lookup_index(r, index_type, build=True):
+    """
+    Lookup index of the range from the cache, indexes are not built without the cache
+    :type r: CellRangeOperand
+    :param build: build the index if it is not in the cache, otherwise None is returned
+    """
+    if not isinstance(r, CellRangeOperand) or r.source is None or not r.source._caches:
+        return None
+
+    cache = r.source._caches['lookup']
+    key = (r.ws_name, r.row1, r.column1, r.row2, r.column2, index_type)
+    index = cache.get(key)
+    if index is None and build:
+        index = cache[key] = index_type(r)
+    return index
+
+
+def has_used_range(r):
+    """Range of the worksheet, its blank cells after the last used cell are not iterated"""
+    return isinstance(r, CellRangeOperand) and r.source is not None and r.source._has_worksheet(r.ws_name)
+
+
+def enumerate_used(r):
+    """
+    1-based positions and items of the range for scans which stop at the first match or keep the last one.
+    Blank cells after the last used cell of the range are compared the same way,
+    so only the first and the last of them are returned.
+    """
+    if not has_used_range(r):
         for idx, item in enumerate(r, 1):
+            yield idx, item
+        return
+
+    for idx, item in enumerate(r.get_used_iter(), 1):
+        yield idx, item
+
+    start, end = r.used_size + 1, r.size
+    if start <= end:
+        item = r.get_item(start)
+        yield start, item
+        if end > start:
+            yield end, item
+
+
+def match_scan(op1, r, match_type):
+    if match_type == 1:
+        match_idx = None
+        for idx, item in enumerate_used(r):
             if EXCEL_FUNCTIONS['>'](item, op1):
                 if match_idx is not None:
                     break
@@ -471,21 +780,37 @@ def match_function(op1, r, match_type=1):
                     raise NotFoundErrorOperand
             elif EXCEL_FUNCTIONS['='](item, op1):
                 match_idx = idx
-        if match_idx is None:
-            raise NotFoundErrorOperand
-        idx = match_idx
+        return match_idx
     elif match_type == -1:
-        for idx, item in enumerate(r, 1):
+        for idx, item in enumerate_used(r):
             if EXCEL_FUNCTIONS['>'](item, op1):
-                break
-        else:
-            idx = None
+                return idx
     else:
-        for idx, item in enumerate(r, 1):
+        for idx, item in enumerate_used(r):
             if EXCEL_FUNCTIONS['='](item, op1):
-                break
-        else:
-            idx = None
+                return idx
+    return None
+
+
+def match_function(op1, r, match_type=1):
+    if isinstance(match_type, EmptyOperand):
+        match_type = None
+
+    match_type = 0 if match_type is None else int(match_type)
+
+    if match_type == 1 and isinstance(r, CellRangeOperand) and r.is_multidim:
+        raise NotFoundErrorOperand
+
+    index = get_lookup_index(r, ApproximateMatchIndex if match_type in (1, -1) else ExactMatchIndex)
+    use_scan = index is None or op1.value is None
+    if not use_scan:
+        try:
+            idx = index.find(op1, match_type)
+        except TypeError:
+            # values can not be ordered, the scan gives the same result as without the index
+            use_scan = True
+    if use_scan:
+        idx = match_scan(op1, r, match_type)
     if idx is None:
         raise NotFoundErrorOperand()
     return idx
@@ -522,10 +847,21 @@ def get_check_function(expr):
 
 def countif_function(cells, expr):
     check, operand = get_check_function(expr)
-    return len([op for op in cells.value if check(op, operand)])
+    if not has_used_range(cells) or isinstance(operand, SingleCellOperand):
+        return len([op for op in cells.value if check(op, operand)])
+
+    count = len([op for op in cells.get_used_iter() if check(op, operand)])
+    # blank cells after the last used cell
+    tail_size = cells.size - cells.used_size
+    if tail_size and check(cells.get_item(cells.used_size + 1), operand):
+        count += tail_size
+    return count
 
 
 def counta_function(cells):
+    block = get_range_values(cells)
+    if block is not None:
+        return len([v for v in block.values if v is not None])
     return len([op for op in cells.value if op.value is not None])
 
 
@@ -544,48 +880,401 @@ def get_checks_from_args(args):
     return checks
 
 
+def positions_to_mask(positions, size):
+    """
+    Bitmap with bits of 1-based positions of the range
+    :type size: int
+    :rtype: int
+    """
+    bits = bytearray(b'0' * (size + 1))
+    for idx in positions:
+        bits[size - idx] = 49  # "1"
+    return int(bytes(bits), 2)
+
+
+def iter_mask(mask):
+    """Positions of the bitmap in ascending order"""
+    bits = bin(mask)[:1:-1]
+    idx = bits.find('1')
+    while idx != -1:
+        yield idx
+        idx = bits.find('1', idx + 1)
+
+
+def mask_count(mask):
+    return bin(mask).count('1')
+
+
+def runs_to_mask(runs, size):
+    """
+    Bitmap with bits of runs of 1-based positions
+    :type runs: list[(int, int)]
+    :type size: int
+    :rtype: int
+    """
+    bits = bytearray(b'0' * (size + 1))
+    for start, end in runs:
+        bits[size - end:size - start + 1] = b'1' * (end - start + 1)
+    return int(bytes(bits), 2)
+
+
+def mask_items(op, mask):
+    """Items of the operand selected by the bitmap"""
+    if isinstance(op, CellRangeOperand) and op.source is not None and op.source._has_worksheet(op.ws_name):
+        # the range is not iterated
+        size = op.size
+        for idx in iter_mask(mask):
+            if idx > size:
+                break
+            yield op.get_item(idx)
+        return
+
+    items = op.cached_iterable_items if isinstance(op, CellsOperand) else list(op)
+    size = len(items)
+    for idx in iter_mask(mask):
+        if idx > size:
+            break
+        yield items[idx - 1]
+
+
+def ifs_scan(op_range, check, expr):
+    """
+    Bitmap of the range items matching the criteria
+    :rtype: int
+    """
+    check_good_indexes = []
+    idx = 0
+    used_range = has_used_range(op_range)
+    for idx, item in enumerate(op_range.get_used_iter() if used_range else op_range, 1):
+        if item is None:
+            raise ValueErrorOperand
+        else:
+            # convert expr value to item type
+            if isinstance(item.value, string_types) and not isinstance(expr.value, string_types):
+                expr = SimpleOperand(expr.string)
+            elif isinstance(item.value, (integer_types, float)) and not isinstance(expr.value,
+                                                                                   (integer_types, float)):
+                try:
+                    expr = SimpleOperand(expr.digit)
+                except ValueError:
+                    pass
+
+            if check(item, expr):
+                check_good_indexes.append(idx)
+
+    if not used_range or op_range.used_size == op_range.size:
+        return positions_to_mask(check_good_indexes, idx)
+
+    # blank cells after the last used cell do not convert the criteria value
+    start, size = op_range.used_size + 1, op_range.size
+    if isinstance(expr, SingleCellOperand):
+        # blank cells can be linked to the criteria cell
+        check_good_indexes.extend(i for i in range(start, size + 1) if check(op_range.get_item(i), expr))
+    elif check(op_range.get_item(start), expr):
+        return positions_to_mask(check_good_indexes, size) | runs_to_mask([(start, size)], size)
+    return positions_to_mask(check_good_indexes, size)
+
+
+class CriteriaIndex(object):
+    """
+    Positions of range values for COUNTIFS, SUMIFS and AVERAGEIFS criteria. The scan converts the criteria value
+    to the type of string and number items and keeps it for the next items, so the index keeps the kind of the
+    last converting item before every item which is not a string or a number.
+    Positions dict is also the histogram of values used to order criteria by selectivity.
+    Only populated cells of worksheet ranges are read, other cells are kept as runs of blank positions.
+    """
+    STRING = 1
+    NUMBER = 0
+    INITIAL_STATE = (None, False, False)
+
+    def __init__(self, r):
+        self._usable = True
+        self._positions = defaultdict(list)
+        self._blanks = defaultdict(list)
+        self._gaps = defaultdict(list)
+        self._others = []
+        self._sorted = {}
+        self._all = {}
+        self._size = 0
+        self._range = None
+        self._indexes = []
+        self._items = []
+        self._states = []
+
+        if isinstance(r, CellRangeOperand) and r.source is not None and r.source._has_worksheet(r.ws_name):
+            self._range = r
+            items = ((position + 1, r.cell_from_info(row, column, cell_info))
+                     for position, row, column, cell_info in r.iter_populated_cells())
+        else:
+            items = enumerate(r, 1)
+
+        last_kind = None
+        seen_string = seen_number = False
+        state = self.INITIAL_STATE
+        states = {state: state}
+        for idx, item in items:
+            if idx > self._size + 1:
+                self._gaps[state].append((self._size + 1, idx - 1))
+
+            try:
+                if item is None:
+                    raise ValueErrorOperand
+                value = item.value
+            except ErrorOperand:
+                # the scan raises the error
+                self._usable = False
+                break
+
+            if isinstance(value, string_types):
+                last_kind, seen_string = self.STRING, True
+            elif isinstance(value, (integer_types, float)):
+                last_kind, seen_number = self.NUMBER, True
+
+            state = (last_kind, seen_number, seen_string)
+            state = states.setdefault(state, state)
+            self._indexes.append(idx)
+            self._items.append(item)
+            self._states.append(state)
+            if value is None:
+                self._blanks[state + (item.linked_cell == item,)].append((idx, item))
+            elif isinstance(value, (string_types, integer_types, float)) and not isinstance(value, bool):
+                self._positions[(CompareAbstract.get_type_id(value), value)].append(idx)
+            else:
+                self._others.append((idx, item, state))
+            self._size = idx
+        else:
+            if self._range is not None and self._range.size > self._size:
+                self._gaps[state].append((self._size + 1, self._range.size))
+                self._size = self._range.size
+
+    def _get_item(self, idx):
+        """Item and its state by the position"""
+        if self._range is None:
+            return self._items[idx - 1], self._states[idx - 1]
+
+        i = bisect_right(self._indexes, idx) - 1
+        if i >= 0 and self._indexes[i] == idx:
+            return self._items[i], self._states[i]
+        # the blank cell has the state of the previous item
+        return self._range.get_item(idx), self._states[i] if i >= 0 else self.INITIAL_STATE
+
+    def _sorted_keys(self, type_id):
+        try:
+            return self._sorted[type_id]
+        except KeyError:
+            keys = sorted(key for key in self._positions if key[0] == type_id)
+            self._sorted[type_id] = keys
+            return keys
+
+    def _all_mask(self, type_id):
+        try:
+            return self._all[type_id]
+        except KeyError:
+            mask = self._all[type_id] = positions_to_mask(chain.from_iterable(
+                positions for key, positions in iteritems(self._positions) if key[0] == type_id), self._size)
+            return mask
+
+    def _find_values(self, check, expr, type_id):
+        """Bitmap of string or number items"""
+        if not self._all_mask(type_id):
+            return 0
+
+        symbol = check.symbol
+        if symbol == '=':
+            return positions_to_mask(chain.from_iterable(
+                self._positions.get(key, ()) for key in check.get_check_types(expr) if key[0] == type_id), self._size)
+        elif symbol == '<>':
+            key = check.get_check_types(expr)[0]
+            return self._all_mask(type_id) & ~positions_to_mask(self._positions.get(key, ()), self._size)
+
+        key = check.get_check_types(expr)[0]
+        if key[0] != type_id:
+            return 0
+
+        keys = self._sorted_keys(type_id)
+        if symbol == '>':
+            keys = keys[bisect_right(keys, key):]
+        elif symbol == '>=':
+            keys = keys[bisect_left(keys, key):]
+        elif symbol == '<':
+            keys = keys[:bisect_left(keys, key)]
+        else:
+            keys = keys[:bisect_right(keys, key)]
+        return positions_to_mask(chain.from_iterable(self._positions[key] for key in keys), self._size)
+
+    @property
+    def usable(self):
+        return self._usable
+
+    @property
+    def size(self):
+        return self._size
+
+    def _get_state_expr(self, expr):
+        """
+        Function returning the criteria value used by the scan for the state of the item,
+        None if the index can not be used for the criteria
+        """
+        value = expr.value
+        if not self._usable or isinstance(value, bool) or not isinstance(value, (string_types, integer_types, float)):
+            return None
+
+        # the criteria value used after the string and the number items
+        if isinstance(value, string_types):
+            string_expr = expr
+            try:
+                number_expr = SimpleOperand(expr.digit)
+            except ValueError:
+                number_expr = None
+            else:
+                if SimpleOperand(number_expr.string).value != value:
+                    return None
+            first_kind = self.NUMBER
+        else:
+            string_expr = SimpleOperand(expr.string)
+            try:
+                number_expr = SimpleOperand(string_expr.digit)
+            except ValueError:
+                # the value is not converted back after strings, it is the same for ranges without strings
+                if self._all_mask(self.STRING):
+                    return None
+                number_expr = None
+            else:
+                if number_expr.value != value or SimpleOperand(number_expr.string).value != string_expr.value:
+                    return None
+            first_kind = self.STRING
+
+        def state_expr(state):
+            last_kind, seen_number, seen_string = state
+            if number_expr is None or not (seen_number if first_kind == self.NUMBER else seen_string):
+                return expr
+            elif last_kind == self.NUMBER:
+                return number_expr
+            return SimpleOperand(number_expr.string) if first_kind == self.NUMBER else string_expr
+
+        state_expr.string_expr = string_expr
+        state_expr.number_expr = expr if number_expr is None else number_expr
+        return state_expr
+
+    def estimate(self, check, expr):
+        """
+        Estimated count of matching items: exact count of values for "=" criteria and the range size for others,
+        None if the index can not be used for the criteria
+        :rtype: int | None
+        """
+        if self._get_state_expr(expr) is None:
+            return None
+        elif check.symbol != '=':
+            return self._size
+
+        count = sum(len(self._positions.get(key, ())) for key in check.get_check_types(expr))
+        if expr.value == '':
+            count += sum(len(items) for items in self._blanks.values())
+            count += sum(end - start + 1 for runs in self._gaps.values() for start, end in runs)
+        return count
+
+    def find(self, check, expr, mask=None):
+        """
+        Same result as ifs_scan or None if the index can not be used for the criteria.
+        If the mask is passed only its positions are checked.
+        :type check: FunctionsCompare
+        :type mask: int | None
+        :rtype: int | None
+        """
+        state_expr = self._get_state_expr(expr)
+        if state_expr is None:
+            return None
+
+        if mask is not None:
+            positions = []
+            for idx in iter_mask(mask):
+                if idx > self._size:
+                    break
+                item, state = self._get_item(idx)
+                if check(item, state_expr(state)):
+                    positions.append(idx)
+            return positions_to_mask(positions, self._size)
+
+        positions = []
+        runs = []
+        for state, state_runs in iteritems(self._gaps):
+            item_expr = state_expr(state)
+            if isinstance(item_expr, SingleCellOperand):
+                positions.extend(idx for start, end in state_runs for idx in range(start, end + 1)
+                                 if check(self._range.get_item(idx), item_expr))
+            elif check(self._range.get_item(state_runs[0][0]), item_expr):
+                runs.extend(state_runs)
+        for key, items in iteritems(self._blanks):
+            item_expr = state_expr(key[:3])
+            if isinstance(item_expr, SingleCellOperand):
+                # blank cells can be linked to the criteria cell
+                positions.extend(idx for idx, item in items if check(item, item_expr))
+            elif check(items[0][1], item_expr):
+                positions.extend(idx for idx, _ in items)
+        positions.extend(idx for idx, item, state in self._others if check(item, state_expr(state)))
+
+        return (positions_to_mask(positions, self._size) | runs_to_mask(runs, self._size) |
+                self._find_values(check, state_expr.string_expr, self.STRING) |
+                self._find_values(check, state_expr.number_expr, self.NUMBER))
+
+
 def ifs_indexes(*args):
+    """
+    Bitmap of positions matching all criteria
+    :rtype: int
+    """
     good_indexes = None
 
     checks = get_checks_from_args(args)
+    # building of an index reads the whole range, so criteria are ordered only by already built indexes,
+    # otherwise ranges after the criteria without matches are not read like in the scan
+    indexes = [get_lookup_index(op_range, CriteriaIndex, build=False) for op_range, _, _ in checks]
+    planned = all(index is not None and index.usable for index in indexes)
+    if planned:
+        # the scan of the criteria which is not indexed can raise the error, so it keeps its place
+        estimates = [index.estimate(check, expr) for (_, check, expr), index in zip(checks, indexes)]
+        planned = None not in estimates
+    if planned:
+        # without errors in ranges and criteria the order of criteria does not change the result,
+        # the most selective criteria goes first
+        order = sorted(range(len(checks)), key=estimates.__getitem__)
+        checks = [tuple(checks[i]) + (indexes[i],) for i in order]
+    else:
+        checks = [(op_range, check, expr, index) for (op_range, check, expr), index in zip(checks, indexes)]
 
-    for op_range, check, expr in checks:
+    for op_range, check, expr, index in checks:
         check_good_indexes = None
         key = None
         if op_range.source and isinstance(op_range, CellRangeOperand):
             cache = op_range.source._caches['ifs'] if op_range.source._caches is not None else None
 
             if cache is not None:
+                # TRUE and 1 are equal keys, but they are different criteria
                 key = (op_range.ws_name, op_range.row1, op_range.column1, op_range.row2,
-                       op_range.column2, check, expr.value)
+                       op_range.column2, check, type(expr.value), expr.value)
                 check_good_indexes = cache.get(key)
         else:
             cache = None
 
+        if check_good_indexes is None and planned and good_indexes is not None and \
+                mask_count(good_indexes) * 64 < index.size:
+            # few positions are left, only they are checked and the partial result is not cached
+            check_good_indexes = index.find(check, expr, good_indexes)
+            cache = None
+
         if check_good_indexes is None:
-            check_good_indexes = set()
-            for idx, item in enumerate(op_range, 1):
-                if item is None:
-                    raise ValueErrorOperand
-                else:
-                    # convert expr value to item type
-                    if isinstance(item.value, string_types) and not isinstance(expr.value, string_types):
-                        expr = SimpleOperand(expr.string)
-                    elif isinstance(item.value, (integer_types, float)) and not isinstance(expr.value,
-                                                                                           (integer_types, float)):
-                        try:
-                            expr = SimpleOperand(expr.digit)
-                        except ValueError:
-                            pass
-
-                    if check(item, expr):
-                        check_good_indexes.add(idx)
+            if index is None:
+                index = get_lookup_index(op_range, CriteriaIndex)
+            if index is not None:
+                check_good_indexes = index.find(check, expr)
+            if check_good_indexes is None:
+                check_good_indexes = ifs_scan(op_range, check, expr)
 
             if cache is not None:
                 cache[key] = check_good_indexes
 
         if good_indexes is None:
-            good_indexes = check_good_indexes.copy()
+            good_indexes = check_good_indexes
         else:
             good_indexes &= check_good_indexes
 
@@ -596,8 +1285,7 @@ def ifs_indexes(*args):
 
 
 def sum_ifs_function(op1, *args):
-    good_indexes = ifs_indexes(*args)
-    return sum_func(*(c for idx, c in enumerate(op1, 1) if idx in good_indexes))
+    return sum_func(*mask_items(op1, ifs_indexes(*args)))
 
 
 def sumproduct_function(op1, *args):
@@ -641,21 +1329,25 @@ def concatenate(*args):
 
 
 def average_function(*args):
-    values = list(iter_digits(*args))
-    return sum(values) / len(values)
+    total, count = sum_digits(args)
+    return total / count
 
 
 def average_ifs_function(op1, *args):
-    good_indexes = ifs_indexes(*args)
-    return average_function(*(c for idx, c in enumerate(op1, 1) if idx in good_indexes))
+    return average_function(*mask_items(op1, ifs_indexes(*args)))
 
 
 def count_blank_function(cells):
+    if isinstance(cells, RPNOperand):
+        cells = cells.evaluated_value
+    block = get_range_values(cells)
+    if block is not None:
+        return block.blanks_count
     return len([op for op in iter_elements(cells) if op.is_blank])
 
 
 def count_ifs_function(*args):
-    return len(ifs_indexes(*args))
+    return mask_count(ifs_indexes(*args))
 
 
 def offset_function(cell, row_offset, col_offset, height=None, width=None):
@@ -694,8 +1386,10 @@ def vlookup_function(op, rg, column, flag=None):
     if isinstance(flag, EmptyOperand):
         flag = None
 
-    first_col = rg.offset()
-    first_col.column2 = first_col.column1
+    first_col = CellRangeOperand(row1=rg.row1, column1=rg.column1, row2=rg.row2, column2=rg.column1,
+                                 row1_fixed=rg.row1_fixed, column1_fixed=rg.column1_fixed,
+                                 row2_fixed=rg.row2_fixed, column2_fixed=rg.column1_fixed,
+                                 ws_name=rg.ws_name, source=rg.source)
 
     op = operand_to_final_operand(op)
     if isinstance(op, (SetOperand, CellRangeOperand)):
@@ -722,8 +1416,10 @@ def hlookup_function(op, rg, row, flag=None):
     if isinstance(flag, EmptyOperand):
         flag = None
 
-    first_row = rg.offset()
-    first_row.row2 = first_row.row1
+    first_row = CellRangeOperand(row1=rg.row1, column1=rg.column1, row2=rg.row1, column2=rg.column2,
+                                 row1_fixed=rg.row1_fixed, column1_fixed=rg.column1_fixed,
+                                 row2_fixed=rg.row1_fixed, column2_fixed=rg.column2_fixed,
+                                 ws_name=rg.ws_name, source=rg.source)
 
     if flag is not None and flag.digit or flag is None:
         idx = match_function(op, first_row, 1)
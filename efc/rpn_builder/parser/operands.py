@@ -3,7 +3,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 from collections import defaultdict, namedtuple
 
-from six import add_metaclass, itervalues, python_2_unicode_compatible, text_type
+from six import add_metaclass, integer_types, itervalues, python_2_unicode_compatible, string_types, text_type
 from six.moves import range
 
 from efc import settings
@@ -17,7 +17,7 @@ __all__ = (
     'CellSetOperand', 'SimpleSetOperand', 'NamedRangeOperand', 'CellRangeOperand',
     'FunctionNotSupported', 'NotFoundErrorOperand', 'RPNOperand', 'OperandLikeObject', 'OffsetMixin',
     'SetOperand', 'BadReference', 'ValueNotAvailable', 'EmptyOperand', 'NamedRangeNotExist', 'NumErrorOperand',
-    'HyperlinkOperand',
+    'HyperlinkOperand', 'RangeValues',
 )
 
 CellAddress = namedtuple('CellAddress', ('ws_name', 'row', 'column', 'row_fixed', 'column_fixed'))
@@ -344,6 +344,63 @@ class SimpleSetOperand(SetOperand):
     operands_type = SimpleOperand
 
 
+class RangeValues(object):
+    """
+    Values of range cells. The block is built from populated cells, functions which need only values
+    do not create operands and do not iterate blank cells. The type tag is kept for not blank values.
+    """
+    BLANK, NUMBERS, STRINGS, MIXED = range(4)
+
+    def __init__(self, rows_count, columns_count, cells):
+        """
+        :param cells: 0-based positions and values of populated cells in order of rows
+        :type cells: list[(int, Any)]
+        """
+        self.rows_count = rows_count
+        self.columns_count = columns_count
+        self.cells = cells
+
+    @classmethod
+    def _get_tag(cls, values):
+        tags = set()
+        for value in values:
+            if value in {None, ''}:
+                continue
+            elif isinstance(value, bool):
+                return cls.MIXED
+            elif isinstance(value, (integer_types, float)):
+                tags.add(cls.NUMBERS)
+            elif isinstance(value, string_types):
+                tags.add(cls.STRINGS)
+            else:
+                return cls.MIXED
+        return cls.BLANK if not tags else tags.pop() if len(tags) == 1 else cls.MIXED
+
+    @cached_property
+    def values(self):
+        """Values of populated cells in order of rows"""
+        return [value for _, value in self.cells]
+
+    @cached_property
+    def tag(self):
+        return self._get_tag(self.values)
+
+    @property
+    def size(self):
+        return self.rows_count * self.columns_count
+
+    @cached_property
+    def blanks_count(self):
+        return self.size - len([value for value in self.values if value not in {None, ''}])
+
+    def __iter__(self):
+        """Values in the order of range cells"""
+        values = [None] * self.size
+        for position, value in self.cells:
+            values[position] = value
+        return iter(values)
+
+
 @add_metaclass(MetaCellRangeOperandCache)
 class CellRangeOperand(CellsOperand, OffsetMixin):
     def __init__(self, row1, column1, row2, column2,
@@ -376,66 +433,161 @@ class CellRangeOperand(CellsOperand, OffsetMixin):
     def max_row(self):
         return self.source._max_row(self.ws_name)
 
-    def _row_cells_generator(self, row, column1, column2):
-        for _ in range(column1, self.min_column):
-            yield BLANK_OPERAND
-
-        for c in range(max(self.min_column, column1), min(column2 + 1, self.max_column + 1)):
-            yield SingleCellOperand(row, c, ws_name=self.ws_name, source=self.source)
-
-        for _ in range(self.max_column + 1, column2 + 1):
-            yield BLANK_OPERAND
-
-    def get_rows_iter(self):
+    def _get_bounds(self):
+        """
+        Rows and columns of the range, whole rows and columns are bounded by the used area of the worksheet
+        :rtype: (int, int, int, int)
+        """
         row1 = self.min_row if self.row1 is None else self.row1
         row2 = self.max_row if self.row2 is None else self.row2
         column1 = self.min_column if self.column1 is None else self.column1
         column2 = self.max_column if self.column2 is None else self.column2
+        return row1, column1, row2, column2
 
-        for r in range(row1, self.min_row):
-            for _ in range(column1, column2 + 1):
-                yield r, BLANK_OPERAND
+    def _get_sheet_block(self, row1, column1, row2, column2):
+        """
+        Infos of the range cells inside of the used area of the worksheet, they are read by one call of the source
+        :rtype: (int, int, list[list[CellInfo]])
+        :return: first row, first column and rows of infos
+        """
+        top, left = max(self.min_row, row1), max(self.min_column, column1)
+        bottom, right = min(self.max_row, row2), min(self.max_column, column2)
+        if top > bottom or left > right:
+            return top, left, []
+        return top, left, self.source._get_range_values(self.ws_name, top, left, bottom, right)
 
-        for r in range(max(self.min_row, row1), min(row2 + 1, self.max_row + 1)):
-            for cell in self._row_cells_generator(r, column1, column2):
-                yield r, cell
+    def cell_from_info(self, row, column, cell_info):
+        """
+        :type cell_info: CellInfo
+        :rtype: SingleCellOperand
+        """
+        cell = SingleCellOperand(row, column, ws_name=self.ws_name, source=self.source)
+        if cell_info.formula is None and '_cell_info' not in cell.__dict__:
+            # the value is already read, formulas are calculated only when they are used
+            cell.__dict__['_cell_info'] = (cell_info.value, cell.cell_address)
+        return cell
 
-        for r in range(self.max_row + 1, row2 + 1):
-            for _ in range(column1, column2 + 1):
-                yield r, BLANK_OPERAND
+    def get_rows_iter(self):
+        return self._iter_rows(*self._get_bounds())
 
-    def _column_cells_generator(self, column, row1, row2):
-        for _ in range(row1, self.min_row):
-            yield BLANK_OPERAND
+    def _iter_rows(self, row1, column1, row2, column2):
+        top, left, infos = self._get_sheet_block(row1, column1, row2, column2)
 
-        for r in range(max(self.min_row, row1), min(row2 + 1, self.max_row + 1)):
-            yield SingleCellOperand(r, column, ws_name=self.ws_name, source=self.source)
+        for r in range(row1, row2 + 1):
+            if not top <= r < top + len(infos):
+                for _ in range(column1, column2 + 1):
+                    yield r, BLANK_OPERAND
+                continue
 
-        for _ in range(self.max_row + 1, row2 + 1):
-            yield BLANK_OPERAND
+            row_infos = infos[r - top]
+            for _ in range(column1, left):
+                yield r, BLANK_OPERAND
+            for c, cell_info in enumerate(row_infos, left):
+                yield r, self.cell_from_info(r, c, cell_info)
+            for _ in range(left + len(row_infos), column2 + 1):
+                yield r, BLANK_OPERAND
 
     def get_columns_iter(self):
-        row1 = self.min_row if self.row1 is None else self.row1
-        row2 = self.max_row if self.row2 is None else self.row2
-        column1 = self.min_column if self.column1 is None else self.column1
-        column2 = self.max_column if self.column2 is None else self.column2
-
-        for c in range(column1, self.min_column):
-            for _ in range(row1, row2 + 1):
-                yield c, BLANK_OPERAND
+        row1, column1, row2, column2 = self._get_bounds()
+        top, left, infos = self._get_sheet_block(row1, column1, row2, column2)
+        right = left + len(infos[0]) if infos else left
 
-        for c in range(max(self.min_column, column1), min(column2 + 1, self.max_column + 1)):
-            for cell in self._column_cells_generator(c, row1, row2):
-                yield c, cell
+        for c in range(column1, column2 + 1):
+            if not left <= c < right:
+                for _ in range(row1, row2 + 1):
+                    yield c, BLANK_OPERAND
+                continue
 
-        for c in range(self.max_column + 1, column2 + 1):
-            for _ in range(row1, row2 + 1):
+            for _ in range(row1, top):
+                yield c, BLANK_OPERAND
+            for r, row_infos in enumerate(infos, top):
+                yield c, self.cell_from_info(r, c, row_infos[c - left])
+            for _ in range(top + len(infos), row2 + 1):
                 yield c, BLANK_OPERAND
 
     def get_iter(self):
         for _, c in self.get_rows_iter():
             yield c
 
+    @cached_property
+    def used_size(self):
+        """
+        Count of the first items of get_iter which can be not blank. Whole columns end at the last used row
+        of the columns and whole rows end at the last used column, next items of the range are blank cells.
+        """
+        row1, column1, row2, column2 = self._get_bounds()
+        if self.row2 is None:
+            last_row = min(self.source._max_row_in_columns(self.ws_name, column1, column2), row2)
+            return max(last_row - row1 + 1, 0) * max(column2 - column1 + 1, 0)
+        elif self.column2 is None and row1 == row2:
+            last_column = min(self.source._max_column_in_rows(self.ws_name, row1, row2), column2)
+            return max(last_column - column1 + 1, 0)
+        return self.size
+
+    def get_used_iter(self):
+        """Items of get_iter up to used_size, the range is read only up to the last used cell"""
+        row1, column1, row2, column2 = self._get_bounds()
+        if self.used_size == self.size:
+            return self.get_iter()
+        elif self.row2 is None:
+            row2 = row1 + self.used_size // (column2 - column1 + 1) - 1
+        else:
+            column2 = column1 + self.used_size - 1
+        return (c for _, c in self._iter_rows(row1, column1, row2, column2))
+
+    def iter_populated_cells(self):
+        """
+        Populated cells of the range inside of the used area of the worksheet in order of get_iter,
+        blank cells are skipped
+        :rtype: collections.Iterable[(int, int, int, CellInfo)]
+        :return: 0-based position in the range, row, column and cell info
+        """
+        row1, column1, row2, column2 = self._get_bounds()
+        top, left = max(self.min_row, row1), max(self.min_column, column1)
+        bottom, right = min(self.max_row, row2), min(self.max_column, column2)
+        if top > bottom or left > right:
+            return
+
+        width = column2 - column1 + 1
+        for r, c, cell_info in self.source._iter_range_cells(self.ws_name, top, left, bottom, right):
+            yield (r - row1) * width + c - column1, r, c, cell_info
+
+    @cached_property
+    def values_block(self):
+        """
+        Values of cells without operands, cells are calculated in the order of get_iter
+        :rtype: RangeValues
+        """
+        row1, column1, row2, column2 = self._get_bounds()
+        ws_name, info_to_value = self.ws_name, self.source._cell_info_to_value
+
+        cells = []
+        for position, r, c, cell_info in self.iter_populated_cells():
+            if cell_info.formula is None:
+                value = cell_info.value
+            else:
+                value = info_to_value(CellAddress(ws_name, r, c, False, False), cell_info)[0]
+            cells.append((position, value))
+        return RangeValues(max(row2 - row1 + 1, 0), max(column2 - column1 + 1, 0), cells)
+
+    def get_item(self, idx):
+        """
+        Item of get_iter by 1-based position without iterating the range
+        :type idx: int
+        """
+        row1, column1, _, column2 = self._get_bounds()
+        width = column2 - column1 + 1
+        r, c = row1 + (idx - 1) // width, column1 + (idx - 1) % width
+        if self.min_row <= r <= self.max_row and self.min_column <= c <= self.max_column:
+            return SingleCellOperand(r, c, ws_name=self.ws_name, source=self.source)
+        return BLANK_OPERAND
+
+    @property
+    def size(self):
+        """Count of range cells"""
+        row1, column1, row2, column2 = self._get_bounds()
+        return max(row2 - row1 + 1, 0) * max(column2 - column1 + 1, 0)
+
     def address_to_value(self):
         return self.cached_iterable_items
 
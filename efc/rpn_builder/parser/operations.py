@@ -24,21 +24,37 @@ class Operation(object):
     def __init__(self, f_name):
         self.f_name = f_name
         self.operands_count = 1
+        # function of the operation, it is resolved once by the parser, None if it is not supported
+        self.func = None
+
+    def resolve(self):
+        """
+        Look up the function of the operation
+        :rtype: bool
+        """
+        self.func = EXCEL_FUNCTIONS.get(self.f_name)
+        return self.func is not None
 
     @property
     def f(self):
-        return excel_function(EXCEL_FUNCTIONS[self.f_name])
+        if self.func is None:
+            raise KeyError(self.f_name)
+        return excel_function(self.func)
 
     @property
     def is_exists(self):
-        return self.f_name in EXCEL_FUNCTIONS
+        return self.func is not None
 
     def eval(self, *args):
-        if self.is_exists:
-            return self.f(*args)
-        else:
+        func = self.func
+        if func is None:
             return FunctionNotSupported(self.f_name)
 
+        result = func(*args)
+        if not isinstance(result, OperandLikeObject):
+            result = SimpleOperand(result)
+        return result
+
 
 class ArithmeticOperation(Operation):
     def __init__(self, f_name, priority):
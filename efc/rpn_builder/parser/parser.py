@@ -7,10 +7,10 @@ from efc.rpn_builder.lexer.tokens import (AddToken, ArithmeticToken, CellsRangeT
                                           SingleCellToken, SubtractToken)
 from efc.rpn_builder.parser.errors import InconsistentParentheses, SeparatorBlockError
 from efc.rpn_builder.parser.operands import (
-    CellRangeOperand, EmptyOperand, NamedRangeOperand, RPNOperand, SimpleOperand, SingleCellOperand,
+    CellRangeOperand, EmptyOperand, ErrorOperand, NamedRangeOperand, RPNOperand, SimpleOperand, SingleCellOperand,
 )
 from efc.rpn_builder.parser.operations import ArithmeticOperation, FunctionOperation, Operation
-from efc.rpn_builder.rpn import RPN
+from efc.rpn_builder.rpn import RPN, RPNTemplate
 
 __all__ = ('Parser',)
 
@@ -25,6 +25,12 @@ OPERATORS_PRIORITY = {
 
 
 class Parser(object):
+    def __init__(self, fold_constants=False):
+        """
+        :param fold_constants: calculate operations of constants while parsing, e.g. 1/12, 2^10 or "Q"&"1"
+        """
+        self.fold_constants = fold_constants
+
     @staticmethod
     def get_priority(token):
         return OPERATORS_PRIORITY.get(token.__class__, 0)
@@ -61,13 +67,53 @@ class Parser(object):
             operation.operands_count = 1
         return operation
 
+    @staticmethod
+    def fold_operation(operation, args):
+        """
+        Result of the operation of constants, None if it should be calculated with the formula
+        :type operation: Operation
+        :type args: list[SimpleOperand]
+        :rtype: SimpleOperand | None
+        """
+        try:
+            v = operation.eval(*args)
+        except (ErrorOperand, TypeError, ValueError, ZeroDivisionError):
+            return None
+        # errors are built by the calculation, they get the formula and the worksheet of the calculated cell
+        return v if type(v) is SimpleOperand else None
+
+    def fold(self, rpn):
+        """
+        Replace arithmetic operations of constants by their results
+        :type rpn: RPN
+        :rtype: RPN
+        """
+        if not self.fold_constants:
+            return rpn
+
+        tokens = []
+        for token in rpn._array:
+            if isinstance(token, ArithmeticOperation) and token.is_exists:
+                count = token.operands_count
+                args = tokens[len(tokens) - count:]
+                if len(args) == count and all(type(arg) is SimpleOperand for arg in args):
+                    v = self.fold_operation(token, args)
+                    if v is not None:
+                        del tokens[len(tokens) - count:]
+                        tokens.append(v)
+                        continue
+            tokens.append(token)
+        rpn._array[:] = tokens
+        return rpn
+
     def handle_result(self, result, ws_name, source):
         if not result:
             return EmptyOperand(ws_name=ws_name, source=source)
         elif len(result) == 1:
             return result[0]
         else:
-            return RPNOperand(result, ws_name=ws_name, source=source)
+            # the argument is folded inside of the RPN operand, so functions get operands of the same types
+            return RPNOperand(self.fold(result), ws_name=ws_name, source=source)
 
     def to_rpn(self, line, ws_name, source, is_operand=False):
         result = RPN(line.src_line)
@@ -81,13 +127,16 @@ class Parser(object):
             if isinstance(token, OperandToken):
                 result_append(self.operand_token_handler(token, ws_name, source))
             elif isinstance(token, FunctionToken):
-                stack_append(FunctionOperation(token.token_value))
+                operation = FunctionOperation(token.token_value)
+                operation.resolve()
+                stack_append(operation)
             elif isinstance(token, LeftBracketToken):
                 stack_append(token)
                 if isinstance(line.prev(), FunctionToken):
                     result_append(self.to_rpn(line, ws_name, source, is_operand=True))
             elif isinstance(token, OperationToken):
                 operation = self.operation_token_handler(line)
+                operation.resolve()
                 while stack:
                     if isinstance(stack[-1], Operation) and stack[-1].priority >= operation.priority:
                         result_append(stack_pop())
@@ -125,4 +174,19 @@ class Parser(object):
                 raise InconsistentParentheses(ws_name, line.src_line)
             result_append(stack_token)
 
-        return result
+        # nested RPN operands are parsed from the same line
+        result.named_ranges = [(token.name, token.ws_name or ws_name)
+                               for token in line if isinstance(token, NamedRangeToken)]
+        result.unsupported_functions = [token.f_name for token in result.iter_tokens()
+                                        if isinstance(token, Operation) and token.func is None]
+
+        return self.fold(result)
+
+    def to_template(self, line, ws_name, source, row, column):
+        """
+        Build RPN template for the formula placed in the cell
+        :type row: int
+        :type column: int
+        :rtype: RPNTemplate
+        """
+        return RPNTemplate(self.to_rpn(line, ws_name, source), row, column)
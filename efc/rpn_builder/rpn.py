@@ -3,20 +3,41 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 from six.moves import range
 
+from efc.rpn_builder.compiler import compile_rpn
 from efc.rpn_builder.errors import OperandsMissing
-from efc.rpn_builder.parser.operands import (CellSetOperand, ErrorOperand, OffsetMixin, OperandLikeObject,
-                                             SimpleOperand, SimpleSetOperand, SingleCellOperand, ValueErrorOperand,
-                                             ZeroDivisionErrorOperand, FunctionNotSupported)
+from efc.rpn_builder.parser.operands import (CellRangeOperand, CellSetOperand, ErrorOperand, OffsetMixin,
+                                             OperandLikeObject, RPNOperand, SimpleOperand, SimpleSetOperand,
+                                             SingleCellOperand, ValueErrorOperand, ZeroDivisionErrorOperand,
+                                             FunctionNotSupported)
 from efc.rpn_builder.parser.operations import Operation
 from efc.utils import Array
 
-__all__ = ('RPN',)
+__all__ = ('RPN', 'RPNTemplate')
+
+NOT_COMPILED = object()
 
 
 class RPN(Array):
     def __init__(self, formula):
         super(RPN, self).__init__()
         self.formula = formula
+        # names and worksheets of named ranges used by the formula and its nested RPN operands,
+        # they are replaced by their values while parsing
+        self.named_ranges = []
+        # names of functions of the formula and its nested RPN operands which are not supported,
+        # they are found while parsing
+        self.unsupported_functions = []
+        self._program = NOT_COMPILED
+
+    @property
+    def program(self):
+        """
+        Tree of closures which calculates the formula, None if the formula is interpreted.
+        It is built at first calculation and copies made by offset share it.
+        """
+        if self._program is NOT_COMPILED:
+            self._program = compile_rpn(self)
+        return self._program
 
     @staticmethod
     def handle_result(result, ws_name, source):
@@ -43,6 +64,13 @@ class RPN(Array):
                 return err
 
     def calc(self, ws_name, source):
+        program = self.program
+        if program is not None:
+            return program(self._array, ws_name, source)
+        return self.interpret(ws_name, source)
+
+    def interpret(self, ws_name, source):
+        """Calculate the formula token by token"""
         self.reset()
         result = []
 
@@ -86,6 +114,9 @@ class RPN(Array):
         self.reset()
 
         new_rpn = RPN(formula=self.formula)
+        new_rpn._program = self.program
+        new_rpn.named_ranges = self.named_ranges
+        new_rpn.unsupported_functions = self.unsupported_functions
         for token in self:
             if isinstance(token, OffsetMixin):
                 new_token = token.offset(row_offset=row_offset, col_offset=col_offset)
@@ -93,3 +124,49 @@ class RPN(Array):
                 new_token = token
             new_rpn.append(new_token)
         return new_rpn
+
+    def iter_tokens(self):
+        """
+        Iterate over tokens of the formula including tokens of nested RPN operands
+        """
+        for token in self:
+            if isinstance(token, RPNOperand):
+                for nested_token in token.rpn.iter_tokens():
+                    yield nested_token
+            else:
+                yield token
+
+    def iter_references(self):
+        """
+        Iterate over cells and ranges used by the formula.
+        References built while calculating (e.g. by OFFSET) are not known before calculation.
+        :rtype: collections.Iterable[SingleCellOperand | CellRangeOperand]
+        """
+        for token in self.iter_tokens():
+            if isinstance(token, (SingleCellOperand, CellRangeOperand)):
+                yield token
+            elif isinstance(token, CellSetOperand):
+                for cell in token:
+                    if isinstance(cell, SingleCellOperand):
+                        yield cell
+
+
+class RPNTemplate(object):
+    """
+    Position-independent RPN. It is parsed once for a cell and can be bound
+    to any other cell with the same formula in R1C1 notation.
+    """
+
+    def __init__(self, rpn, row, column):
+        self.rpn = rpn
+        self.row = row
+        self.column = column
+
+    def bind(self, row, column):
+        """
+        RPN for the formula placed in the cell
+        :type row: int
+        :type column: int
+        :rtype: RPN
+        """
+        return self.rpn.offset(row_offset=row - self.row, col_offset=column - self.column)
@@ -8,8 +8,8 @@ from string import ascii_uppercase
 
 import six
 
-__all__ = ('col_str_to_index', 'col_index_to_str', 'u', 'cached_property', 'digit', 'Array', 'is_float', 'parse_date',
-           'datetime_to_openxml')
+__all__ = ('col_str_to_index', 'col_index_to_str', 'cell_index_to_tuple', 'u', 'cached_property', 'digit', 'Array',
+           'is_float', 'parse_date', 'datetime_to_openxml')
 
 BASE = datetime(1900, 1, 1)
 
@@ -42,6 +42,23 @@ def col_index_to_str(i):
     return ''.join(chars)
 
 
+CELL_INDEX_REGEXP = re.compile(r'^\$?([A-Z]+)\$?(\d+)$', re.I)
+
+
+def cell_index_to_tuple(cell_index):
+    """
+    A1 -> (1, 1)
+    $B$3 -> (3, 2)
+    :param basestring cell_index: [A-Z]+[0-9]+
+    :rtype: (int, int)
+    :return: row and column
+    """
+    m = CELL_INDEX_REGEXP.match(cell_index)
+    if m is None:
+        raise ValueError(cell_index)
+    return int(m.group(2)), col_str_to_index(m.group(1).upper())
+
+
 if six.PY2:
     b_from_default_type = str
 
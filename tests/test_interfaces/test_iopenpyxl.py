@@ -5,9 +5,28 @@ from datetime import datetime
 from os.path import dirname, join
 
 import pytest
-from openpyxl import load_workbook
+from openpyxl import Workbook, load_workbook
+from openpyxl.workbook.defined_name import DefinedName
 
+from efc.interfaces.errors import CircularReference
 from efc.interfaces.iopenpyxl import OpenpyxlInterface
+from efc.rpn_builder.parser.operands import CellAddress, FunctionNotSupported, ZeroDivisionErrorOperand
+
+
+class RangeReadsInterface(OpenpyxlInterface):
+    """Keeps rectangles of cells read for ranges"""
+
+    def __init__(self, *args, **kwargs):
+        super(RangeReadsInterface, self).__init__(*args, **kwargs)
+        self.reads = set()
+
+    def _get_range_values(self, ws_name, row1, column1, row2, column2):
+        self.reads.add((row1, column1, row2, column2))
+        return super(RangeReadsInterface, self)._get_range_values(ws_name, row1, column1, row2, column2)
+
+    def _iter_range_cells(self, ws_name, row1, column1, row2, column2):
+        self.reads.add((row1, column1, row2, column2))
+        return super(RangeReadsInterface, self)._iter_range_cells(ws_name, row1, column1, row2, column2)
 
 
 @pytest.fixture(scope='function')
@@ -94,6 +113,307 @@ def test_openpyxl_cache_enabled(workbook, interface):
     assert interface.calc_cell('B1', 'ws1') == 4
 
 
+def test_set_cell_value(workbook, interface):
+    assert interface.calc_cell('B1', 'ws1') == 2
+    assert interface.calc_cell('B2', 'ws1') == 3
+    assert interface.calc_cell('D3', 'ws1') == 15
+
+    interface.set_cell_value('A1', 'ws1', 3)
+    assert interface.calc_cell('B1', 'ws1') == 4
+    assert interface.calc_cell('D3', 'ws1') == 17
+    assert interface._caches['cells'].get(CellAddress('ws1', 2, 2, False, False)) is not None
+
+    interface.set_cell_value('B5', 'ws1', '=A1*10')
+    assert interface.calc_cell('B5', 'ws1') == 30
+
+
+def test_set_cell_value_transitive():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 1
+    ws['A2'] = '=A1*2'
+    ws['A3'] = '=A2+1'
+    ws['B1'] = '=SUM(A1:A3)'
+    ws['C1'] = '=SUM(D:D)'
+    ws['C2'] = '=OFFSET(A1,0,4)'
+
+    interface = OpenpyxlInterface(wb, use_cache=True)
+    assert interface.calc_sheet(ws.title) == {'A2': 2, 'A3': 3, 'B1': 6, 'C1': 0, 'C2': None}
+
+    interface.set_cell_value('A1', ws.title, 5)
+    assert interface.calc_cell('A3', ws.title) == 11
+    assert interface.calc_cell('B1', ws.title) == 26
+
+    interface.set_cell_value('D100', ws.title, 7)
+    assert interface.calc_cell('C1', ws.title) == 7
+
+    interface.set_cell_value('E1', ws.title, 8)
+    assert interface.calc_cell('C2', ws.title) == 8
+
+
+def test_set_cell_value_named_range():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 1
+    ws['B1'] = '=dbl'
+    ws['B2'] = '=B1+1'
+    ws['B3'] = '=SUM(twice)'
+    wb.defined_names['dbl'] = DefinedName('dbl', attr_text='%s!$A$1*10' % ws.title)
+    wb.defined_names['twice'] = DefinedName('twice', attr_text='dbl*2')
+
+    interface = OpenpyxlInterface(wb, use_cache=True)
+    assert interface.calc_sheet(ws.title) == {'B1': 10, 'B2': 11, 'B3': 20}
+
+    interface.set_cell_value('A1', ws.title, 5)
+    assert interface.calc_sheet(ws.title) == {'B1': 50, 'B2': 51, 'B3': 100}
+
+
+def test_running_totals():
+    wb = Workbook()
+    ws = wb.active
+    for row in range(1, 11):
+        ws.cell(row, 1, row)
+        ws.cell(row, 2, '=SUM($A$1:A%d)' % row)
+        ws.cell(row, 3, '=AVERAGE(A1:A%d)' % row)
+        ws.cell(row, 4, '=COUNT($A$1:A%d)' % row)
+    ws['A5'] = 'text'
+    ws['E1'] = '=SUM(A1:D1)'
+
+    interface = OpenpyxlInterface(wb, use_cache=True)
+    values = interface.calc_sheet(ws.title)
+    assert values['B10'] == 50
+    assert values['C10'] == 50 / 9
+    assert values['D10'] == 9
+    assert values['E1'] == 4
+
+    interface.set_cell_value('A5', ws.title, 0.5)
+    assert interface.calc_cell('B10', ws.title) == 50.5
+    assert interface.calc_cell('C10', ws.title) == 5.05
+    assert interface.calc_cell('D10', ws.title) == 10
+    assert interface.calc_cell('B4', ws.title) == 10
+
+
+def test_sums_match_scan():
+    wb = Workbook()
+    ws = wb.active
+    values = [0.1, 0.2, 0.3, 4, 'text', 0.7, -0.0, 31.6, 0.07]
+    for row, value in enumerate(values, 1):
+        ws.cell(row, 1, value)
+        ws.cell(row, 2, '=SUM($A$1:A%d)' % row)
+        ws.cell(row, 3, '=AVERAGE($A$1:A%d)' % row)
+        ws.cell(row, 4, '=SUM(A2:A%d)' % row)
+        ws.cell(row, 5, '=SUM(1.5,$A$1:A%d)' % row)
+        ws.cell(row, 6, '=SUM($A$1:A%d,A1:A%d)' % (row, row))
+    ws['G1'] = '=SUM(A4:A5)'
+    ws['G2'] = '=SUMIFS(A1:A9,A1:A9,">0")'
+
+    expected = OpenpyxlInterface(wb).calc_sheet(ws.title)
+    for interface in (OpenpyxlInterface(wb, use_cache=True), OpenpyxlInterface(wb, use_cache=True,
+                                                                                block_aggregates=True)):
+        result = interface.calc_sheet(ws.title)
+        assert result == expected
+        assert [type(v) for v in result.values()] == [type(v) for v in expected.values()]
+
+    digits = [v for v in values if not isinstance(v, str)]
+    # digits are added one by one, sums are not rounded once
+    assert expected['B3'] == 0.1 + 0.2 + 0.3 != 0.6
+    assert expected['B9'] == sum(digits)
+    assert expected['C9'] == sum(digits) / len(digits)
+    assert expected['D9'] == sum(digits[1:])
+    assert expected['G1'] == 4
+
+
+def test_line_sums_read_only_ranges():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 1
+    ws['A2'] = 2
+    # the cell between ranges depends on the next range
+    ws['A3'] = '=SUM(A4:A5)'
+    ws['A4'] = 3
+    ws['A5'] = 4
+    ws['B1'] = '=SUM(A1:A2)'
+    ws['B2'] = '=SUM(A999999:A1000000)'
+    ws['B3'] = '=SUM(A1:A5)'
+
+    interface = RangeReadsInterface(wb, use_cache=True)
+    assert interface.calc_cell('B1', ws.title) == 3
+    assert interface.calc_cell('A3', ws.title) == 7
+    assert interface.calc_cell('B2', ws.title) == 0
+    # cells out of the worksheet are not read
+    assert interface.reads == {(1, 1, 2, 1), (4, 1, 5, 1)}
+
+    interface.reads.clear()
+    assert interface.calc_cell('B3', ws.title) == 17
+    # sums of read ranges are reused, only the cell between them is read
+    assert interface.reads == {(3, 1, 3, 1)}
+
+    interface.set_cell_value('A4', ws.title, 10)
+    assert interface.calc_cell('A3', ws.title) == 14
+    assert interface.calc_cell('B3', ws.title) == 31
+    assert interface.calc_cell('B1', ws.title) == 3
+
+
+def test_block_sums():
+    wb = Workbook()
+    ws = wb.active
+    for row in range(1, 7):
+        for column in range(1, 5):
+            ws.cell(row, column, row * column)
+    ws['D6'] = '=A1+1'
+    ws['F1'] = '=SUM(A1:C3)'
+    ws['F2'] = '=SUM(B2:D4)'
+    ws['F3'] = '=AVERAGE(A2:B3)'
+    ws['F4'] = '=COUNT(A1:D6)'
+    ws['F5'] = '=SUM(C5:D6)'
+
+    interface = OpenpyxlInterface(wb, use_cache=True, block_aggregates=True)
+    assert interface.calc_sheet(ws.title) == {'D6': 2, 'F1': 36, 'F2': 81, 'F3': 3.75, 'F4': 24, 'F5': 55}
+
+    interface.set_cell_value('B2', ws.title, 0.5)
+    assert interface.calc_cell('F1', ws.title) == 32.5
+    assert interface.calc_cell('F2', ws.title) == 77.5
+    assert interface.calc_cell('F3', ws.title) == 2.875
+
+
+def test_block_sums_tables():
+    wb = Workbook()
+    ws = wb.active
+    for row in (1, 2, 999, 1000):
+        for column in (1, 2, 199, 200):
+            ws.cell(row, column, row + column)
+    ws['GS1'] = '=SUM(A1:B40)'
+    ws['GS2'] = '=SUM(GQ999:GR1000)'
+    ws['GS3'] = '=SUM(A1:B41)'
+    ws['GS4'] = '=SUM(B2:GR3)'
+
+    ranges = [(1, 1, 40, 2), (999, 199, 1000, 200), (1, 1, 41, 2), (2, 2, 3, 200)]
+
+    def is_in_ranges(rect):
+        row1, column1, row2, column2 = rect
+        return any(r1 <= row1 and c1 <= column1 and row2 <= r2 and column2 <= c2 for r1, c1, r2, c2 in ranges)
+
+    interface = RangeReadsInterface(wb, use_cache=True, block_aggregates=True)
+    assert [interface.calc_cell('GS%d' % row, ws.title) for row in range(1, 5)] == [12, 4796, 12, 407]
+    # far ranges get their own tables, the range overlapping a table is scanned,
+    # so cells between ranges are not read
+    assert all(is_in_ranges(rect) for rect in interface.reads)
+
+    interface.set_cell_value('B2', ws.title, 100)
+    assert [interface.calc_cell('GS%d' % row, ws.title) for row in range(1, 5)] == [108, 4796, 108, 503]
+    interface.set_cell_value('GQ999', ws.title, 2)
+    assert interface.calc_cell('GS2', ws.title) == 3600
+
+    # without block_aggregates ranges are summed by columns
+    interface = RangeReadsInterface(wb, use_cache=True)
+    assert interface.calc_cell('GS4', ws.title) == 503
+    assert interface.reads and all(column1 == column2 for _, column1, _, column2 in interface.reads)
+
+
+def test_range_values():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 1
+    ws['C1'] = 'text'
+    ws['B2'] = '=A1*2'
+    ws['C3'] = 3
+    ws['E1'] = '=SUM(A1:C3)'
+    ws['E2'] = '=COUNTA(A1:C3)'
+
+    interface = OpenpyxlInterface(wb)
+    infos = interface._get_range_values(ws.title, 1, 1, 3, 3)
+    assert [[(i.value, i.formula) for i in row] for row in infos] == [
+        [(1, None), (None, None), ('text', None)],
+        [(None, None), (None, 'A1*2'), (None, None)],
+        [(None, None), (None, None), (3, None)],
+    ]
+    # missing cells are not created
+    assert len(ws._cells) == 6
+    assert interface.calc_cell('E1', ws.title) == 6
+    assert interface.calc_cell('E2', ws.title) == 4
+
+
+@pytest.mark.parametrize('use_cache', (False, True))
+def test_sparse_ranges(use_cache):
+    wb = Workbook()
+    ws = wb.active
+    ws['A10'] = 5
+    ws['B10'] = 'x'
+    ws['A5000'] = 2.5
+    ws['B5000'] = 'x'
+    ws['C20000'] = '=A10*2'
+
+    interface = OpenpyxlInterface(wb, use_cache=use_cache)
+    cells = interface._iter_range_cells(ws.title, 1, 1, 20000, 2)
+    assert [(row, column, info.value) for row, column, info in cells] == [
+        (10, 1, 5), (10, 2, 'x'), (5000, 1, 2.5), (5000, 2, 'x'),
+    ]
+    formulas = {
+        'SUM(A1:C20000)': 17.5,
+        'COUNT(A:C)': 3,
+        'COUNTA(A1:C20000)': 5,
+        'COUNTBLANK(A1:C20000)': 59995,
+        'SUMIFS(A:A,B:B,"x")': 7.5,
+        'COUNTIFS(B1:B20000,"")': 19998,
+    }
+    for formula, result in formulas.items():
+        ws['E1'] = '=' + formula
+        if use_cache:
+            interface.clear_cache()
+        assert interface.calc_cell('E1', ws.title) == result, formula
+
+
+@pytest.mark.parametrize('use_cache', (False, True))
+def test_whole_columns_used_range(use_cache):
+    wb = Workbook()
+    ws = wb.active
+    for row in range(1, 6):
+        ws.cell(row, 1, 'k%d' % row)
+        ws.cell(row, 2, row)
+    ws['Z1000'] = 1
+
+    interface = OpenpyxlInterface(wb, use_cache=use_cache)
+    assert interface._max_row_in_columns(ws.title, 1, 2) == 5
+    assert interface._max_row_in_columns(ws.title, 3, 25) == 0
+    assert interface._max_column_in_rows(ws.title, 1, 5) == 2
+
+    formulas = {
+        'VLOOKUP("k4",A:B,2,0)': 4,
+        'MATCH("",A:A,0)': 6,
+        'COUNTIF(A:A,"")': 995,
+        'COUNTIF(A:B,">2")': 3,
+        'SUMIFS(B:B,A:A,"<>k2")': 13,
+        'COUNTIFS(C:C,"",A:A,"k*")': 0,
+    }
+    for formula, result in formulas.items():
+        ws['AA1'] = '=' + formula
+        if use_cache:
+            interface.clear_cache()
+        assert interface.calc_cell('AA1', ws.title) == result, formula
+
+    if use_cache:
+        interface.set_cell_value('A7', ws.title, 'k7')
+        assert interface._max_row_in_columns(ws.title, 1, 1) == 7
+
+
+def test_sheet_dimensions_cache():
+    wb = Workbook()
+    ws = wb.active
+    interface = OpenpyxlInterface(wb, use_cache=True)
+    assert (interface._min_row(ws.title), interface._max_row(ws.title)) == (1, 1)
+
+    ws['B3'] = 2
+    ws['C4'] = 3
+    ws['E1'] = '=COUNTBLANK(B:C)'
+    interface.clear_cache()
+    assert interface.calc_cell('E1', ws.title) == 6
+    assert interface._caches['dimensions'][ws.title].bounds == (1, 4, 2, 5)
+
+    interface.set_cell_value('B6', ws.title, 1)
+    assert interface._caches['dimensions'][ws.title].bounds == (1, 6, 2, 5)
+    assert interface.calc_cell('E1', ws.title) == 9
+
+
 def test_openpyxl_cache_disabled(workbook):
     interface = OpenpyxlInterface(workbook, use_cache=False)
     assert interface.calc_cell('B1', 'ws1') == 2
@@ -121,3 +441,95 @@ def test_hyperlink(workbook, cell, hyperlink, value, use_cache):
     interface = OpenpyxlInterface(workbook, use_cache=use_cache)
     assert interface.calc_cell(cell, 'hyperlink') == value
     assert interface.get_cell_formula_hyperlink(cell, 'hyperlink') == hyperlink
+
+
+def test_calc_sheet(workbook, interface):
+    result = interface.calc_sheet('ws1')
+    assert result == {
+        'B1': 2, 'B2': 3, 'B3': 4, 'B4': 5, 'B5': 6,
+        'D1': 15, 'D2': 20, 'D3': 15, 'D4': 46,
+        'C7': 1, 'C8': 'text1text2',
+    }
+    assert interface.calc_sheet('ws2') == {}
+
+
+def test_calc_all(workbook):
+    interface = OpenpyxlInterface(workbook, use_cache=True)
+    result = interface.calc_all()
+    assert set(result) == {'ws1', 'hyperlink'}
+
+    expected = OpenpyxlInterface(workbook, use_cache=False)
+    for ws_name, values in result.items():
+        for cell_index, value in values.items():
+            assert value == expected.calc_cell(cell_index, ws_name)
+
+
+def test_calc_sheet_errors():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 0
+    ws['A2'] = '=1/A1'
+    ws['A3'] = '=UNKNOWNFUNC(A1)'
+    ws['A4'] = '=A1+1'
+    ws['A5'] = '=A2+1'
+
+    result = OpenpyxlInterface(wb, use_cache=True).calc_sheet(ws.title)
+    assert result['A4'] == 1
+    assert [type(result[cell]) for cell in ('A2', 'A3', 'A5')] == [
+        ZeroDivisionErrorOperand, FunctionNotSupported, ZeroDivisionErrorOperand,
+    ]
+
+
+def test_calc_sheet_long_chain():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 1
+    for row in range(2, 3001):
+        ws.cell(row=row, column=1).value = '=A%d+1' % (row - 1)
+    ws['B1'] = '=SUM(A1:A3000)'
+
+    interface = OpenpyxlInterface(wb, use_cache=True)
+    result = interface.calc_sheet(ws.title)
+    assert result['A3000'] == 3000
+    assert result['B1'] == 3000 * 3001 // 2
+
+
+@pytest.mark.parametrize('use_cache', (False, True))
+def test_calc_cell_long_chain_with_stack(use_cache):
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 1
+    for row in range(2, 5001):
+        ws.cell(row=row, column=1).value = '=A%d+1' % (row - 1)
+    ws['B1'] = '=A5000*2'
+    ws['C1'] = '=SUM(A1:A5000)'
+
+    interface = OpenpyxlInterface(wb, use_cache=use_cache, max_depth=20)
+    assert interface.calc_cell('A5000', ws.title) == 5000
+    assert interface.calc_cell('B1', ws.title) == 10000
+    assert interface.calc_cell('C1', ws.title) == 5000 * 5001 // 2
+    assert interface.calc_cell('A1', ws.title) == 1
+
+
+def test_circular_reference_with_stack():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = '=B1+1'
+    ws['B1'] = '=A1+1'
+
+    interface = OpenpyxlInterface(wb, use_cache=True, max_depth=20)
+    with pytest.raises(CircularReference):
+        interface.calc_cell('A1', ws.title)
+
+
+@pytest.mark.parametrize('use_cache', (False, True))
+def test_pending_cell_is_not_circular_reference(use_cache):
+    wb = Workbook()
+    ws = wb.active
+    # E1 waits in the stack as a precedent of C1 when it is needed again by K1
+    for cell_index, value in (('A1', '=B1'), ('B1', '=C1'), ('C1', '=E1+F1'), ('E1', '=1'), ('F1', '=G1'),
+                              ('G1', '=SUM(K1:K1)'), ('K1', '=E1')):
+        ws[cell_index] = value
+
+    interface = OpenpyxlInterface(wb, use_cache=use_cache, max_depth=1)
+    assert interface.calc_cell('A1', ws.title) == 2
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from datetime import datetime
+from os.path import dirname, join
+
+import pytest
+from openpyxl import Workbook, load_workbook
+
+from efc.interfaces.iopenpyxl import OpenpyxlInterface
+from efc.interfaces.isnapshot import SheetSnapshot, SnapshotInterface
+
+
+@pytest.fixture(scope='function')
+def workbook():
+    path = join(dirname(__file__), 'fixtures', 'openpyxl.xlsx')
+    return load_workbook(path)
+
+
+@pytest.fixture(scope='function')
+def interface(workbook):
+    return SnapshotInterface.from_openpyxl(workbook, use_cache=True)
+
+
+def test_sheet_snapshot():
+    sheet = SheetSnapshot()
+    sheet.append(1, 1, 1)
+    sheet.append(1, 3, 'text')
+    sheet.append(2, 2, formula='A1*2')
+    sheet.append(2, 4)
+    sheet.append(3, 1, 'text')
+    sheet.append(3, 3, 2.5)
+    sheet.append(4, 1, True)
+    with pytest.raises(ValueError):
+        sheet.append(3, 2, 1)
+
+    assert len(sheet) == 6
+    assert sheet._strings == ['text']
+    assert sheet.dimensions.bounds == (1, 4, 1, 4)
+    assert (sheet.get(1, 1).value, sheet.get(2, 2).formula, sheet.get(4, 1).value) == (1, 'A1*2', True)
+    assert sheet.get(2, 4) is SheetSnapshot.BLANK
+    assert [(row, column, info.value) for row, column, info in sheet.iter_cells(1, 1, 3, 2)] == [
+        (1, 1, 1), (2, 2, None), (3, 1, 'text'),
+    ]
+    assert list(sheet.iter_formula_cells()) == [(2, 2)]
+
+    sheet.set(2, 3, 7)
+    sheet.set(1, 1, None)
+    sheet.set(3, 3, formula='B2+1')
+    assert [(row, column) for row, column, _ in sheet.iter_cells(1, 1, 4, 4)] == [
+        (1, 3), (2, 2), (2, 3), (3, 1), (3, 3), (4, 1),
+    ]
+    assert sheet.get(1, 1).value is None
+    assert list(sheet.iter_formula_cells()) == [(2, 2), (3, 3)]
+
+
+def test_sheet_snapshot_reuses_slots():
+    sheet = SheetSnapshot()
+    sheet.append(1, 1, 1)
+    sheet.append(1, 2, 1.5)
+    for i in range(100):
+        sheet.set(1, 1, i)
+        sheet.set(1, 2, i + 0.5)
+        sheet.set(2, 1, i if i % 2 else float(i))
+        sheet.set(3, 1, [i])
+        sheet.set(3, 1, None)
+    assert (len(sheet._integers), len(sheet._numbers), len(sheet._others)) == (2, 2, 1)
+    assert (sheet.get(1, 1).value, sheet.get(1, 2).value, sheet.get(2, 1).value) == (99, 99.5, 99)
+    assert sheet.get(3, 1) is SheetSnapshot.BLANK
+
+
+def test_same_results_as_openpyxl(workbook, interface):
+    expected = OpenpyxlInterface(workbook, use_cache=True).calc_all()
+    assert interface.calc_all() == expected
+    assert interface.calc_cell('A7', 'ws1') == datetime(2020, 1, 1)
+    assert interface.get_cell_formula_hyperlink('A4', 'hyperlink') == 'https://ya2.ru'
+    assert interface._has_named_range('TEST_NAMED_RANGE', None)
+    assert interface._has_named_range('TEST_LOCAL_NAMED_RANGE', 'ws1')
+    assert not interface._has_named_range('TEST_LOCAL_NAMED_RANGE', 'ws2')
+
+
+def test_workbook_is_not_used(workbook, interface):
+    workbook['ws1']['A1'].value = 3
+    assert interface.calc_cell('B1', 'ws1') == 2
+
+    interface.set_cell_value('A1', 'ws1', 3)
+    assert interface.calc_cell('B1', 'ws1') == 4
+    assert interface.calc_cell('D3', 'ws1') == 17
+
+    interface.set_cell_value('B5', 'ws1', '=A1*10')
+    assert interface.calc_cell('B5', 'ws1') == 30
+    interface.set_cell_value('A9', 'ws1', datetime(2021, 3, 4))
+    assert interface.calc_cell('A9', 'ws1') == datetime(2021, 3, 4)
+
+
+@pytest.mark.parametrize('use_cache', (False, True))
+def test_sparse_ranges(use_cache):
+    wb = Workbook()
+    ws = wb.active
+    ws['A10'] = 5
+    ws['B10'] = 'x'
+    ws['A5000'] = 2.5
+    ws['B5000'] = 'x'
+    ws['C20000'] = '=A10*2'
+
+    interface = SnapshotInterface.from_openpyxl(wb, use_cache=use_cache)
+    cells = interface._iter_range_cells(ws.title, 1, 1, 20000, 2)
+    assert [(row, column, info.value) for row, column, info in cells] == [
+        (10, 1, 5), (10, 2, 'x'), (5000, 1, 2.5), (5000, 2, 'x'),
+    ]
+    formulas = {
+        'SUM(A1:C20000)': 17.5,
+        'COUNT(A:C)': 3,
+        'COUNTA(A1:C20000)': 5,
+        'COUNTBLANK(A1:C20000)': 59995,
+        'SUMIFS(A:A,B:B,"x")': 7.5,
+        'MATCH("x",B:B,0)': 10,
+    }
+    for formula, result in formulas.items():
+        interface.set_cell_value('E1', ws.title, '=' + formula)
+        assert interface.calc_cell('E1', ws.title) == result, formula
+    assert len(interface.sheets[ws.title]) == 6
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from datetime import datetime
+from io import BytesIO
+from os.path import dirname, join
+from zipfile import ZipFile
+
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.workbook.defined_name import DefinedName
+
+from efc.interfaces.errors import WorkbookPartNotFound
+from efc.interfaces.iopenpyxl import OpenpyxlInterface
+from efc.interfaces.isnapshot import SnapshotInterface
+from efc.interfaces.ixlsx import SharedFormula, XlsxInterface, XlsxReader
+from efc.rpn_builder.parser.operands import CellAddress
+
+FIXTURE = join(dirname(__file__), 'fixtures', 'openpyxl.xlsx')
+
+WORKBOOK_XML = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+    xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="Data" sheetId="1" r:id="rId1"/></sheets>
+<definedNames><definedName name="TOTAL">Data!$C$1</definedName></definedNames>
+</workbook>'''
+
+WORKBOOK_RELS_XML = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Target="worksheets/sheet1.xml"
+    Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>
+<Relationship Id="rId2" Target="/xl/sharedStrings.xml"
+    Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings"/>
+</Relationships>'''
+
+SHARED_STRINGS_XML = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<si><t>plain</t></si>
+<si><r><t>ri</t></r><r><t>ch</t></r><rPh><t>phonetic</t></rPh></si>
+</sst>'''
+
+SHEET_XML = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>
+<row r="1"><c r="A1"><v>1</v></c><c r="B1"><f t="shared" ref="B1:B3" si="0">A1*2+$A$1</f><v>3</v></c>
+    <c r="C1"><f>SUM(B1:B3)</f></c><c r="D1"><f>TOTAL+1</f></c></row>
+<row r="2"><c r="A2"><v>2.5</v></c><c r="B2"><f t="shared" si="0"/></c><c t="s"><v>0</v></c>
+    <c t="inlineStr"><is><t>inline</t></is></c></row>
+<row><c r="A3" t="b"><v>1</v></c><c r="B3"><f t="shared" si="0"/></c><c r="C3" t="s"><v>1</v></c>
+    <c r="D3" t="e"><v>#N/A</v></c></row>
+</sheetData></worksheet>'''
+
+
+def build_xlsx():
+    f = BytesIO()
+    with ZipFile(f, 'w') as zip_file:
+        zip_file.writestr('xl/workbook.xml', WORKBOOK_XML)
+        zip_file.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS_XML)
+        zip_file.writestr('xl/sharedStrings.xml', SHARED_STRINGS_XML)
+        zip_file.writestr('xl/worksheets/sheet1.xml', SHEET_XML)
+    f.seek(0)
+    return f
+
+
+def test_same_results_as_openpyxl():
+    interface = XlsxInterface(FIXTURE, use_cache=True)
+    assert interface.calc_all() == OpenpyxlInterface(load_workbook(FIXTURE), use_cache=True).calc_all()
+    assert interface.calc_cell('A7', 'ws1') == datetime(2020, 1, 1)
+    assert interface.get_cell_formula_hyperlink('A4', 'hyperlink') == 'https://ya2.ru'
+    assert interface._worksheet_names() == ['ws1', 'ws2', 'hyperlink']
+
+
+def test_cells_of_generated_workbook():
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'S'
+    values = [1, 2.5, -3, 10 ** 12, 'x', True, False, datetime(2020, 5, 6), datetime(2020, 5, 6, 12, 30, 15),
+              datetime(1900, 1, 15), '=B1+1', '=SUM(Other!A:A)', '=NAMED*2', '="s"&B2']
+    for row, value in enumerate(values, 1):
+        ws.cell(row, 1, value)
+        ws.cell(row + 2, 3, value)
+    wb.create_sheet('Other')['A1'] = 4
+    wb.defined_names['NAMED'] = DefinedName('NAMED', attr_text='Other!$A$1')
+    f = BytesIO()
+    wb.save(f)
+
+    expected = SnapshotInterface.from_openpyxl(load_workbook(BytesIO(f.getvalue())))
+    interface = XlsxInterface(f)
+    for row in range(1, 18):
+        for column in range(1, 5):
+            address = CellAddress('S', row, column, False, False)
+            info, expected_info = interface._get_cell_info(address), expected._get_cell_info(address)
+            assert (type(info.value), info.value, info.formula) == \
+                   (type(expected_info.value), expected_info.value, expected_info.formula)
+    assert interface._get_sheet('S').dimensions.bounds == (1, 16, 1, 3)
+    assert interface.calc_cell('A8', 'S') == datetime(2020, 5, 6)
+    assert interface.calc_cell('A13', 'S') == 8
+
+
+def test_shared_formulas_and_strings():
+    interface = XlsxInterface(build_xlsx(), use_cache=True)
+    assert interface.calc_sheet('Data') == {'B1': 3, 'B2': 6, 'B3': 3, 'C1': 12, 'D1': 13}
+    assert interface._get_cell_info(CellAddress('Data', 3, 2, False, False)).formula == 'A3*2+$A$1'
+    assert [info.value for info in interface._get_range_values('Data', 2, 3, 3, 4)[0]] == ['plain', 'inline']
+    assert interface.calc_cell('C3', 'Data') == 'rich'
+    assert interface.calc_cell('D3', 'Data') == '#N/A'
+    assert interface.calc_cell('A3', 'Data') is True
+
+
+@pytest.mark.parametrize(
+    ('formula', 'row', 'column', 'result'),
+    (
+            ('A1+$A$1', 3, 2, 'B3+$A$1'),
+            ('SUM($A1:B$2)*A$1', 2, 3, 'SUM($A2:D$2)*C$1'),
+            ("'my sheet'!C4+Other!A:A", 1, 2, "'my sheet'!D4+Other!B:B"),
+            ('LOG10(A1)&"A1"', 2, 1, 'LOG10(A2)&"A1"'),
+    )
+)
+def test_shared_formula(formula, row, column, result):
+    assert SharedFormula(formula, 1, 1).formula_at(row, column) == result
+
+
+def test_missing_sheet_part():
+    f = BytesIO()
+    with ZipFile(f, 'w') as zip_file:
+        zip_file.writestr('xl/workbook.xml', WORKBOOK_XML)
+        zip_file.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS_XML)
+
+    with XlsxReader(f) as reader:
+        assert reader.sheet_names == ['Data']
+        assert reader.defined_names == {None: {'TOTAL': 'Data!$C$1'}}
+        with pytest.raises(WorkbookPartNotFound):
+            reader.read_sheet('Data')
+
+
+def test_lazy_loading():
+    wb = Workbook()
+    wb.active.title = 'ws0'
+    for i in range(1, 4):
+        ws = wb.create_sheet('ws%d' % i)
+        ws['A1'] = i
+        ws['B1'] = '=A1+ws%d!A1' % (i - 1)
+    f = BytesIO()
+    wb.save(f)
+
+    interface = XlsxInterface(f, lazy=True, use_cache=True)
+    assert interface.loaded_sheets() == []
+    assert interface._has_worksheet('ws3') and interface._has_named_range('missing', 'ws3') is False
+    assert interface.calc_cell('B1', 'ws2') == 3
+    assert interface.loaded_sheets() == ['ws1', 'ws2']
+
+    interface = XlsxInterface(f, lazy=True, max_resident_sheets=2, use_cache=True)
+    interface.set_cell_value('A1', 'ws1', 10)
+    assert interface.calc_cell('B1', 'ws3') == 5
+    assert interface.calc_cell('B1', 'ws2') == 12
+    assert interface.loaded_sheets() == ['ws1', 'ws2']
+    assert interface.calc_cell('A1', 'ws0') is None
+    assert interface.loaded_sheets() == ['ws0', 'ws1']
+    assert interface.calc_sheet('ws1') == {'B1': 10}
+    interface.close()
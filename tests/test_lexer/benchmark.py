@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput of the lexer, values of tokens are used like interfaces do: python -m tests.test_lexer.benchmark
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import timeit
+
+from efc.rpn_builder.lexer import Lexer
+
+FORMULAS = (
+    'SUM(A1:C3, 1, -2)/COUNT(A1:A3)',
+    'IF(\'Sheet 1\'!$A$1>5,VLOOKUP(B2,Data!A:D,3,FALSE),"no")',
+    'A1*2+B1/3-1',
+    '_xlfn.IFS(A1>1,"a",TRUE,"b")',
+    'ROUND(AVERAGE(A1:C1)*1.5, 1)&" %"',
+    'SUMIFS(Data!$C:$C,Data!$A:$A,$A2,Data!$B:$B,">="&B$1)',
+)
+
+
+def main(count=2000, repeat=5):
+    lines = [formula.replace('1', str(i % 97 + 1)) for i in range(count) for formula in FORMULAS]
+    lexer = Lexer()
+    seconds = min(timeit.repeat(lambda: [lexer.parse(line).relative_key(1, 1) for line in lines],
+                                 number=1, repeat=repeat))
+    print('Lexer: %d formulas/s' % (len(lines) / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,8 @@ import pytest
 from six.moves import zip
 
 from efc.rpn_builder.lexer import Lexer, tokens
+from efc.rpn_builder.lexer.errors import CheckSumError
+from efc.rpn_builder.lexer.lexer import LEXER_REGEXP, get_symbol_regexp
 
 
 @pytest.fixture(scope='module')
@@ -77,3 +79,46 @@ def test_operators_parse(lexer, line, token_types):
 
     for c, token in zip(token_types, parsed_line):
         assert isinstance(token, c)
+
+
+@pytest.mark.parametrize(
+    ['line1', 'cell1', 'line2', 'cell2', 'is_same'],
+    (
+            ('A1+B1', (1, 3), 'A2+B2', (2, 3), True),
+            ('A1+B1', (1, 3), 'B1+C1', (1, 4), True),
+            ('A1+B1', (1, 3), 'A1+B1', (2, 3), False),
+            ('$A$1+B1', (1, 3), '$A$1+B2', (2, 3), True),
+            ('$A$1+B1', (1, 3), '$A$2+B2', (2, 3), False),
+            ('SUM(A$1:A1)', (1, 3), 'SUM(A$1:A5)', (5, 3), True),
+            ('SUM(A:A)', (1, 3), 'SUM(B:B)', (5, 4), True),
+            ('Sheet1!A1', (1, 3), 'Sheet2!A2', (2, 3), False),
+    )
+)
+def test_relative_key(lexer, line1, cell1, line2, cell2, is_same):
+    key1 = lexer.parse(line1).relative_key(*cell1)
+    key2 = lexer.parse(line2).relative_key(*cell2)
+    assert (key1 == key2) is is_same
+
+
+@pytest.mark.parametrize(
+    'line',
+    (
+            'SUM(A1:C3, 1, -2)/COUNT(A1:A3)%',
+            "IF('Sheet 1'!$A$1>=5,VLOOKUP(B2,Data!A:D,3,FALSE),\"no\")<>TRUES",
+            '_xlfn.IFS(A1>1,"a",TRUE,"b")&[doc]Sheet!$1:$2&!A1&:B2',
+            'Имя+Лист!A1*2.5%^ 3\n<=_name',
+            '٣.٥+A٣*\'Лист 2\'!B2:٣ ~#é中',
+    )
+)
+def test_symbol_regexps(line):
+    for pos in range(len(line)):
+        expected = LEXER_REGEXP.match(line, pos)
+        match = get_symbol_regexp(line[pos]).match(line, pos)
+        assert (match and (match.lastgroup, match.group(0))) == (expected and (expected.lastgroup, expected.group(0)))
+
+
+def test_check_sum(lexer):
+    assert Lexer().regexp is lexer.regexp
+    with pytest.raises(CheckSumError) as exc_info:
+        lexer.parse('1 + 2 ~ 3')
+    assert exc_info.value.parsed_line == '1 + 2  3'
@@ -33,6 +33,19 @@ def test_arithmetic_tokens(line, token_type):
     assert token.token_value == line
 
 
+def test_lazy_token():
+    line = 'SUM(Sheet1!$A$1, 2)'
+    match = re.compile(tokens.SingleCellToken.get_group_pattern()).match(line, 4)
+    token = tokens.SingleCellToken(match)
+    assert token._value is tokens.NOT_PARSED
+    assert (token.src_value, token.ws_name, token.row, token.column_fixed) == ('Sheet1!$A$1', 'Sheet1', 1, True)
+    assert token._value is token.token_value
+
+    token = tokens.FunctionToken(re.compile(tokens.FunctionToken.get_group_pattern()).match(line))
+    assert (token.src_value, token.token_value) == ('SUM', 'SUM')
+    assert not hasattr(token, '__dict__')
+
+
 def test_function_token():
     pattern = re.compile('(?P<%s>%s)' % (tokens.FunctionToken.__name__, tokens.FunctionToken.pattern))
 
@@ -43,3 +43,26 @@ def test_operations(parse, line, token_types):
 
     for c, token in zip(token_types, parsed_line):
         assert isinstance(token, c)
+
+
+@pytest.mark.parametrize(
+    ['line', 'token_types'],
+    (
+            ('1/12', [operands.SimpleOperand]),
+            ('2^10+-1', [operands.SimpleOperand]),
+            ('"Q"&"1"', [operands.SimpleOperand]),
+            ('SUM(1 + 2,2,4) * 5',
+             [operands.RPNOperand, operands.SimpleOperand, operands.SimpleOperand,
+              operations.FunctionOperation, operands.SimpleOperand, operations.ArithmeticOperation]),
+            ('1/0', [operands.SimpleOperand, operands.SimpleOperand, operations.ArithmeticOperation]),
+            ('A1*(2+3)', [operands.SingleCellOperand, operands.SimpleOperand, operations.ArithmeticOperation]),
+    )
+)
+def test_fold_constants(line, token_types):
+    parsed_line = Parser(fold_constants=True).to_rpn(Lexer().parse(line), None, None)
+    assert [type(token) for token in parsed_line] == token_types
+
+
+def test_unsupported_functions(parse):
+    assert parse('SUM(1,UNKNOWNFUNC(A1))+OTHER(2)').unsupported_functions == ['UNKNOWNFUNC', 'OTHER']
+    assert parse('SUM(1,2)').unsupported_functions == []
@@ -81,6 +81,9 @@ class ExcelMock(BaseExcelInterface):
     def _has_worksheet(self, ws_name):
         return ws_name in self.data
 
+    def _worksheet_names(self):
+        return list(self.data)
+
     def _has_named_range(self, name, ws_name):
         return name in self.named_ranges
 
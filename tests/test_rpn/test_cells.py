@@ -3,7 +3,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import pytest
 
-from efc.rpn_builder.parser.operands import BLANK_OPERAND, WorksheetNotExist
+from efc.rpn_builder.parser.operands import BLANK_OPERAND, CellAddress, RangeValues, WorksheetNotExist
 from .mock import ExcelMock, get_calculator
 
 
@@ -42,6 +42,18 @@ def test_cell_address(calc):
     assert calc('SUM([0]Sheet4!test2)', 'Yet another sheet').value == 34
 
 
+def test_range_values_block(calc):
+    block = calc('Sheet5!A1:C4', 'Yet another sheet').values_block
+    assert list(block) == ['', 16, None, 13, '', 18, None, 2, '', None, None, None]
+    assert block.tag == RangeValues.NUMBERS
+    assert block.blanks_count == 8
+
+    block = calc('Sheet6!A1:B4', 'Yet another sheet').values_block
+    assert block.tag == RangeValues.MIXED
+
+    assert calc('COUNTBLANK(Sheet5!B5:B6)', 'Yet another sheet').value == 2
+
+
 def test_single_cell_cache():
     # Cache disabled
     source = ExcelMock(use_cache=False)
@@ -79,3 +91,48 @@ def test_single_cell_cache():
     assert r[5] is not BLANK_OPERAND
     assert r[6] is BLANK_OPERAND
 
+
+
+def test_rpn_cache():
+    source = ExcelMock(use_cache=False, rpn_cache_size=2)
+
+    assert source._calc_formula('A3 + 1', 'Sheet 1').value == 5
+    assert source._calc_formula('A3 + 1', 'Sheet 1').value == 5
+    assert source._calc_formula('A3 + 1', 'Sheet4').value == 5
+    assert source.rpn_cache_info() == (1, 2, 2, 2)
+
+    # Cached formulas are not affected by already calculated values
+    source.data['Sheet 1'][3][1] = 10
+    assert source._calc_formula('A3 + 1', 'Sheet 1').value == 11
+
+    # The least recently used formula is evicted
+    assert source._calc_formula('SUM(A1:C1)', 'Sheet 1').value == 47
+    assert ('A3 + 1', 'Sheet4') not in source._rpn_cache
+    assert ('A3 + 1', 'Sheet 1') in source._rpn_cache
+    source.data['Sheet 1'][3][1] = 4
+
+    # Named ranges are parsed again from cached tokens
+    assert source._calc_formula('SUM(test2)', 'Sheet 1').value == 34
+    assert source._calc_formula('SUM(test2)', 'Sheet 1').value == 34
+
+    source = ExcelMock(rpn_cache_size=0)
+    assert source._calc_formula('A3 + 1', 'Sheet 1').value == 5
+    assert source.rpn_cache_info() is None
+
+
+def test_rpn_template():
+    source = ExcelMock(use_cache=True)
+
+    rpn = source._build_rpn('A1+$B$1*C1', 'Sheet4', CellAddress('Sheet4', 1, 4, False, False))
+    assert rpn.calc('Sheet4', source).value == 301
+    rpn = source._build_rpn('A2+$B$1*C2', 'Sheet4', CellAddress('Sheet4', 2, 4, False, False))
+    assert rpn.calc('Sheet4', source).value == 301
+    rpn = source._build_rpn('B3+$B$1*D3', 'Sheet4', CellAddress('Sheet4', 3, 5, False, False))
+    assert rpn.calc('Sheet4', source).value == 2
+    assert len(source._template_cache) == 1
+
+    rpn = source._build_rpn('SUM($A1:A3)', 'Sheet4', CellAddress('Sheet4', 1, 4, False, False))
+    assert rpn.calc('Sheet4', source).value == 30
+    rpn = source._build_rpn('SUM($A1:B3)', 'Sheet4', CellAddress('Sheet4', 1, 5, False, False))
+    assert rpn.calc('Sheet4', source).value == 64
+    assert len(source._template_cache) == 2
@@ -1,6 +1,12 @@
 import logging
 
-from efc.rpn_builder.parser.operands import ValueErrorOperand
+import pytest
+
+from efc import Lexer, Parser
+from efc.rpn_builder.errors import OperandsMissing
+from efc.rpn_builder.parser.functions import EXCEL_FUNCTIONS
+from efc.rpn_builder.parser.operands import ErrorOperand, FunctionNotSupported, ValueErrorOperand
+from tests.test_rpn.mock import ExcelMock
 
 
 def test_logging():
@@ -9,3 +15,79 @@ def test_logging():
         op.value
     except ValueErrorOperand:
         logging.exception('Error')
+
+
+def calc_result(formula, compiled, fold_constants=False):
+    source = ExcelMock()
+    rpn = Parser(fold_constants=fold_constants).to_rpn(Lexer().parse(formula), 'Sheet4', source)
+    try:
+        result = rpn.calc('Sheet4', source) if compiled else rpn.interpret('Sheet4', source)
+        if isinstance(result.value, list):
+            return type(result), [item.value for item in result.value]
+        return type(result), result.value
+    except ErrorOperand as err:
+        return type(err), err.ws_name, err.formula
+
+
+@pytest.mark.parametrize(
+    'formula',
+    (
+            '1+2*3-4/5',
+            '-A1+B2^2',
+            '"a"&A1&TRUE',
+            'SUM(A1:C3, 1, -2)/COUNT(A1:A3)',
+            'IF(A1>5, "big", 1/0)',
+            'IFERROR(1/0, 3)',
+            '1/0+2',
+            '"a"+1',
+            'SUM(A1:B2)',
+            'A1 B1',
+            '1 2',
+            'ROUND(AVERAGE(A1:C1)*1.5, 1)',
+            'MATCH(16,\'Sheet 1\'!A1:C1,0)',
+            '2^10/4&"x"',
+            'IF(1+1=2, -(3*2), "no")',
+    )
+)
+def test_compiled_rpn(formula):
+    assert calc_result(formula, compiled=True) == calc_result(formula, compiled=False)
+    assert calc_result(formula, compiled=True, fold_constants=True) == calc_result(formula, compiled=False)
+
+
+def test_compiled_rpn_errors():
+    source = ExcelMock()
+    rpn = Parser().to_rpn(Lexer().parse('1+UNKNOWNFUNC(2)'), 'Sheet4', source)
+    assert rpn.program is not None
+    with pytest.raises(FunctionNotSupported):
+        rpn.calc('Sheet4', source)
+
+    rpn = Parser().to_rpn(Lexer().parse('1+'), 'Sheet4', source)
+    assert rpn.program is None
+    with pytest.raises(OperandsMissing):
+        rpn.calc('Sheet4', source)
+
+    rpn = Parser().to_rpn(Lexer().parse('+'.join(['A1'] * 300)), 'Sheet4', source)
+    assert rpn.program is None
+    assert rpn.calc('Sheet4', source).value == 13 * 300
+
+
+def test_functions_resolved_while_parsing():
+    source = ExcelMock()
+    rpn = Parser().to_rpn(Lexer().parse('1+NEWFUNC(2)'), 'Sheet4', source)
+    assert rpn.unsupported_functions == ['NEWFUNC']
+    with pytest.raises(FunctionNotSupported):
+        rpn.calc('Sheet4', source)
+
+    # functions added later are found by formulas parsed after that
+    EXCEL_FUNCTIONS['NEWFUNC'] = lambda op: op.digit * 10
+    try:
+        with pytest.raises(FunctionNotSupported):
+            rpn.interpret('Sheet4', source)
+
+        rpn = Parser().to_rpn(Lexer().parse('1+NEWFUNC(2)'), 'Sheet4', source)
+        assert rpn.unsupported_functions == []
+        assert rpn.calc('Sheet4', source).value == 21
+        assert rpn.interpret('Sheet4', source).value == 21
+        assert rpn.offset(1, 1).calc('Sheet4', source).value == 21
+    finally:
+        del EXCEL_FUNCTIONS['NEWFUNC']
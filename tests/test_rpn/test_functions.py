@@ -7,14 +7,29 @@ from os.path import dirname, join
 import pytest
 from openpyxl import load_workbook
 from openpyxl.utils.cell import get_column_letter
+from six import string_types
 
+from efc.interfaces.base import CellInfo
 from efc.interfaces.iopenpyxl import OpenpyxlInterface
+from efc.rpn_builder.parser.functions import (
+    CriteriaIndex,
+    get_check_function,
+    get_lookup_index,
+    iter_mask,
+    mask_count,
+    positions_to_mask,
+    runs_to_mask,
+)
 from efc.rpn_builder.parser.operands import (
     BadReference,
+    CellAddress,
+    CellRangeOperand,
+    ErrorOperand,
     HyperlinkOperand,
     NotFoundErrorOperand,
     NumErrorOperand,
     RPNOperand,
+    SimpleOperand,
     ValueErrorOperand,
     ValueNotAvailable,
     ZeroDivisionErrorOperand,
@@ -220,6 +235,163 @@ def test_simple_MATCH(calc):
     assert calc('MATCH(13,Sheet4!A1:A3)', 'Yet another sheet').value == 2
 
 
+def test_exact_MATCH_index():
+    source = ExcelMock(use_cache=True)
+    calculator = get_calculator()
+
+    assert calculator('MATCH(13,Sheet4!A1:A3,0)', 'Sheet4', source).value == 1
+    assert calculator('MATCH(4,Sheet4!A1:A3,0)', 'Sheet4', source).value == 3
+    assert calculator('MATCH("",Sheet5!A1:A3,0)', 'Sheet4', source).value == 1
+    assert calculator('MATCH(0,Sheet5!A1:A3,0)', 'Sheet4', source).value == 3
+    assert calculator('MATCH("keklol",Sheet6!B1:B5,0)', 'Sheet4', source).value == 3
+    assert calculator('MATCH("0",Sheet6!B1:B5,0)', 'Sheet4', source).value == 4
+    with pytest.raises(NotFoundErrorOperand):
+        calculator('MATCH(5,Sheet4!A1:A3,0)', 'Sheet4', source).value
+    assert calculator('VLOOKUP(4,Sheet4!A1:C3,3,0)', 'Sheet4', source).value == 8
+    assert calculator('HLOOKUP(16,Sheet4!A1:C3,3,0)', 'Sheet4', source).value == 2
+
+    # the index of the changed range is built again
+    source.data = dict(ExcelMock.data, Sheet4={row: dict(cells) for row, cells in ExcelMock.data['Sheet4'].items()})
+    source.data['Sheet4'][2][1] = 5
+    source._caches.remove_cell('Sheet4', 2, 1)
+    assert calculator('MATCH(5,Sheet4!A1:A3,0)', 'Sheet4', source).value == 2
+    assert calculator('MATCH(4,Sheet4!A1:A3,0)', 'Sheet4', source).value == 3
+    assert calculator('VLOOKUP(5,Sheet4!A1:C3,3,0)', 'Sheet4', source).value == 18
+
+
+
+def test_approximate_MATCH_index():
+    indexed_source = ExcelMock(use_cache=True)
+    scan_source = ExcelMock()
+    calculator = get_calculator()
+
+    def match(formula, source):
+        try:
+            return calculator(formula, 'Sheet4', source).value
+        except ErrorOperand as err:
+            return type(err)
+
+    refs = ('Sheet4!A1:A3', 'Sheet5!A1:A3', 'Sheet5!C1:C3', 'Sheet6!A1:A5', 'Sheet6!B1:B5', 'TestUnique!A1:A10',
+            'TestUnique!B1:B10', 'TestUnique!C1:C10')
+    values = ('-1', '0', '1', '4', '7', '13', '15', '100', '""', '"0"', '"7"', '"B"', '"keklol"', 'TRUE')
+    for ref, value, match_type in product(refs, values, (1, -1)):
+        formula = 'MATCH(%s,%s,%d)' % (value, ref, match_type)
+        assert match(formula, indexed_source) == match(formula, scan_source), formula
+
+    # indexes follow the changed cell
+    data = dict(ExcelMock.data, Sheet4={row: dict(cells) for row, cells in ExcelMock.data['Sheet4'].items()})
+    data['Sheet4'][2][1] = 7
+    indexed_source.data = scan_source.data = data
+    indexed_source._caches.remove_cell('Sheet4', 2, 1)
+    for value, match_type in product(values, (1, -1)):
+        formula = 'MATCH(%s,Sheet4!A1:A3,%d)' % (value, match_type)
+        assert match(formula, indexed_source) == match(formula, scan_source), formula
+
+
+def test_ifs_criteria_index():
+    indexed_source = ExcelMock(use_cache=True)
+    scan_source = ExcelMock()
+    calculator = get_calculator()
+
+    refs = ('Sheet4!A1:C3', 'Sheet5!A1:C3', 'Sheet6!A1:B5', 'TestUnique!A1:D10')
+    criteria = ('13', '"13"', '"=13"', '"<>13"', '">=7"', '"<7"', '"<>"', '"="', '""', '"B"', '"<>B"', '">A"', '"<=B"',
+                '"0"', '"7"', 'Sheet5!B2', 'Sheet6!B4')
+    for ref, value in product(refs, criteria):
+        formula = 'COUNTIFS(%s,%s)' % (ref, value)
+        expected = calculator(formula, 'Sheet4', scan_source).value
+        assert calculator(formula, 'Sheet4', indexed_source).value == expected, formula
+
+    for value1, value2 in product(criteria[:8], criteria[8:]):
+        formula = 'COUNTIFS(TestUnique!A1:A10,%s,TestUnique!C1:C10,%s,TestUnique!B1:B10,7)' % (value1, value2)
+        expected = calculator(formula, 'Sheet4', scan_source).value
+        assert calculator(formula, 'Sheet4', indexed_source).value == expected, formula
+
+    assert calculator('SUMIFS(Sheet4!C1:C3,Sheet4!A1:A3,13,Sheet4!B1:B3,">2")', 'Sheet4', indexed_source).value == 36
+
+    index = CriteriaIndex(CellRangeOperand(1, 1, 10, 1, ws_name='TestUnique', source=indexed_source))
+    mask = positions_to_mask([2, 5, 7, 9, 10], 10)
+    for value in (7, '7', '>1', '<>7', ''):
+        check, expr = get_check_function(SimpleOperand(value))
+        assert index.find(check, expr, mask) == index.find(check, expr) & mask
+    assert index.estimate(*get_check_function(SimpleOperand(7))) == 3
+    assert index.estimate(*get_check_function(SimpleOperand('>7'))) == 10
+
+
+class CriteriaMock(ExcelMock):
+    data = {
+        'Criteria': {
+            1: {1: 1.5, 2: 7, 3: 'x'},
+            2: {1: '1.5', 2: '7', 3: 2},
+            3: {1: None, 2: True, 3: 0.5},
+            4: {1: 'x', 2: 1, 3: '1,5'},
+            5: {1: 0.5, 2: 'TRUE', 3: 1.5},
+        },
+        'Errors': {
+            1: {1: 1, 2: 1},
+            2: {1: '=1/0', 2: 2},
+        },
+    }
+
+    def _get_cell_info(self, address):
+        value = self.data[address.ws_name].get(address.row, {}).get(address.column)
+        if isinstance(value, string_types) and value.startswith('='):
+            return CellInfo(None, value[1:])
+        return CellInfo(value)
+
+
+def test_calc_all_default_formula_cells():
+    source = CriteriaMock(use_cache=True)
+    assert list(source._iter_formula_cells('Errors')) == [CellAddress('Errors', 2, 1, False, False)]
+    result = source.calc_all()
+    assert list(result) == ['Errors'] and list(result['Errors']) == ['A2']
+    assert isinstance(result['Errors']['A2'], ZeroDivisionErrorOperand)
+
+
+def test_ifs_criteria_index_parity():
+    indexed_source = CriteriaMock(use_cache=True)
+    calculator = get_calculator()
+
+    def calc_value(formula, source):
+        try:
+            return calculator(formula, 'Criteria', source).value
+        except ErrorOperand as err:
+            return type(err)
+
+    criteria = ('1.5', '"1.5"', '"=1,5"', '"<1.5"', '3/2', '1%', '7', '"7"', '1', 'TRUE', '0', 'FALSE', '"x"', '""',
+                '1/0', '"#DIV/0!"', 'Errors!A2', 'Criteria!A1')
+    ranges = ('Criteria!A1:A5', 'Criteria!B1:B5', 'Criteria!C1:C5', 'Errors!A1:B2')
+    # the same cached source calculates all formulas, so later ones use built indexes and cached results
+    for value1, value2 in product(criteria, repeat=2):
+        for ref1, ref2 in zip(ranges[:3], ranges[1:3] + ranges[:1]):
+            for formula in ('COUNTIFS(%s,%s,%s,%s)' % (ref1, value1, ref2, value2),
+                            'AVERAGEIFS(Criteria!C1:C5,%s,%s,%s,%s)' % (ref1, value1, ref2, value2)):
+                expected = calc_value(formula, CriteriaMock())
+                assert calc_value(formula, indexed_source) == expected, formula
+    for ref, value in product(ranges, criteria):
+        formula = 'SUMIFS(%s,%s,%s)' % (ref, ref, value)
+        assert calc_value(formula, indexed_source) == calc_value(formula, CriteriaMock()), formula
+
+
+def test_ifs_lazy_criteria_index():
+    source = ExcelMock(use_cache=True)
+    calculator = get_calculator()
+    formula = 'COUNTIFS(TestUnique!A1:A10,"Z",TestUnique!B1:B10,7)'
+    assert calculator(formula, 'Sheet4', source).value == 0
+    # the second range is not read after the criteria without matches
+    assert get_lookup_index(CellRangeOperand(1, 2, 10, 2, ws_name='TestUnique', source=source), CriteriaIndex,
+                            build=False) is None
+    assert get_lookup_index(CellRangeOperand(1, 1, 10, 1, ws_name='TestUnique', source=source), CriteriaIndex,
+                            build=False) is not None
+
+
+def test_ifs_mask():
+    mask = positions_to_mask([1, 3, 64, 65], 70)
+    assert list(iter_mask(mask)) == [1, 3, 64, 65]
+    assert mask_count(mask) == 4
+    assert list(iter_mask(positions_to_mask([], 0))) == []
+    assert runs_to_mask([(2, 3), (70, 70)], 70) == positions_to_mask([2, 3, 70], 70)
+
+
 def test_AVERAGE(calc):
     assert calc('AVERAGE(Sheet4!A1:B3)', 'Yet another sheet').value == 64 / 6
     assert calc('AVERAGEIFS(Sheet4!A1:B3,Sheet4!A1:B3,"13")', 'Yet another sheet').value == 13